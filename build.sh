@@ -13,5 +13,9 @@ python manage.py collectstatic --no-input
 # Aplica as migrações no banco de dados (PostgreSQL no Render)
 python manage.py migrate
 
+# Preenche o Resumo Diário de Vendas (Dashboard) só no primeiro deploy;
+# depois ele é mantido a cada venda (não reconstrói o histórico a cada deploy)
+python manage.py rebuild_sales_summary --if-empty
+
 # Cria o superusuário de forma segura, se ele não existir
 python manage.py shell -c "from django.contrib.auth import get_user_model; User = get_user_model(); User.objects.filter(username='${ADMIN_USER:-admin}').exists() or User.objects.create_superuser('${ADMIN_USER:-admin}', '${ADMIN_EMAIL:-admin@example.com}', '${ADMIN_PASS:-admin123}')"
\ No newline at end of file
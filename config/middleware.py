@@ -1,7 +1,9 @@
 from django.shortcuts import redirect
 from django.urls import reverse
 import threading
-from reports.models import CompanySettings
+from django.utils.functional import SimpleLazyObject
+from reports.theme import get_theme
+from core.audit import audit_buffer
 
 # Armazenamento local para thread
 _thread_locals = threading.local()
@@ -15,32 +17,21 @@ class LoginRequiredMiddleware:
 
     def __call__(self, request):
         # --- ÁREA DE PERSONALIZAÇÃO VISUAL (Dinâmica do Banco de Dados) ---
-        try:
-            # Tenta buscar as configurações salvas
-            settings = CompanySettings.objects.first()
-            if settings:
-                request.theme = {
-                    'primary_color': settings.primary_color,
-                    'secondary_color': settings.secondary_color,
-                    'background_color': settings.background_color,
-                    'card_bg': '#ffffff',
-                    'text_color': '#333333',
-                    'font_family': f"'{settings.font_family}', sans-serif",
-                    'font_size': f"{settings.font_size}px"
-                }
-            else:
-                raise Exception("Sem configuração")
-        except:
-            # Tema Padrão (Caso ocorra erro ou não tenha config)
-            request.theme = {
-                'primary_color': '#3498db', 'secondary_color': '#2c3e50',
-                'background_color': '#f4f6f9', 'card_bg': '#ffffff',
-                'text_color': '#333333', 'font_family': "'Poppins', sans-serif", 'font_size': '14px'
-            }
+        # Preguiçoso: o tema só é resolvido se um template ler 'request.theme'
+        # (APIs do PDV, estáticos e mídia não fazem nenhuma consulta de configuração).
+        request.theme = SimpleLazyObject(get_theme)
 
-        # Armazena o usuário atual na thread para uso em signals (logs)
+        # Armazena o usuário atual na thread para uso em signals (logs).
+        # Os registros de auditoria da requisição são gravados juntos no final (core/audit.py)
+        # e o usuário é limpo em seguida, para não "vazar" para o próximo uso da thread.
         _thread_locals.user = getattr(request, 'user', None)
+        try:
+            with audit_buffer():
+                return self.check_login(request)
+        finally:
+            _thread_locals.user = None
 
+    def check_login(self, request):
         # 1. Se o usuário já está logado, deixa passar
         if request.user.is_authenticated:
             return self.get_response(request)
@@ -123,6 +123,55 @@ DATABASES = {
     )
 }
 
+# Testes com SQLite em arquivo (e não em memória): o teste de concorrência do estoque
+# (sales.tests.GuardedStockConcurrencyTests) usa várias conexões ao mesmo tempo.
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['TEST'] = {'NAME': str(BASE_DIR / 'test_db.sqlite3')}
+
+# Cache compartilhado entre os workers do Gunicorn (mesma máquina).
+# Guarda as "versões" usadas para invalidar caches locais, como o de código de barras do PDV.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_DIR', str(BASE_DIR / '.cache')),
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
+# Cache de código de barras do PDV (por worker)
+POS_BARCODE_CACHE_SIZE = 2048     # Quantidade máxima de produtos em memória
+POS_BARCODE_NEGATIVE_TTL = 30     # Segundos que um EAN desconhecido fica marcado como "não encontrado"
+
+# Baixa de estoque no PDV (save_sale):
+#   'lock'    -> trava os produtos com SELECT FOR UPDATE (padrão; no SQLite a trava não existe)
+#   'guarded' -> baixa condicional sem trava (UPDATE ... WHERE estoque >= qtd), escala com vários caixas
+POS_CHECKOUT_MODE = os.environ.get('POS_CHECKOUT_MODE', 'lock')
+
+# Auditoria: grava os logs da requisição em uma thread separada (True) ou no fim da requisição (False)
+AUDIT_LOG_ASYNC = os.environ.get('AUDIT_LOG_ASYNC', 'False') == 'True'
+
+# Tempo máximo (segundos) dos KPIs do Dashboard no cache; gravações de vendas/despesas invalidam antes
+REPORTS_KPI_CACHE_TIMEOUT = 3600
+
+# Miniaturas das fotos de produto usadas no catálogo em PDF (geradas uma vez e reaproveitadas)
+THUMBNAIL_DIR = os.environ.get('THUMBNAIL_DIR', str(BASE_DIR / '.cache' / 'thumbnails'))
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 0)) or None # None = nº de CPUs
+
+# Exportação fiscal do período (ZIP): processos que geram os DANFE/XML que ainda não estão gravados.
+# O pool roda dentro da requisição, então o padrão é pequeno (limitado ao nº de CPUs); 1 = sem pool
+FISCAL_EXPORT_WORKERS = int(os.environ.get('FISCAL_EXPORT_WORKERS', 2))
+
+# Arquivos gerados em segundo plano (manage.py run_report_worker): horas até expirarem
+REPORT_JOB_TTL_HOURS = int(os.environ.get('REPORT_JOB_TTL_HOURS', 24))
+
+# Arquivos em geração: o worker dá sinal de vida a cada N segundos; sem sinal por
+# REPORT_JOB_STALE_MINUTES (worker caiu/reiniciou) o pedido volta para a fila
+REPORT_JOB_HEARTBEAT_SECONDS = int(os.environ.get('REPORT_JOB_HEARTBEAT_SECONDS', 30))
+REPORT_JOB_STALE_MINUTES = int(os.environ.get('REPORT_JOB_STALE_MINUTES', 5))
+
+# Importações em segundo plano: minutos sem avançar até uma importação 'running' ser retomada
+IMPORT_STALE_MINUTES = int(os.environ.get('IMPORT_STALE_MINUTES', 10))
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
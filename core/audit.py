@@ -0,0 +1,165 @@
+"""
+Auditoria em lote (AuditLog).
+
+Antes, cada save() de Venda/Produto/Cliente buscava o objeto de novo no banco
+só para comparar e gravava um AuditLog na hora (2 queries extras por registro).
+Agora:
+    1. O estado original vem do próprio objeto carregado do banco (AuditedModel.from_db).
+    2. Os registros ficam em um buffer e só entram no buffer se a transação
+       for confirmada (transaction.on_commit), como acontecia com o INSERT direto.
+    3. O buffer é gravado com um único bulk_create no fim da requisição
+       (ou do bloco 'audit_buffer()'); com settings.AUDIT_LOG_ASYNC = True a
+       gravação é feita por uma thread em segundo plano.
+
+Para cargas em massa (importações), 'audit_disabled()' desliga a auditoria.
+"""
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+
+class AuditedModel:
+    """
+    Mixin dos modelos auditados: guarda os valores lidos do banco (sem query extra),
+    usados pelo sinal de post_save para montar a descrição das alterações.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._audit_snapshot = dict(zip(field_names, values))
+        return instance
+
+def _audited_fields(instance):
+    # Mesmos campos do antigo model_to_dict: editáveis, sem ManyToMany (e sem campos adiados)
+    return [
+        f for f in instance._meta.concrete_fields
+        if f.editable and f.attname in instance.__dict__
+    ]
+
+def take_snapshot(instance):
+    """Atualiza o estado de referência após salvar (para o próximo save do mesmo objeto)."""
+    instance._audit_snapshot = {f.attname: instance.__dict__[f.attname] for f in _audited_fields(instance)}
+
+def describe_changes(instance):
+    """Texto 'campo: antigo ➔ novo' comparando com o estado lido do banco."""
+    old_state = getattr(instance, '_audit_snapshot', None)
+    if old_state is None:
+        return "Estado anterior não disponível"
+    diffs = []
+    for field in _audited_fields(instance):
+        if field.attname not in old_state:
+            continue
+        old_val = old_state[field.attname]
+        new_val = instance.__dict__[field.attname]
+        # Compara convertendo para string para evitar erros entre tipos (ex: Decimal vs Float)
+        if str(old_val) != str(new_val):
+            diffs.append(f"{field.name}: {old_val} ➔ {new_val}")
+    return ", ".join(diffs) if diffs else "Atualização sem alterações visíveis"
+
+def is_enabled():
+    return not getattr(_state, 'disabled', 0)
+
+@contextmanager
+def audit_disabled():
+    """Desliga a auditoria nesta thread (ex.: importação de milhares de produtos)."""
+    _state.disabled = getattr(_state, 'disabled', 0) + 1
+    try:
+        yield
+    finally:
+        _state.disabled -= 1
+
+@contextmanager
+def audit_buffer():
+    """
+    Acumula os registros de auditoria confirmados e grava todos de uma vez no final.
+    Usado pelo middleware (uma requisição = um bulk_create). Blocos aninhados
+    usam o buffer do bloco externo.
+    """
+    if getattr(_state, 'buffer', None) is not None:
+        yield
+        return
+    _state.buffer = []
+    try:
+        yield
+    finally:
+        entries, _state.buffer = _state.buffer, None
+        flush(entries)
+
+def record(**fields):
+    """
+    Registra uma entrada de auditoria (campos do AuditLog). A entrada só vale se
+    a transação atual for confirmada; fora de transação entra imediatamente.
+    """
+    if not is_enabled():
+        return
+    AuditLog = apps.get_model('sales', 'AuditLog')
+    transaction.on_commit(partial(_enqueue, AuditLog(**fields)))
+
+def record_bulk(user, model, created=(), updated=()):
+    """
+    Auditoria de gravações em lote (bulk_create/bulk_update não disparam post_save):
+    os mesmos registros do sinal audit_log_save, em nome do usuário informado.
+    """
+    model_name = model._meta.verbose_name.title()
+    for action, instances in (('CREATE', created), ('UPDATE', updated)):
+        for instance in instances:
+            changes = describe_changes(instance) if action == 'UPDATE' else ""
+            take_snapshot(instance)
+            if user is not None and user.is_authenticated:
+                record(
+                    user=user,
+                    model_name=model_name,
+                    object_id=str(instance.pk),
+                    object_repr=str(instance),
+                    action=action,
+                    changes=changes,
+                )
+
+def _enqueue(entry):
+    buffer = getattr(_state, 'buffer', None)
+    if buffer is None:
+        flush([entry]) # Sem buffer ativo (shell, comandos): grava na hora
+    else:
+        buffer.append(entry)
+
+def flush(entries):
+    if not entries:
+        return
+    if getattr(settings, 'AUDIT_LOG_ASYNC', False):
+        _writer().put(entries)
+    else:
+        apps.get_model('sales', 'AuditLog').objects.bulk_create(entries)
+
+# --- Gravação em segundo plano (opcional) ---
+_queue = None
+_queue_lock = threading.Lock()
+
+def _writer():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = queue.Queue()
+            threading.Thread(target=_write_forever, args=(_queue,), name='audit-log-writer', daemon=True).start()
+    return _queue
+
+def _write_forever(pending):
+    AuditLog = apps.get_model('sales', 'AuditLog')
+    while True:
+        entries = pending.get()
+        try:
+            AuditLog.objects.bulk_create(entries)
+        except Exception:
+            logger.exception("Falha ao gravar %s registros de auditoria", len(entries))
+        finally:
+            connection.close()
+            pending.task_done()
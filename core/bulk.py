@@ -0,0 +1,42 @@
+"""
+Gravação em lote usada pelos importadores (Produtos e Clientes).
+
+Um bulk_create + um bulk_update dentro de uma transação. Se o banco recusar algum
+registro (ex: valor maior que a coluna no PostgreSQL), o lote inteiro é desfeito
+e regravado um registro por vez, cada um no seu savepoint, para apontar quais
+linhas falharam sem perder as demais.
+
+bulk_create/bulk_update não chamam save() nem disparam sinais: campos calculados
+no save() (chaves de busca), 'updated_at' e a auditoria ficam a cargo de quem chama.
+"""
+from django.db import DatabaseError, transaction
+
+def save_in_bulk(model, to_create, to_update, fields, batch_size=500):
+    """Retorna (criados, atualizados, falhas), com falhas = [(objeto, erro)]."""
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(to_create, batch_size=batch_size)
+            if to_update:
+                model.objects.bulk_update(to_update, fields, batch_size=batch_size)
+        return list(to_create), list(to_update), []
+    except DatabaseError:
+        pass
+
+    created, updated, failed = [], [], []
+    for obj in to_create:
+        obj.pk = None # O bulk_create desfeito pode ter preenchido o ID
+        obj._state.adding = True
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([obj])
+            created.append(obj)
+        except DatabaseError as e:
+            failed.append((obj, e))
+    for obj in to_update:
+        try:
+            with transaction.atomic():
+                model.objects.bulk_update([obj], fields)
+            updated.append(obj)
+        except DatabaseError as e:
+            failed.append((obj, e))
+    return created, updated, failed
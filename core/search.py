@@ -0,0 +1,54 @@
+"""
+Utilitários de busca compartilhados pelos módulos (Clientes, Produtos e PDV).
+
+A ideia é guardar no banco uma "chave de busca" já normalizada (sem acentos,
+minúscula e sem pontuação) e consultar essa coluna diretamente, em vez de
+carregar a tabela inteira e normalizar cada registro em Python.
+"""
+import re
+import unicodedata
+
+def normalize_str(s):
+    """Remove acentos e coloca em minúsculo"""
+    if s is None: return ''
+    return ''.join(c for c in unicodedata.normalize('NFD', str(s)) if unicodedata.category(c) != 'Mn').lower()
+
+def build_search_key(*parts):
+    """
+    Monta a chave de busca persistida a partir de vários textos.
+    Exemplo: ('João da Silva', '123.456.789-00') -> 'joao da silva 12345678900'
+    """
+    text = ' '.join(normalize_str(p) for p in parts if p)
+    # Junta números separados por pontuação (CPF, CNPJ, EAN digitado com pontos)
+    text = re.sub(r'(?<=\d)[.\-/](?=\d)', '', text)
+    # Qualquer outro caractere que não seja letra/número vira separador
+    text = re.sub(r'[^0-9a-z]+', ' ', text)
+    return ' '.join(text.split())
+
+def filter_by_search_key(queryset, query, field='search_key'):
+    """
+    Filtra o queryset exigindo que todas as palavras da busca estejam na chave.
+    Retorna None se a busca não tiver nenhum termo útil.
+    """
+    key = build_search_key(query)
+    if not key:
+        return None
+    for token in key.split():
+        queryset = queryset.filter(**{f'{field}__contains': token})
+    return queryset
+
+def search_by_key(queryset, query, field='search_key', limit=10):
+    """
+    Busca em duas etapas, sempre com LIMIT:
+    1. Prefixo da chave (LIKE 'termo%'), que aproveita o índice da coluna.
+    2. Se faltar resultado, completa com as palavras em qualquer posição.
+    """
+    key = build_search_key(query)
+    if not key:
+        return []
+
+    results = list(queryset.filter(**{f'{field}__startswith': key}).order_by(field)[:limit])
+    if len(results) < limit:
+        remaining = filter_by_search_key(queryset, key, field).exclude(pk__in=[obj.pk for obj in results])
+        results += list(remaining.order_by(field)[:limit - len(results)])
+    return results
@@ -0,0 +1,15 @@
+"""
+Utilitários dos testes.
+
+Os testes que limpam ou dependem do cache (versões do catálogo, do tema e dos
+KPIs) usam um cache em memória próprio, e não o cache em disco do projeto
+(o do servidor ou do desenvolvedor), qualquer que seja o runner (manage.py
+test, python -m django test, pytest ou a IDE).
+"""
+from django.test import override_settings
+
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+def local_cache(test_class):
+    """Decorador de TestCase: cache em memória durante a classe de testes."""
+    return override_settings(CACHES=LOCAL_CACHES)(test_class)
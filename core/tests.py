@@ -1,3 +1,38 @@
+from django.core.cache import cache
+from django.db import transaction
 from django.test import TestCase
 
-# Create your tests here.
+from .testing import local_cache
+from .versioning import get_version, bump_version, bump_on_commit
+
+@local_cache
+class VersioningTests(TestCase):
+    KEY = 'tests:version'
+
+    def setUp(self):
+        cache.delete(self.KEY)
+
+    def test_bump_and_recreate(self):
+        version = get_version(self.KEY)
+        self.assertEqual(get_version(self.KEY), version)
+        bump_version(self.KEY)
+        self.assertEqual(get_version(self.KEY), version + 1)
+        cache.delete(self.KEY)
+        bump_version(self.KEY) # Chave apagada/expirada: recria com o relógio
+        self.assertNotEqual(get_version(self.KEY), version + 1)
+
+    def test_bump_on_commit(self):
+        version = get_version(self.KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_on_commit(self.KEY)
+            self.assertEqual(get_version(self.KEY), version) # Só após o commit
+        self.assertEqual(get_version(self.KEY), version + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    bump_on_commit(self.KEY)
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(get_version(self.KEY), version + 1) # Desfeito: não invalida
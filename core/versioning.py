@@ -0,0 +1,36 @@
+"""
+Números de versão guardados no cache compartilhado do Django.
+
+Caches locais de cada worker do Gunicorn (código de barras do PDV, tema) e
+entradas do cache compartilhado (KPIs do Dashboard) guardam junto a versão
+com que foram calculados. Para invalidar tudo em todos os processos basta
+incrementar a versão: o que tiver a versão antiga deixa de valer.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+def get_version(key):
+    """Versão atual da chave (criada na primeira leitura)."""
+    version = cache.get(key)
+    if version is None:
+        # Valor inicial baseado no relógio: se a chave expirar/for apagada,
+        # a nova versão nunca coincide com uma versão antiga ainda guardada.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+def bump_version(key):
+    """Incrementa a versão (invalida o que foi guardado com a anterior)."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+def bump_on_commit(key):
+    """
+    Incrementa a versão só depois do commit: uma gravação desfeita não invalida,
+    e quem ler antes do commit guarda o dado antigo na versão antiga.
+    """
+    transaction.on_commit(lambda: bump_version(key))
@@ -24,29 +24,10 @@ class CustomerForm(forms.ModelForm):
                 field.disabled = True
 
     def clean_cpf_cnpj(self):
-        cpf_cnpj = self.cleaned_data.get('cpf_cnpj', '')
-        if not cpf_cnpj:
-            return cpf_cnpj
-            
-        # Remove caracteres não numéricos para validar apenas os dígitos
-        numbers = re.sub(r'[^0-9]', '', cpf_cnpj)
-        
-        if len(numbers) == 11:
-            if not self.validate_cpf(numbers):
-                raise forms.ValidationError("CPF inválido.")
-            # Retorna formatado: 000.000.000-00
-            return f"{numbers[:3]}.{numbers[3:6]}.{numbers[6:9]}-{numbers[9:]}"
-            
-        elif len(numbers) == 14:
-            if not self.validate_cnpj(numbers):
-                raise forms.ValidationError("CNPJ inválido.")
-            # Retorna formatado: 00.000.000/0000-00
-            return f"{numbers[:2]}.{numbers[2:5]}.{numbers[5:8]}/{numbers[8:12]}-{numbers[12:]}"
-            
-        else:
-            raise forms.ValidationError("O documento deve ter 11 (CPF) ou 14 (CNPJ) dígitos.")
+        return normalize_cpf_cnpj(self.cleaned_data.get('cpf_cnpj', ''))
 
-    def validate_cpf(self, cpf):
+    @staticmethod
+    def validate_cpf(cpf):
         # Verifica tamanho e se todos os dígitos são iguais (ex: 111.111.111-11 é inválido)
         if len(cpf) != 11 or len(set(cpf)) == 1: return False
         
@@ -62,7 +43,8 @@ class CustomerForm(forms.ModelForm):
         
         return True
 
-    def validate_cnpj(self, cnpj):
+    @staticmethod
+    def validate_cnpj(cnpj):
         if len(cnpj) != 14 or len(set(cnpj)) == 1: return False
         
         def calculate_digit(digits, weights):
@@ -84,4 +66,30 @@ class CustomerForm(forms.ModelForm):
         digit2 = calculate_digit(digits[:13], weights2)
         if digit2 != digits[13]: return False
         
-        return True
\ No newline at end of file
+        return True
+
+def normalize_cpf_cnpj(cpf_cnpj):
+    """
+    Valida e formata o CPF/CNPJ (ValidationError se inválido).
+    Usado pelo formulário e pela importação de clientes.
+    """
+    if not cpf_cnpj:
+        return cpf_cnpj
+
+    # Remove caracteres não numéricos para validar apenas os dígitos
+    numbers = re.sub(r'[^0-9]', '', str(cpf_cnpj))
+
+    if len(numbers) == 11:
+        if not CustomerForm.validate_cpf(numbers):
+            raise forms.ValidationError("CPF inválido.")
+        # Retorna formatado: 000.000.000-00
+        return f"{numbers[:3]}.{numbers[3:6]}.{numbers[6:9]}-{numbers[9:]}"
+
+    elif len(numbers) == 14:
+        if not CustomerForm.validate_cnpj(numbers):
+            raise forms.ValidationError("CNPJ inválido.")
+        # Retorna formatado: 00.000.000/0000-00
+        return f"{numbers[:2]}.{numbers[2:5]}.{numbers[5:8]}/{numbers[8:12]}-{numbers[12:]}"
+
+    else:
+        raise forms.ValidationError("O documento deve ter 11 (CPF) ou 14 (CNPJ) dígitos.")
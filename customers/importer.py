@@ -0,0 +1,185 @@
+"""
+Importação de Clientes em lote (tela de Importação / ImportRun).
+
+Antes cada linha fazia um update_or_create (por ID, email ou nome): um SELECT,
+um INSERT/UPDATE e as queries do sinal de auditoria, linha por linha. Agora,
+para cada lote:
+    1. Os CPF/CNPJ do lote são validados e formatados de uma vez, com as mesmas
+       regras do cadastro (customers.forms.normalize_cpf_cnpj), antes de qualquer query.
+    2. Os clientes do lote são buscados em UMA query (ID, CPF/CNPJ, email ou nome)
+       e cada linha é ligada ao cliente pela ordem: ID > CPF/CNPJ > email > nome.
+    3. As gravações são um bulk_create + um bulk_update (core/bulk.py).
+Linhas que repetem no arquivo uma chave já usada (mesmo ID, CPF/CNPJ, email ou o
+mesmo cliente) são ignoradas e listadas nos erros.
+"""
+import itertools
+
+from django import forms
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core import audit
+from core.bulk import save_in_bulk
+from core.search import build_search_key
+from .forms import normalize_cpf_cnpj
+from .models import Customer
+
+IMPORT_BATCH_SIZE = 500
+
+KEY_LABELS = {'pk': 'ID', 'cpf_cnpj': 'CPF/CNPJ', 'email': 'e-mail', 'name': 'nome', 'customer': 'cliente'}
+
+def parse_row(row):
+    """Dados do cliente na linha (só os preenchidos, para não apagar o que já existe)."""
+    row_lower = {k.lower().strip(): v for k, v in row.items()}
+    pk = row_lower.get('id')
+    data = {
+        'name': row_lower.get('nome') or row_lower.get('name'),
+        'email': row_lower.get('email') or row_lower.get('e-mail'),
+        'phone': row_lower.get('telefone') or row_lower.get('phone'),
+        'cpf_cnpj': row_lower.get('cpf/cnpj') or row_lower.get('cpf') or row_lower.get('cnpj') or row_lower.get('documento'),
+    }
+    return {
+        'pk': Customer._meta.pk.to_python(pk) if pk not in (None, '') else None,
+        # Remove chaves vazias
+        'data': {k: v for k, v in data.items() if v},
+    }
+
+class CustomerImporter:
+    """Mesma interface do ProductImporter: run(linhas) ou import_batch(lote)."""
+
+    def __init__(self, user=None, batch_size=IMPORT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.success_count = 0
+        self.errors = []
+        self._seen = set() # (chave, valor) já usados por linhas anteriores do arquivo
+
+    def run(self, rows):
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                return self
+            self.import_batch(batch)
+
+    def import_batch(self, rows):
+        parsed = self._parse(rows)
+        if not parsed:
+            return
+        with transaction.atomic():
+            to_create, to_update, rows_of = self._apply(parsed)
+            if to_create or to_update:
+                self._write(to_create, to_update, rows_of)
+
+    def _parse(self, rows):
+        """Converte as linhas e valida todos os CPF/CNPJ do lote numa passada só."""
+        parsed = []
+        for row in rows:
+            try:
+                item = parse_row(row)
+                if 'cpf_cnpj' in item['data']:
+                    item['data']['cpf_cnpj'] = normalize_cpf_cnpj(item['data']['cpf_cnpj'])
+            except forms.ValidationError as e:
+                self.errors.append(f"Erro na linha {row}: {' '.join(e.messages)}")
+                continue
+            except Exception as e:
+                self.errors.append(f"Erro na linha {row}: {str(e)}")
+                continue
+            if not (item['pk'] is not None or item['data'].get('cpf_cnpj') or item['data'].get('email') or item['data'].get('name')):
+                self.errors.append(f"Linha ignorada por não conter ID, CPF/CNPJ, e-mail ou nome: {row}")
+                continue
+            parsed.append((row, item))
+        return parsed
+
+    def _duplicate(self, keys):
+        """Primeira chave da linha já usada por outra linha do arquivo (ou None). Registra as novas."""
+        for key in keys:
+            if key in self._seen:
+                return key
+        self._seen.update(keys)
+        return None
+
+    def _apply(self, parsed):
+        pks = {item['pk'] for _, item in parsed if item['pk'] is not None}
+        values = {field: {item['data'][field] for _, item in parsed if item['data'].get(field)} for field in ('cpf_cnpj', 'email', 'name')}
+        existing = Customer.objects.filter(
+            Q(pk__in=pks) | Q(cpf_cnpj__in=values['cpf_cnpj']) | Q(email__in=values['email']) | Q(name__in=values['name'])
+        ).order_by('pk')
+        by_id, by_doc, by_email, by_name = {}, {}, {}, {}
+        for customer in existing:
+            by_id[customer.pk] = customer
+            if customer.cpf_cnpj: by_doc[customer.cpf_cnpj] = customer
+            if customer.email: by_email.setdefault(customer.email, []).append(customer)
+            by_name.setdefault(customer.name, []).append(customer)
+
+        to_create, to_update, rows_of = [], {}, {}
+        for row, item in parsed:
+            data = item['data']
+            try:
+                customer = self._find(item, by_id, by_doc, by_email, by_name)
+
+                # Chaves da linha: ID/CPF/email sempre; o nome só quando é ele que identifica o cliente
+                keys = [(f, data[f]) for f in ('cpf_cnpj', 'email') if data.get(f)]
+                if item['pk'] is not None: keys.append(('pk', item['pk']))
+                if not keys: keys.append(('name', data['name']))
+                if customer is not None: keys.append(('customer', customer.pk))
+                duplicate = self._duplicate(keys)
+                if duplicate:
+                    field, value = duplicate
+                    label = f"{KEY_LABELS[field]} {value}" if field != 'customer' else f"cliente '{customer}'"
+                    raise ValueError(f"{label} repetido no arquivo (já usado em uma linha anterior)")
+
+                owner = by_doc.get(data.get('cpf_cnpj'))
+                if owner is not None and owner is not customer:
+                    raise ValueError(f"CPF/CNPJ {data['cpf_cnpj']} já pertence ao cliente '{owner}'")
+            except Exception as e:
+                self.errors.append(f"Erro na linha {row}: {str(e)}")
+                continue
+
+            if customer is not None: # Atualiza
+                for key, value in data.items():
+                    setattr(customer, key, value)
+                to_update.setdefault(customer.pk, (customer, set()))[1].update(data)
+            else: # Cria
+                customer = Customer(**data)
+                to_create.append(customer)
+            if customer.cpf_cnpj: by_doc[customer.cpf_cnpj] = customer
+            rows_of[id(customer)] = row
+            self.success_count += 1
+        return to_create, list(to_update.values()), rows_of
+
+    @staticmethod
+    def _find(item, by_id, by_doc, by_email, by_name):
+        """Cliente existente da linha: ID > CPF/CNPJ > email > nome (email/nome ambíguos são erro, como no update_or_create)."""
+        data = item['data']
+        if item['pk'] is not None and item['pk'] in by_id:
+            return by_id[item['pk']]
+        if data.get('cpf_cnpj') in by_doc:
+            return by_doc[data['cpf_cnpj']]
+        for field, index in (('email', by_email), ('name', by_name)):
+            if data.get(field):
+                matches = index.get(data[field], [])
+                if len(matches) > 1:
+                    raise ValueError(f"Mais de um cliente cadastrado com o {KEY_LABELS[field]} {data[field]}")
+                return matches[0] if matches else None
+        return None
+
+    def _write(self, to_create, to_update, rows_of):
+        now = timezone.now()
+        fields = {'search_key', 'updated_at'}
+        for customer in to_create:
+            customer.search_key = build_search_key(customer.name, customer.cpf_cnpj)
+        for customer, changed in to_update:
+            customer.search_key = build_search_key(customer.name, customer.cpf_cnpj)
+            customer.updated_at = now
+            fields |= changed
+        updated = [customer for customer, _ in to_update]
+
+        created, updated, failed = save_in_bulk(Customer, to_create, updated, sorted(fields), self.batch_size)
+        for customer, error in failed:
+            self.errors.append(f"Erro na linha {rows_of[id(customer)]}: {str(error)}")
+            self.success_count -= 1
+
+        # Auditoria (mesmos registros do sinal audit_log_save)
+        audit.record_bulk(self.user, Customer, created, updated)
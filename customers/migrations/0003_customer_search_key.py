@@ -0,0 +1,48 @@
+# Generated by Django 6.0.3 on 2026-10-17 02:53
+
+from django.db import migrations, models
+
+from core.search import build_search_key
+
+
+def fill_search_key(apps, schema_editor):
+    Customer = apps.get_model('customers', 'Customer')
+    customers = list(Customer.objects.only('id', 'name', 'cpf_cnpj'))
+    for customer in customers:
+        customer.search_key = build_search_key(customer.name, customer.cpf_cnpj)
+    Customer.objects.bulk_update(customers, ['search_key'], batch_size=500)
+
+
+def create_trigram_index(apps, schema_editor):
+    # No PostgreSQL (produção) o índice trigram acelera LIKE '%termo%'.
+    # No SQLite fica apenas o índice comum da coluna (busca por prefixo).
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS customers_customer_search_key_trgm '
+        'ON customers_customer USING gin (search_key gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS customers_customer_search_key_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0002_remove_customer_address_customer_city_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=300, verbose_name='Chave de Busca'),
+        ),
+        migrations.RunPython(fill_search_key, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
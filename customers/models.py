@@ -1,4 +1,6 @@
 from django.db import models
+from core.audit import AuditedModel
+from core.search import build_search_key
 
 class FragranceFamily(models.Model):
     name = models.CharField("Família Olfativa", max_length=50, unique=True)
@@ -10,7 +12,7 @@ class FragranceFamily(models.Model):
         verbose_name = "Família Olfativa"
         verbose_name_plural = "Famílias Olfativas"
 
-class Customer(models.Model):
+class Customer(AuditedModel, models.Model):
     CLASSIFICATION_CHOICES = [
         ('novo', 'Novo'),
         ('recorrente', 'Recorrente'),
@@ -40,9 +42,20 @@ class Customer(models.Model):
     loyalty_points = models.IntegerField("Pontos de Fidelidade", default=0)
     classification = models.CharField("Classificação", max_length=20, choices=CLASSIFICATION_CHOICES, default='novo')
     
+    # Busca rápida (PDV): nome + CPF/CNPJ normalizados, mantidos pelo save()
+    search_key = models.CharField("Chave de Busca", max_length=300, blank=True, editable=False, db_index=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def save(self, *args, **kwargs):
+        # Mantém a chave de busca sincronizada com o nome e o documento
+        self.search_key = build_search_key(self.name, self.cpf_cnpj)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'name', 'cpf_cnpj'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'search_key'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -1,3 +1,105 @@
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-# Create your tests here.
+from .forms import CustomerForm, normalize_cpf_cnpj
+from .importer import CustomerImporter
+from .models import Customer
+
+class CustomerSearchTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('caixa', password='123'))
+
+    def search(self, q):
+        return [c['name'] for c in self.client.get(reverse('customer_search_api'), {'q': q}).json()]
+
+    def test_search_key_kept_by_save(self):
+        customer = Customer.objects.create(name="João da Silva", phone="1", cpf_cnpj="529.982.247-25")
+        self.assertEqual(customer.search_key, 'joao da silva 52998224725')
+        customer.name = "João Souza"
+        customer.save(update_fields=['name'])
+        customer.refresh_from_db()
+        self.assertEqual(customer.search_key, 'joao souza 52998224725')
+
+    def test_api_accents_cpf_and_limit(self):
+        Customer.objects.create(name="José Antônio", phone="1", cpf_cnpj="529.982.247-25")
+        Customer.objects.create(name="Maria José", phone="2")
+        self.assertEqual(self.search('jose'), ['José Antônio', 'Maria José']) # Prefixo primeiro
+        self.assertEqual(self.search('ANTONIO'), ['José Antônio'])
+        self.assertEqual(self.search('529.982'), ['José Antônio'])
+        self.assertEqual(self.search('52998224725'), ['José Antônio'])
+        self.assertEqual(self.search('  '), [])
+
+        Customer.objects.bulk_create(Customer(name=f"Cliente {i}", phone=str(i), search_key=f"cliente {i}") for i in range(15))
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(len(self.search('cliente')), 10)
+        self.assertTrue(any('LIMIT 10' in q['sql'] for q in ctx.captured_queries))
+
+class CpfCnpjTests(TestCase):
+    def test_validators_are_static(self):
+        self.assertTrue(CustomerForm.validate_cpf('52998224725'))
+        self.assertFalse(CustomerForm.validate_cpf('52998224726'))
+        self.assertTrue(CustomerForm.validate_cnpj('11222333000181'))
+        self.assertEqual(normalize_cpf_cnpj('529.982.247-25'), '529.982.247-25')
+        self.assertEqual(normalize_cpf_cnpj(11222333000181), '11.222.333/0001-81')
+
+    def test_form_uses_same_rules(self):
+        form = CustomerForm(data={'name': 'Ana', 'phone': '1199', 'cpf_cnpj': '52998224726', 'loyalty_points': 0, 'classification': 'novo'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['cpf_cnpj'], ['CPF inválido.'])
+
+class CustomerImporterTests(TestCase):
+    def setUp(self):
+        self.ana = Customer.objects.create(name="Ana", phone="111", email="ana@x.com")
+        self.bia = Customer.objects.create(name="Bia", phone="222", cpf_cnpj="111.444.777-35")
+        Customer.objects.create(name="Homônimo", phone="333")
+        Customer.objects.create(name="Homônimo", phone="444")
+
+    def test_upsert_rules_and_errors(self):
+        importer = CustomerImporter().run([
+            {'Email': 'ana@x.com', 'Telefone': '999', 'CPF': '52998224725'},
+            {'cpf/cnpj': '11144477735', 'Nome': 'Beatriz'},
+            {'id': str(self.ana.pk), 'nome': 'Ana Maria'}, # Mesmo cliente da 1ª linha
+            {'nome': 'Carla', 'email': 'carla@x.com', 'cnpj': '11.222.333/0001-81'},
+            {'nome': 'Outra Carla', 'email': 'carla@x.com'}, # Email repetido no arquivo
+            {'nome': 'Dani', 'cpf': '123'},
+            {'nome': 'Homônimo', 'telefone': '555'},
+            {'nome': 'Eva', 'cpf': '111.444.777-35'}, # CPF já usado na 2ª linha
+            {'telefone': '000'},
+        ])
+        self.assertEqual(importer.success_count, 3)
+        self.assertEqual(len(importer.errors), 6)
+        errors = '\n'.join(importer.errors)
+        self.assertIn('O documento deve ter 11 (CPF) ou 14 (CNPJ) dígitos.', errors)
+        self.assertIn("cliente 'Ana' repetido no arquivo", errors)
+        self.assertIn('e-mail carla@x.com repetido no arquivo', errors)
+        self.assertIn('Mais de um cliente cadastrado com o nome Homônimo', errors)
+        self.assertIn('CPF/CNPJ 111.444.777-35 repetido no arquivo', errors)
+        self.assertIn("Linha ignorada por não conter ID, CPF/CNPJ, e-mail ou nome", errors)
+
+        self.ana.refresh_from_db()
+        self.assertEqual((self.ana.name, self.ana.phone, self.ana.cpf_cnpj), ('Ana', '999', '529.982.247-25'))
+        self.assertIn('52998224725', self.ana.search_key)
+        self.bia.refresh_from_db()
+        self.assertEqual(self.bia.name, 'Beatriz')
+        carla = Customer.objects.get(email='carla@x.com')
+        self.assertEqual((carla.name, carla.cpf_cnpj, carla.search_key), ('Carla', '11.222.333/0001-81', 'carla 11222333000181'))
+
+    def test_document_owned_by_other_customer(self):
+        importer = CustomerImporter().run([{'id': str(self.ana.pk), 'cpf': '111.444.777-35'}])
+        self.assertIn("já pertence ao cliente 'Bia'", importer.errors[0])
+        self.ana.refresh_from_db()
+        self.assertIsNone(self.ana.cpf_cnpj)
+
+    def test_query_count_does_not_depend_on_rows(self):
+        rows = [{'nome': f'Cliente {i}', 'email': f'c{i}@x.com', 'telefone': str(i)} for i in range(300)]
+        rows.append({'email': 'ana@x.com', 'telefone': '777'})
+        with CaptureQueriesContext(connection) as ctx:
+            importer = CustomerImporter(batch_size=1000).run(rows)
+        self.assertEqual((importer.success_count, importer.errors), (301, []))
+        # O SQLite divide o INSERT em blocos (limite de parâmetros); o resto é fixo por lote
+        other = [q for q in ctx.captured_queries if not q['sql'].startswith('INSERT INTO "customers_customer"')]
+        self.assertLessEqual(len(other), 6)
+        self.assertEqual(Customer.objects.filter(name__startswith='Cliente ').count(), 300)
@@ -1,9 +1,9 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
 from .forms import CustomerForm
 from .models import Customer, FragranceFamily
+from core.search import filter_by_search_key
 import unicodedata
 
 def normalize_str(s):
@@ -18,11 +18,10 @@ def get_common_context(request):
     customers = Customer.objects.all()
 
     if search_query:
-        # Filtra diretamente no banco de dados, que é muito mais rápido.
-        # __icontains é case-insensitive (ignora maiúsculas/minúsculas).
-        customers = customers.filter(
-            Q(name__icontains=search_query) | Q(cpf_cnpj__icontains=search_query)
-        )
+        # Filtra diretamente no banco pela chave normalizada (ignora acentos e maiúsculas)
+        filtered = filter_by_search_key(customers, search_query)
+        if filtered is not None:
+            customers = filtered
     return customers.order_by('-created_at')
 
 @login_required
@@ -0,0 +1,78 @@
+"""
+Cache de Código de Barras do PDV.
+
+Quando o caixa passa vários produtos no leitor, cada bipe vira uma requisição
+à API de busca. Este módulo guarda, em memória de cada worker, os dados do
+produto que não dependem do estoque (LRU com tamanho limitado), inclusive
+"não encontrado" por alguns segundos (cache negativo). O estoque é lido na hora,
+pela chave primária, então as vendas não invalidam o cache.
+
+A invalidação entre workers do Gunicorn é feita por um número de versão
+guardado no cache compartilhado do Django: alterações em Produto ou Composição
+de Kit (e entradas de estoque que mudam o custo médio) incrementam a versão
+após o commit, e as entradas antigas deixam de valer.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from core.versioning import get_version, bump_on_commit
+
+VERSION_KEY = 'pos:catalog_version'
+
+def get_catalog_version():
+    """Versão atual do catálogo (compartilhada entre os processos)."""
+    return get_version(VERSION_KEY)
+
+def bump_catalog_version():
+    """Invalida o cache de código de barras de todos os workers (após o commit)."""
+    bump_on_commit(VERSION_KEY)
+
+MISSING = object()
+
+class BarcodeCache:
+    """LRU local (por processo) de código de barras -> JSON do produto para o PDV."""
+
+    def __init__(self, maxsize=2048, negative_ttl=30):
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, barcode):
+        """
+        Retorna o JSON do produto, None se o código é sabidamente inexistente,
+        ou MISSING se não há informação válida no cache.
+        """
+        version = get_catalog_version()
+        with self._lock:
+            entry = self._entries.get(barcode)
+            if entry is None:
+                return MISSING
+            payload, entry_version, expires_at = entry
+            if entry_version != version or (expires_at and expires_at < time.monotonic()):
+                del self._entries[barcode]
+                return MISSING
+            self._entries.move_to_end(barcode)
+            return payload
+
+    def set(self, barcode, payload, version):
+        expires_at = None
+        if payload is None:
+            expires_at = time.monotonic() + self.negative_ttl
+        with self._lock:
+            self._entries[barcode] = (payload, version, expires_at)
+            self._entries.move_to_end(barcode)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+barcode_cache = BarcodeCache(
+    maxsize=getattr(settings, 'POS_BARCODE_CACHE_SIZE', 2048),
+    negative_ttl=getattr(settings, 'POS_BARCODE_NEGATIVE_TTL', 30),
+)
@@ -0,0 +1,290 @@
+"""
+Importação de Produtos em lote (planilha/CSV/JSON da tela de Importação).
+
+Antes, cada linha do arquivo fazia de 3 a 7 queries (get_or_create da marca e da
+família, exists() + get() do produto, save()) e disparava os sinais de cache e
+auditoria um a um. Com dezenas de milhares de linhas a requisição estourava o
+timeout. Agora, para cada lote de linhas:
+    1. Marcas e famílias olfativas ficam em mapas (nome em minúsculas) carregados
+       uma única vez; as que faltam são criadas com um bulk_create.
+    2. Os produtos do lote são buscados em UMA query (por ID, código de barras ou
+       nome) e indexados em memória pelas mesmas regras de antes.
+    3. As gravações são um bulk_create + um bulk_update, dentro de uma transação
+       (core/bulk.py); se o banco recusar algum registro, o erro vai para a linha.
+    4. Caches, KPIs e auditoria são tratados aqui, pois o bulk não dispara sinais.
+"""
+import itertools
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from core import audit
+from core.bulk import save_in_bulk
+from .cache import bump_catalog_version
+from .ledger import cost_price_changed
+from .models import Brand, OlfactoryFamily, Product
+
+IMPORT_BATCH_SIZE = 500
+
+def clean_decimal(val):
+    """Limpa valores monetários (Ex: "R$ 1.200,50" -> 1200.50)."""
+    if not val: return None
+    s = str(val).replace('R$', '').replace(' ', '').strip()
+    # Se tiver ponto e vírgula, assume formato BR (milhar.centena,decimal)
+    if ',' in s and '.' in s: s = s.replace('.', '').replace(',', '.')
+    elif ',' in s: s = s.replace(',', '.')
+    try: return Decimal(s)
+    except: return Decimal('0')
+
+def _clean_int(val):
+    return int(float(str(val).replace(',', '.')))
+
+def parse_row(row):
+    """
+    Converte uma linha do arquivo (cabeçalhos em português ou inglês) nos dados do produto.
+    Retorna None se a linha não tem nome; erros de conversão sobem como exceção.
+    """
+    row_lower = {k.lower().strip(): v for k, v in row.items()}
+
+    pk = row_lower.get('id')
+    pk = Product._meta.pk.to_python(pk) if pk not in (None, '') else None
+
+    barcode = row_lower.get('código de barras') or row_lower.get('codigo de barras') or row_lower.get('barcode')
+    barcode = (str(barcode).strip() or None) if barcode else None
+
+    name = row_lower.get('nome') or row_lower.get('name')
+    if not name:
+        return None
+
+    brand_name = row_lower.get('marca') or row_lower.get('brand')
+    family_name = row_lower.get('família olfativa') or row_lower.get('familia olfativa')
+
+    product_data = {
+        'name': name,
+        'line': row_lower.get('linha'),
+        'product_type': row_lower.get('tipo'),
+        'gender': (row_lower.get('gênero') or row_lower.get('genero') or '').upper(),
+        'top_notes': row_lower.get('notas de saída'),
+        'heart_notes': row_lower.get('notas de corpo'),
+        'base_notes': row_lower.get('notas de fundo'),
+        'description': row_lower.get('descrição') or row_lower.get('descricao'),
+        'volume': row_lower.get('volume'),
+        'barcode': barcode,
+        'batch_code': row_lower.get('lote'),
+        'expiration_date': row_lower.get('validade') or None,
+        'cost_price': clean_decimal(row_lower.get('preço de custo') or row_lower.get('preco de custo') or row_lower.get('custo')),
+        'selling_price': clean_decimal(row_lower.get('preço de venda') or row_lower.get('preco de venda') or row_lower.get('preço') or row_lower.get('price')),
+        'stock_quantity': row_lower.get('qtd. em estoque') or row_lower.get('qtd em estoque') or row_lower.get('estoque'),
+        'min_stock': row_lower.get('estoque mínimo') or row_lower.get('estoque minimo'),
+        'image_url': row_lower.get('url da imagem') or row_lower.get('imagem'),
+    }
+    if product_data['stock_quantity']: product_data['stock_quantity'] = _clean_int(product_data['stock_quantity'])
+    if product_data['min_stock']: product_data['min_stock'] = _clean_int(product_data['min_stock'])
+    if product_data['expiration_date']:
+        product_data['expiration_date'] = Product._meta.get_field('expiration_date').to_python(product_data['expiration_date'])
+
+    # Filtra valores nulos/vazios para não sobrescrever dados existentes com nada
+    return {
+        'pk': pk,
+        'barcode': barcode,
+        'name': name,
+        'brand': brand_name.strip() if brand_name else None,
+        'olfactory_family': family_name.strip() if family_name else None,
+        'data': {k: v for k, v in product_data.items() if v is not None and v != ''},
+    }
+
+class ProductImporter:
+    """
+    Aplica as linhas de um arquivo em lotes. Guarda os mapas de marcas/famílias
+    entre os lotes, e o total de linhas gravadas e os erros (mesmas mensagens da tela).
+    """
+
+    def __init__(self, user=None, batch_size=IMPORT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.success_count = 0
+        self.errors = []
+        self._brands = None
+        self._families = None
+        self._default_brand = None
+
+    def run(self, rows):
+        """Importa todas as linhas (qualquer iterável), um lote por transação."""
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                return self
+            self.import_batch(batch)
+
+    def import_batch(self, rows):
+        parsed = []
+        for row in rows:
+            try:
+                item = parse_row(row)
+            except Exception as e:
+                self.errors.append(f"Erro na linha {row}: {str(e)}")
+                continue
+            if item is None:
+                self.errors.append(f"Linha ignorada por não conter 'Nome': {row}")
+                continue
+            parsed.append((row, item))
+        if not parsed:
+            return
+
+        with transaction.atomic():
+            brands = self._resolve(Brand, 'brand', parsed)
+            families = self._resolve(OlfactoryFamily, 'olfactory_family', parsed)
+            to_create, to_update, rows_of = self._apply(parsed, brands, families)
+            if to_create or to_update:
+                self._write(to_create, to_update, rows_of)
+
+    # --- Marcas e famílias ---
+
+    def _resolve(self, model, key, parsed):
+        """Mapa {nome em minúsculas: objeto}, criando de uma vez os nomes que faltam."""
+        cache_attr = '_brands' if model is Brand else '_families'
+        known = getattr(self, cache_attr)
+        if known is None:
+            # Em nomes repetidos com caixa diferente, vale o mais antigo (como o get_or_create com iexact)
+            known = {obj.name.lower(): obj for obj in model.objects.order_by('-pk')}
+            setattr(self, cache_attr, known)
+        missing = {}
+        for _, item in parsed:
+            name = item[key]
+            if name and name.lower() not in known:
+                missing.setdefault(name.lower(), name)
+        if missing:
+            model.objects.bulk_create([model(name=name) for name in missing.values()], ignore_conflicts=True)
+            for obj in model.objects.filter(name__in=missing.values()):
+                known.setdefault(obj.name.lower(), obj)
+        return known
+
+    def _get_default_brand(self):
+        if self._default_brand is None:
+            self._default_brand, _ = Brand.objects.get_or_create(name="Geral")
+        return self._default_brand
+
+    # --- Produtos ---
+
+    def _apply(self, parsed, brands, families):
+        """Localiza o produto de cada linha (ID > código de barras > nome + marca) e aplica os dados."""
+        ids = {item['pk'] for _, item in parsed if item['pk'] is not None}
+        barcodes = {item['barcode'] for _, item in parsed if item['barcode']}
+        names = {item['name'] for _, item in parsed}
+        existing = (
+            Product.objects.select_related('brand')
+            .alias(lname=Lower('name'))
+            .filter(Q(pk__in=ids) | Q(barcode__in=barcodes) | Q(name__in=names) | Q(lname__in={n.lower() for n in names}))
+            .order_by('pk')
+        )
+        by_id, by_barcode, by_name = {}, {}, {}
+        for product in existing:
+            by_id[product.pk] = product
+            self._index(product, by_barcode, by_name)
+
+        to_create, to_update, rows_of = [], {}, {}
+        for row, item in parsed:
+            data = dict(item['data'])
+            brand = brands.get(item['brand'].lower()) if item['brand'] else None
+            family = families.get(item['olfactory_family'].lower()) if item['olfactory_family'] else None
+            if brand: data['brand'] = brand
+            if family: data['olfactory_family'] = family
+
+            product = None
+            if item['pk'] is not None and item['pk'] in by_id:
+                product = by_id[item['pk']]
+            elif item['barcode'] and item['barcode'] in by_barcode:
+                product = by_barcode[item['barcode']]
+            else:
+                candidates = by_name.get(item['name'].lower(), [])
+                if brand:
+                    candidates = [p for p in candidates if p.brand_id == brand.pk]
+                product = candidates[0] if candidates else None
+
+            try:
+                barcode = data.get('barcode')
+                owner = by_barcode.get(barcode) if barcode else None
+                if owner is not None and owner is not product:
+                    raise ValueError(f"Código de barras {barcode} já pertence ao produto '{owner.name}'")
+
+                if product: # Atualiza
+                    self._unindex(product, by_barcode, by_name)
+                    for key, value in data.items():
+                        setattr(product, key, value)
+                    self._index(product, by_barcode, by_name)
+                    if product.pk is not None:
+                        to_update.setdefault(product.pk, (product, set()))[1].update(data)
+                elif data.get('selling_price'): # Cria
+                    # Garante campos obrigatórios para criação
+                    if 'brand' not in data:
+                        data['brand'] = self._get_default_brand()
+                    data.setdefault('cost_price', 0)
+                    data.setdefault('volume', 'N/A')
+                    product = Product(**data)
+                    self._index(product, by_barcode, by_name)
+                    to_create.append(product)
+                else:
+                    continue # Sem cadastro e sem preço de venda: ignorada, como antes
+            except Exception as e:
+                self.errors.append(f"Erro na linha {row}: {str(e)}")
+                continue
+            rows_of.setdefault(id(product), []).append(row)
+            self.success_count += 1
+        return to_create, list(to_update.values()), rows_of
+
+    @staticmethod
+    def _index(product, by_barcode, by_name):
+        if product.barcode:
+            by_barcode[product.barcode] = product
+        by_name.setdefault(product.name.lower(), []).append(product)
+
+    @staticmethod
+    def _unindex(product, by_barcode, by_name):
+        if product.barcode and by_barcode.get(product.barcode) is product:
+            del by_barcode[product.barcode]
+        same_name = by_name.get(product.name.lower(), [])
+        if product in same_name:
+            same_name.remove(product)
+
+    def _write(self, to_create, to_update, rows_of):
+        now = timezone.now()
+        fields = {'search_text', 'updated_at'}
+        for product in to_create:
+            product.search_text = product.build_search_text()
+        for product, changed in to_update:
+            product.search_text = product.build_search_text()
+            product.updated_at = now
+            fields |= changed
+        updated = [product for product, _ in to_update]
+        fields = sorted(fields)
+
+        created, updated, failed = save_in_bulk(Product, to_create, updated, fields, self.batch_size)
+        # Registros recusados pelo banco: erro em cada linha que os alterou
+        for product, error in failed:
+            for row in rows_of.get(id(product), []):
+                self.errors.append(f"Erro na linha {row}: {str(error)}")
+                self.success_count -= 1
+
+        self._after_write(created, updated)
+
+    def _after_write(self, created, updated):
+        """O que os sinais de post_save/pre_save fariam em cada save()."""
+        if not created and not updated:
+            return
+        # Cache de código de barras do PDV
+        bump_catalog_version()
+
+        # Mesmo sinal das entradas de estoque para quem acompanha o preço de custo
+        cost_changed = [
+            p.pk for p in updated
+            if getattr(p, '_audit_snapshot', {}).get('cost_price') != p.cost_price
+        ]
+        if cost_changed:
+            cost_price_changed.send(sender=Product, product_ids=cost_changed)
+
+        # Auditoria (mesmos registros do sinal audit_log_save)
+        audit.record_bulk(self.user, Product, created, updated)
@@ -0,0 +1,164 @@
+"""
+Livro de Estoque: ponto único para lançar movimentações (entradas e saídas).
+
+Em vez de ler o produto, alterar o saldo em Python e chamar product.save() para
+cada movimentação (lento e sujeito a corrida entre caixas), aqui tudo é feito
+em uma transação:
+    1. Um único UPDATE para todos os produtos envolvidos, com expressões F()
+       (o banco soma/subtrai sobre o valor atual, sem ler antes).
+    2. O Preço Médio Ponderado das entradas calculado no próprio SQL.
+    3. Um único INSERT (bulk_create) das movimentações.
+    4. Os produtos já carregados nas movimentações recebem o saldo e o custo novos
+       (uma consulta), para quem usar a instância depois não gravar valores antigos.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.dispatch import Signal
+from django.db.models import Case, When, F, Func, Q, Value, IntegerField, DecimalField, ExpressionWrapper
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .models import Product, StockMovement
+
+# Enviado quando um lançamento altera o preço médio de custo (UPDATE em lote não dispara post_save).
+# Argumento: product_ids.
+cost_price_changed = Signal()
+
+class OutOfStock(Exception):
+    """
+    Saldo insuficiente detectado pela baixa condicional (modo 'guarded').
+    Não consulta o banco (a transação está sendo desfeita): quem trata o erro
+    busca nome e saldo atual depois do rollback, se quiser exibi-los.
+    """
+
+    def __init__(self, product_id, requested):
+        self.product_id = product_id
+        self.requested = requested
+        super().__init__(f"Estoque insuficiente para o produto #{product_id} (pedido: {requested}).")
+
+def _guarded_decrement(deltas):
+    """
+    Baixa condicional, sem trava de linha (SELECT FOR UPDATE):
+        UPDATE produto SET estoque = estoque - q WHERE id = ? AND estoque >= q
+    Se nenhuma linha for alterada, o saldo acabou (outro caixa vendeu antes).
+    Os produtos são processados sempre na mesma ordem (id) para evitar deadlock.
+    """
+    now = timezone.now()
+    for pk in sorted(pk for pk, delta in deltas.items() if delta < 0):
+        quantity = -deltas.pop(pk)
+        updated = Product.objects.filter(pk=pk, stock_quantity__gte=quantity).update(
+            stock_quantity=F('stock_quantity') - quantity,
+            updated_at=now,
+        )
+        if not updated:
+            raise OutOfStock(pk, quantity)
+
+def _refresh_products(movements):
+    """Atualiza em memória saldo/custo dos produtos já carregados (movement.product)."""
+    loaded = {}
+    for movement in movements:
+        if StockMovement.product.is_cached(movement):
+            loaded.setdefault(movement.product_id, []).append(movement.product)
+    if not loaded:
+        return
+    fields = ('stock_quantity', 'cost_price', 'updated_at')
+    for values in Product.objects.filter(pk__in=loaded).values('pk', *fields):
+        for product in loaded[values['pk']]:
+            snapshot = getattr(product, '_audit_snapshot', {}) # Estado "lido do banco" da auditoria
+            for field in fields:
+                setattr(product, field, values[field])
+                if field in snapshot:
+                    snapshot[field] = values[field]
+
+def post_movements(movements, guarded=False, insert=None):
+    """
+    Lança uma lista de StockMovement (ainda não salvos) e atualiza o estoque.
+    Retorna a mesma lista, já com as chaves primárias preenchidas.
+
+    insert: função que grava as movimentações (padrão: um único bulk_create).
+    StockMovement.save() passa o save() do próprio model, que dispara post_save.
+
+    guarded=True: os produtos com saída líquida só são baixados se houver saldo
+    (ver _guarded_decrement). Sem saldo, levanta OutOfStock e a transação é desfeita.
+    Pensado para as saídas de venda (o custo médio de entradas no mesmo lote não é recalculado).
+
+    Preço médio: as entradas com 'entry_cost' de um mesmo produto são somadas e
+    aplicadas sobre o saldo do produto no momento do lançamento:
+        (Qtd Atual * Custo Atual + Σ Qtd Nova * Custo Novo) / (Qtd Atual + Σ Qtd Nova)
+    """
+    movements = [m for m in movements if m.pk is None]
+    if not movements:
+        return []
+
+    deltas = {}          # product_id -> variação de saldo
+    entries = {}         # product_id -> [qtd com custo, valor total das entradas]
+    for movement in movements:
+        quantity = int(movement.quantity)
+        if movement.movement_type == 'E':
+            deltas[movement.product_id] = deltas.get(movement.product_id, 0) + quantity
+            if movement.entry_cost is not None and quantity > 0:
+                entry = entries.setdefault(movement.product_id, [0, Decimal('0')])
+                entry[0] += quantity
+                entry[1] += Decimal(quantity) * Decimal(movement.entry_cost)
+        else:
+            deltas[movement.product_id] = deltas.get(movement.product_id, 0) - quantity
+
+    with transaction.atomic():
+        if guarded:
+            _guarded_decrement(deltas)
+        if deltas:
+            _apply_deltas(deltas, entries)
+        if insert is None:
+            StockMovement.objects.bulk_create(movements)
+        else:
+            insert(movements)
+        _refresh_products(movements)
+        if entries:
+            # Depois do INSERT: quem recebe o sinal já vê as movimentações gravadas
+            cost_price_changed.send(sender=Product, product_ids=list(entries))
+            # O cache do PDV guarda o custo (não o estoque, lido na hora): só entradas com custo invalidam
+            bump_catalog_version()
+    return movements
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+class _Divide(Func):
+    """
+    Divisão decimal (valor total / quantidade). O SQLite não tem tipo decimal e
+    guarda '40.00' como o inteiro 40: lá 'inteiro / inteiro' trunca (900 / 13 = 69),
+    então o numerador é promovido a real só nesse banco.
+    """
+    arg_joiner = ' / '
+    template = '(%(expressions)s)'
+    output_field = DecimalField(max_digits=14, decimal_places=4)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, arg_joiner=' * 1.0 / ', **extra_context)
+
+def _apply_deltas(deltas, entries):
+    """Um único UPDATE (CASE por produto) para saldo e preço médio."""
+    changes = {
+        'stock_quantity': Case(
+            *[When(pk=pk, then=F('stock_quantity') + delta) for pk, delta in deltas.items()],
+            default=F('stock_quantity'),
+            output_field=IntegerField(),
+        ),
+        'updated_at': timezone.now(),
+    }
+    if entries:
+        # Valor do estoque atual + valor das entradas, tudo em decimal
+        current_value = ExpressionWrapper(F('stock_quantity') * F('cost_price'), output_field=MONEY)
+        changes['cost_price'] = Case(
+            *[
+                When(
+                    Q(pk=pk) & Q(stock_quantity__gt=-qty),
+                    then=Round(_Divide(current_value + Value(value, output_field=MONEY), F('stock_quantity') + Value(qty)), 2),
+                )
+                for pk, (qty, value) in entries.items()
+            ],
+            default=F('cost_price'),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+    Product.objects.filter(pk__in=deltas.keys()).update(**changes)
@@ -0,0 +1,48 @@
+# Generated by Django 6.0.3 on 2026-10-17 02:54
+
+from django.db import migrations, models
+
+from core.search import build_search_key
+
+
+def fill_search_text(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    products = list(Product.objects.select_related('brand'))
+    for product in products:
+        brand_name = product.brand.name if product.brand else ''
+        product.search_text = build_search_key(product.name, brand_name, product.line, product.volume, product.barcode)
+    Product.objects.bulk_update(products, ['search_text'], batch_size=500)
+
+
+def create_trigram_index(apps, schema_editor):
+    # Mesmo esquema da busca de clientes: trigram no PostgreSQL, índice comum no SQLite.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS products_product_search_text_trgm '
+        'ON products_product USING gin (search_text gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS products_product_search_text_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_stockmovement_entry_cost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_text',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=600, verbose_name='Texto de Busca'),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
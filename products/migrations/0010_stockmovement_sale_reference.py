@@ -0,0 +1,34 @@
+# Generated by Django 6.0.3 on 2026-10-17 02:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_search_text'),
+        ('sales', '0005_auditlog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockmovement',
+            name='sale',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='sales.sale', verbose_name='Venda'),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='sale_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='sales.saleitem', verbose_name='Item da Venda'),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='source',
+            field=models.CharField(choices=[('manual', 'Ajuste Manual'), ('purchase', 'Compra / Entrada'), ('sale', 'Venda'), ('sale_pending', 'Reserva de Venda Pendente'), ('sale_edit', 'Edição de Venda'), ('sale_reversal', 'Estorno de Venda'), ('item_removal', 'Remoção de Item da Venda')], default='manual', max_length=20, verbose_name='Origem'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['sale', 'source'], name='stockmov_sale_source_idx'),
+        ),
+    ]
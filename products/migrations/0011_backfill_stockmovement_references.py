@@ -0,0 +1,69 @@
+# Generated by Django 6.0.3 on 2026-10-17 03:05
+
+import re
+
+from django.db import migrations
+
+# Formatos de 'reason' gravados pelas versões anteriores do sistema
+REASON_PATTERNS = [
+    (re.compile(r'^Venda Kit Pendente #(\d+) \((.*)\)$'), 'sale_pending', True),
+    (re.compile(r'^Venda Pendente #(\d+)$'), 'sale_pending', False),
+    (re.compile(r'^Venda Kit #(\d+) \((.*)\)$'), 'sale', True),
+    (re.compile(r'^Venda #(\d+)$'), 'sale', False),
+    (re.compile(r'^Edição Venda #(\d+)$'), 'sale_edit', False),
+    (re.compile(r'^Estorno/Exclusão Venda #(\d+)$'), 'sale_reversal', False),
+    (re.compile(r'^Remoção de item da Venda #(\d+)$'), 'item_removal', False),
+]
+
+
+def backfill_references(apps, schema_editor):
+    StockMovement = apps.get_model('products', 'StockMovement')
+    Sale = apps.get_model('sales', 'Sale')
+    SaleItem = apps.get_model('sales', 'SaleItem')
+
+    existing_sales = set(Sale.objects.values_list('id', flat=True))
+    # Itens por venda: (sale_id, product_id) -> item_id e (sale_id, nome do kit) -> item_id
+    items_by_product = {}
+    items_by_name = {}
+    for item_id, sale_id, product_id, product_name in SaleItem.objects.values_list('id', 'sale_id', 'product_id', 'product__name'):
+        items_by_product.setdefault((sale_id, product_id), item_id)
+        items_by_name.setdefault((sale_id, product_name), item_id)
+
+    batch = []
+    for movement_id, product_id, reason in list(StockMovement.objects.values_list('id', 'product_id', 'reason')):
+        reason = (reason or '').strip()
+        source = 'purchase' if reason.startswith('Compra') else 'manual'
+        sale_id = item_id = None
+
+        for pattern, pattern_source, is_kit in REASON_PATTERNS:
+            match = pattern.match(reason)
+            if not match:
+                continue
+            source = pattern_source
+            sale_id = int(match.group(1))
+            if sale_id not in existing_sales:
+                sale_id = None
+            elif is_kit:
+                item_id = items_by_name.get((sale_id, match.group(2)))
+            elif source in ['sale', 'sale_pending', 'sale_edit']:
+                item_id = items_by_product.get((sale_id, product_id))
+            break
+
+        batch.append(StockMovement(id=movement_id, source=source, sale_id=sale_id, sale_item_id=item_id))
+        if len(batch) >= 2000:
+            StockMovement.objects.bulk_update(batch, ['source', 'sale', 'sale_item'])
+            batch = []
+
+    if batch:
+        StockMovement.objects.bulk_update(batch, ['source', 'sale', 'sale_item'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_stockmovement_sale_reference'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_references, migrations.RunPython.noop),
+    ]
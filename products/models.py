@@ -1,6 +1,9 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from datetime import date
-from decimal import Decimal
+from core.audit import AuditedModel
+from core.search import build_search_key
 
 class Category(models.Model):
     name = models.CharField("Categoria", max_length=100, unique=True)
@@ -28,6 +31,19 @@ class Supplier(models.Model):
 class Brand(models.Model):
     name = models.CharField("Marca", max_length=100, unique=True)
     
+    def save(self, *args, **kwargs):
+        old_name = None
+        if self.pk:
+            old_name = Brand.objects.filter(pk=self.pk).values_list('name', flat=True).first()
+        super().save(*args, **kwargs)
+        # Renomear a marca altera a chave de busca de todos os produtos dela
+        if old_name is not None and old_name != self.name:
+            products = list(self.product_set.all())
+            for product in products:
+                product.brand = self
+                product.search_text = product.build_search_text()
+            Product.objects.bulk_update(products, ['search_text'], batch_size=500)
+
     def __str__(self):
         return self.name
     
@@ -45,7 +61,7 @@ class OlfactoryFamily(models.Model):
         verbose_name = "Família Olfativa"
         verbose_name_plural = "Famílias Olfativas"
 
-class Product(models.Model):
+class Product(AuditedModel, models.Model):
     GENDER_CHOICES = [
         ('M', 'Masculino'),
         ('F', 'Feminino'),
@@ -93,9 +109,24 @@ class Product(models.Model):
     image = models.ImageField("Imagem", upload_to='products/', blank=True, null=True)
     image_url = models.URLField("URL da Imagem", max_length=500, blank=True, null=True, help_text="Cole um link de imagem da internet (opcional)")
     
+    # Índice de busca (nome + marca + linha + volume + código), mantido pelo save()
+    search_text = models.CharField("Texto de Busca", max_length=600, blank=True, editable=False, db_index=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def build_search_text(self):
+        brand_name = self.brand.name if self.brand_id else ''
+        return build_search_key(self.name, brand_name, self.line, self.volume, self.barcode)
+
+    def save(self, *args, **kwargs):
+        # Mantém o índice de busca sincronizado a cada gravação (cadastro, edição, importação)
+        self.search_text = self.build_search_text()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'name', 'brand', 'line', 'volume', 'barcode'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'search_text'}
+        super().save(*args, **kwargs)
+
     @property
     def profit_margin(self):
         """Calcula a margem de lucro bruta (%)"""
@@ -128,36 +159,38 @@ class StockMovement(models.Model):
         ('S', 'Saída'),
     ]
     
+    SOURCE_CHOICES = [
+        ('manual', 'Ajuste Manual'),
+        ('purchase', 'Compra / Entrada'),
+        ('sale', 'Venda'),
+        ('sale_pending', 'Reserva de Venda Pendente'),
+        ('sale_edit', 'Edição de Venda'),
+        ('sale_reversal', 'Estorno de Venda'),
+        ('item_removal', 'Remoção de Item da Venda'),
+    ]
+    # Origens que representam a baixa inicial de uma venda (usadas para evitar baixa duplicada)
+    SALE_DEDUCTION_SOURCES = ['sale', 'sale_pending']
+    
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="Produto")
     quantity = models.IntegerField("Quantidade")
     movement_type = models.CharField("Tipo", max_length=1, choices=MOVEMENT_TYPES)
     reason = models.CharField("Motivo", max_length=255, blank=True, null=True, help_text="Ex: Compra, Venda, Decant, Quebra")
     entry_cost = models.DecimalField("Custo de Entrada (Unitário)", max_digits=10, decimal_places=2, null=True, blank=True, help_text="Preencha apenas para recalcular o preço médio na entrada.")
+
+    # Referências estruturadas (substituem a busca por '#ID' dentro do texto do motivo)
+    source = models.CharField("Origem", max_length=20, choices=SOURCE_CHOICES, default='manual')
+    sale = models.ForeignKey('sales.Sale', on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements', verbose_name="Venda")
+    sale_item = models.ForeignKey('sales.SaleItem', on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements', verbose_name="Item da Venda")
     created_at = models.DateTimeField(auto_now_add=True)
 
     def save(self, *args, **kwargs):
-        # Atualiza o estoque do produto automaticamente na criação
+        # Na criação, o lançamento passa pelo Livro de Estoque (products/ledger.py), que
+        # atualiza saldo e preço médio direto no banco, sem ler/salvar o produto inteiro.
+        # A gravação em si continua sendo o save() normal (post_save é disparado).
         if not self.pk:
-            if self.movement_type == 'E':
-                # Lógica de Preço Médio Ponderado
-                # (Qtd Atual * Custo Atual) + (Qtd Nova * Custo Novo) / (Qtd Total)
-                if self.entry_cost is not None and self.quantity > 0:
-                    # Converte para Decimal para garantir precisão
-                    current_qty = Decimal(self.product.stock_quantity)
-                    current_cost = self.product.cost_price
-                    new_qty = Decimal(self.quantity)
-                    new_cost = self.entry_cost
-
-                    total_value = (current_qty * current_cost) + (new_qty * new_cost)
-                    total_qty = current_qty + new_qty
-
-                    if total_qty > 0:
-                        self.product.cost_price = total_value / total_qty
-
-                self.product.stock_quantity += self.quantity
-            else:
-                self.product.stock_quantity -= self.quantity
-            self.product.save()
+            from .ledger import post_movements
+            post_movements([self], insert=lambda movements: super(StockMovement, self).save(*args, **kwargs))
+            return
         super().save(*args, **kwargs)
         
     def __str__(self):
@@ -166,6 +199,9 @@ class StockMovement(models.Model):
     class Meta:
         verbose_name = "Movimentação de Estoque"
         verbose_name_plural = "Movimentações de Estoque"
+        indexes = [
+            models.Index(fields=['sale', 'source'], name='stockmov_sale_source_idx'),
+        ]
 
 class ProductComponent(models.Model):
     """Define quais produtos compõem um Kit"""
@@ -177,4 +213,14 @@ class ProductComponent(models.Model):
         return f"{self.quantity}x {self.component.name} em {self.kit.name}"
 
     class Meta:
-        unique_together = ('kit', 'component')
\ No newline at end of file
+        unique_together = ('kit', 'component')
+
+# --- SINAIS: invalida o cache de código de barras do PDV em todos os workers (após o commit) ---
+from .cache import bump_catalog_version
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductComponent)
+@receiver(post_delete, sender=ProductComponent)
+def invalidate_barcode_cache(sender, instance, **kwargs):
+    bump_catalog_version()
@@ -0,0 +1,87 @@
+"""
+Motor de Busca de Produtos: usado pelo PDV (product_search_api), pela lista de
+produtos e pela montagem de Kits, para que todos tenham o mesmo comportamento.
+
+A busca usa a coluna Product.search_text (nome + marca + linha + volume + código,
+já sem acentos) e ordena por relevância:
+    0 - Código de barras exato (leitor a laser)
+    1 - Começa com o termo (código ou nome)
+    2 - Contém todas as palavras digitadas
+"""
+from django.db.models import Case, When, Value, IntegerField, Q
+
+from core.search import build_search_key
+from .models import Product
+
+RANK_EXACT_BARCODE = 0
+RANK_PREFIX = 1
+RANK_TOKENS = 2
+
+def search_products(query, queryset=None):
+    """
+    Retorna um queryset anotado com 'search_rank' e ordenado por relevância.
+    Quem chama decide o LIMIT (fatiando o queryset).
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+
+    raw = (query or '').strip()
+    key = build_search_key(raw)
+    if not raw or not key:
+        return queryset.none()
+
+    tokens = Q()
+    for token in key.split():
+        tokens &= Q(search_text__contains=token)
+
+    return queryset.filter(
+        Q(barcode=raw) | Q(barcode__startswith=raw) | tokens
+    ).annotate(
+        search_rank=Case(
+            When(barcode=raw, then=Value(RANK_EXACT_BARCODE)),
+            When(Q(barcode__startswith=raw) | Q(search_text__startswith=key), then=Value(RANK_PREFIX)),
+            default=Value(RANK_TOKENS),
+            output_field=IntegerField(),
+        )
+    ).order_by('search_rank', 'name', 'pk')
+
+def serialize_catalog(p):
+    """
+    Dados do produto para o PDV que não dependem do estoque (podem ficar no cache
+    de código de barras). Espera o produto com 'components__component' já carregado.
+    """
+    components_list = []
+    # Lógica especial para Kits: Monta a lista de itens que compõem o kit
+    if p.product_type in ['kit', 'combo']:
+        for comp in p.components.all():
+            # Formata quantidade (tira .0 se for inteiro)
+            qty = int(comp.quantity) if comp.quantity % 1 == 0 else float(comp.quantity)
+            components_list.append(f"{qty}x {comp.component.name}")
+
+    return {
+        'id': p.id,
+        'name': p.name,
+        'is_kit': p.product_type in ['kit', 'combo'],
+        'price': float(p.selling_price),
+        'cost_price': float(p.cost_price),
+        'image': p.image.url if p.image else (p.image_url if p.image_url else ''),
+        'volume': p.volume,
+        'components': components_list
+    }
+
+def with_stock(catalog, stock):
+    """Junta os dados do catálogo com o estoque atual: é o dicionário enviado ao Javascript do PDV."""
+    data = dict(catalog)
+    is_kit = data.pop('is_kit')
+    # Adiciona alerta visual se estiver sem estoque (exceto Kits que são virtuais)
+    if stock <= 0 and not is_kit:
+        data['name'] += " (ESGOTADO ⚠️)"
+    data['stock'] = stock
+    return data
+
+def serialize_for_pos(p):
+    """
+    Monta o dicionário de dados enviado ao Javascript do PDV.
+    Espera o produto com 'brand' e 'components__component' já carregados.
+    """
+    return with_stock(serialize_catalog(p), p.stock_quantity)
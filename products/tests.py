@@ -1,3 +1,143 @@
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models.signals import post_save
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from .importer import ProductImporter
+from .ledger import post_movements, cost_price_changed
+from .models import Brand, OlfactoryFamily, Product, StockMovement
+from .search import search_products, RANK_EXACT_BARCODE, RANK_PREFIX, RANK_TOKENS
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name="Zaad", selling_price=100, cost_price=40, stock_quantity=10)
+
+    def post(self, *movements):
+        post_movements([
+            StockMovement(product=self.product, movement_type=kind, quantity=qty, entry_cost=cost)
+            for kind, qty, cost in movements
+        ])
+        self.product.refresh_from_db()
+        return self.product.stock_quantity, self.product.cost_price
+
+    def test_weighted_average_over_entries(self):
+        # (10 * 40 + 3 * 50) / 13 = 42,307... e depois (13 * 42,31 + 7 * 41) / 20 = 41,8515
+        self.assertEqual(self.post(('E', 3, Decimal('50'))), (13, Decimal('42.31')))
+        self.assertEqual(self.post(('E', 7, Decimal('41'))), (20, Decimal('41.85')))
+        # Duas entradas no mesmo lote: (20 * 41,85 + 5 * 46 + 5 * 52,10) / 30
+        self.assertEqual(self.post(('E', 5, Decimal('46')), ('E', 5, Decimal('52.10'))), (30, Decimal('44.25')))
+
+    def test_mixed_batch_and_entry_without_cost(self):
+        # A saída do lote não entra na média: (10 * 40 + 10 * 50) / 20
+        self.assertEqual(self.post(('E', 10, Decimal('50')), ('S', 3, None)), (17, Decimal('45.00')))
+        self.assertEqual(self.post(('E', 3, None)), (20, Decimal('45.00')))
+
+    def test_entry_on_zero_stock(self):
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=0)
+        self.assertEqual(self.post(('E', 4, Decimal('37.50'))), (4, Decimal('37.50')))
+
+    def test_save_keeps_model_contract(self):
+        saved, seen = [], []
+        def on_save(sender, instance, created, **kwargs):
+            saved.append((instance.pk, created))
+        def on_cost(sender, product_ids, **kwargs):
+            # O sinal vem depois do INSERT: a movimentação já está no banco
+            seen.append(StockMovement.objects.filter(product_id__in=product_ids).count())
+        post_save.connect(on_save, sender=StockMovement)
+        cost_price_changed.connect(on_cost)
+        self.addCleanup(post_save.disconnect, on_save, sender=StockMovement)
+        self.addCleanup(cost_price_changed.disconnect, on_cost)
+
+        movement = StockMovement(product=self.product, movement_type='E', quantity=10, entry_cost=Decimal('60'))
+        movement.save()
+        self.assertEqual(saved, [(movement.pk, True)])
+        self.assertEqual(seen, [1])
+        # O produto em memória já tem o saldo e o custo médio novos: (10 * 40 + 10 * 60) / 20
+        self.assertEqual((self.product.stock_quantity, self.product.cost_price), (20, Decimal('50.00')))
+        self.product.save() # Não grava o saldo antigo por cima
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 20)
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.brand = Brand.objects.create(name="Boticário")
+        self.exact = Product.objects.create(name="Zaad", brand=self.brand, barcode="7891234567890")
+        self.prefix = Product.objects.create(name="Malbec Gold", brand=self.brand, barcode="78912345678901")
+        self.tokens = Product.objects.create(name="Água de Colônia Malbec", brand=self.brand, volume="100ml")
+
+    def ranked(self, query):
+        return [(p.name, p.search_rank) for p in search_products(query)]
+
+    def test_ranking(self):
+        self.assertEqual(self.ranked('7891234567890'), [('Zaad', RANK_EXACT_BARCODE), ('Malbec Gold', RANK_PREFIX)])
+        self.assertEqual(self.ranked('malbec'), [('Malbec Gold', RANK_PREFIX), ('Água de Colônia Malbec', RANK_TOKENS)])
+        self.assertEqual(self.ranked(''), [])
+
+    def test_accent_insensitive(self):
+        self.assertEqual(self.ranked('AGUA DE COLÔNIA'), [('Água de Colônia Malbec', RANK_PREFIX)])
+        self.assertEqual(self.ranked('colonia agua'), [('Água de Colônia Malbec', RANK_TOKENS)])
+        self.assertEqual(self.ranked('BOTICARIO 100ML'), [('Água de Colônia Malbec', RANK_TOKENS)])
+
+    def test_brand_rename_refreshes_search_text(self):
+        self.brand.name = "O Boticário Perfumaria"
+        self.brand.save()
+        self.tokens.refresh_from_db()
+        self.assertIn('o boticario perfumaria', self.tokens.search_text)
+        self.assertEqual(len(self.ranked('perfumaria')), 3)
+
+class ProductImporterTests(TestCase):
+    def setUp(self):
+        self.brand = Brand.objects.create(name="Natura")
+        self.by_id = Product.objects.create(name="Essencial", brand=self.brand, selling_price=100, cost_price=50, barcode="111")
+        self.by_name = Product.objects.create(name="Kaiak", brand=self.brand, selling_price=90, cost_price=40)
+
+    def test_upsert_rules(self):
+        importer = ProductImporter().run([
+            {'ID': str(self.by_id.pk), 'Nome': 'Essencial Oud', 'Preço de Venda': '120,50'},
+            {'Código de Barras': '111', 'Nome': 'Essencial Oud', 'Estoque': '7'},
+            {'nome': 'KAIAK', 'marca': 'natura', 'custo': '45'},
+            {'nome': 'Novo', 'marca': 'Boticário', 'Família Olfativa': 'Amadeirado', 'preço': '80', 'Código de Barras': '222'},
+            {'nome': 'Novo', 'marca': 'boticário', 'estoque': '3'}, # Mesmo produto da linha anterior
+            {'nome': 'Sem preço'}, # Não existe e não tem preço: ignorada
+            {'Marca': 'Natura'},
+            {'ID': str(self.by_name.pk), 'nome': 'Kaiak', 'Código de Barras': '111'}, # Código de outro produto
+            {'nome': 'Datado', 'preço': '10', 'validade': 'amanhã'},
+        ])
+
+        self.assertEqual(importer.success_count, 5)
+        self.assertEqual(len(importer.errors), 3)
+        self.assertIn("Linha ignorada por não conter 'Nome'", importer.errors[0])
+        self.assertIn("Erro na linha", importer.errors[1]) # Data inválida (erro de conversão)
+        self.assertIn("já pertence ao produto 'Essencial Oud'", importer.errors[2])
+
+        self.by_id.refresh_from_db()
+        self.assertEqual((self.by_id.name, self.by_id.selling_price, self.by_id.stock_quantity), ("Essencial Oud", Decimal('120.50'), 7))
+        self.assertIn('oud', self.by_id.search_text)
+        self.by_name.refresh_from_db()
+        self.assertEqual(self.by_name.cost_price, Decimal('45'))
+
+        new = Product.objects.get(barcode='222')
+        self.assertEqual((new.brand.name, new.olfactory_family.name, new.stock_quantity, new.volume), ("Boticário", "Amadeirado", 3, 'N/A'))
+        self.assertTrue(new.search_text)
+        self.assertEqual(Brand.objects.filter(name__iexact='boticário').count(), 1)
+        self.assertFalse(Product.objects.filter(name__in=['Sem preço', 'Datado']).exists())
 
-# Create your tests here.
+    def test_query_count_does_not_depend_on_rows(self):
+        OlfactoryFamily.objects.create(name="Cítrico")
+        rows = [
+            {'nome': f'Produto {i}', 'marca': f'Marca {i % 5}', 'família olfativa': 'cítrico', 'preço': '10', 'código de barras': f'B{i}'}
+            for i in range(300)
+        ]
+        rows.append({'nome': 'kaiak', 'marca': 'Natura', 'estoque': '2'})
+        with CaptureQueriesContext(connection) as ctx:
+            importer = ProductImporter(batch_size=1000).run(rows)
+        self.assertEqual(importer.errors, [])
+        self.assertEqual(importer.success_count, 301)
+        # O SQLite divide o INSERT em blocos (limite de parâmetros); o resto é fixo por lote
+        other = [q for q in ctx.captured_queries if not q['sql'].startswith('INSERT INTO "products_product"')]
+        self.assertLessEqual(len(other), 10)
+        self.assertEqual(Product.objects.filter(name__startswith='Produto ').count(), 300)
+        self.by_name.refresh_from_db()
+        self.assertEqual(self.by_name.stock_quantity, 2)
@@ -0,0 +1,74 @@
+"""
+Miniaturas das fotos de Produto (usadas no catálogo em PDF).
+
+O catálogo embutia a foto original (às vezes vários MB) de cada produto num
+quadro de 40x40mm. Agora cada foto é reduzida uma única vez com o Pillow e
+guardada em disco (settings.THUMBNAIL_DIR). O nome do arquivo da miniatura
+vem do caminho + data de modificação + tamanho da foto original: se a foto for
+trocada, a chave muda e uma nova miniatura é gerada.
+
+As miniaturas que faltam são geradas em paralelo (ProcessPoolExecutor), pois
+redimensionar imagem é trabalho de CPU e não se beneficia de threads.
+"""
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+THUMBNAIL_SIZE = 240 # px: 40mm a ~150 dpi, suficiente para impressão do catálogo
+
+def thumbnail_path(source, size=THUMBNAIL_SIZE):
+    """Caminho da miniatura da foto 'source' (ou None se a foto não existe)."""
+    try:
+        stat = os.stat(source)
+    except OSError:
+        return None
+    key = hashlib.sha1(f"{os.path.abspath(source)}:{stat.st_mtime_ns}:{stat.st_size}:{size}".encode()).hexdigest()
+    return os.path.join(settings.THUMBNAIL_DIR, key[:2], f"{key}.jpg")
+
+def _make_thumbnail(source, target, size):
+    """Executado nos processos do pool: reduz a foto e grava como JPEG."""
+    from PIL import Image
+    try:
+        with Image.open(source) as img:
+            img.thumbnail((size, size))
+            if img.mode not in ('RGB', 'L'):
+                # Fundo branco para PNG com transparência
+                background = Image.new('RGB', img.size, 'white')
+                background.paste(img, mask=img.convert('RGBA').getchannel('A'))
+                img = background
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp = f"{target}.{os.getpid()}.tmp"
+            img.save(temp, 'JPEG', quality=85, optimize=True)
+            os.replace(temp, target) # Nunca expõe um arquivo pela metade a outro worker
+        return True
+    except Exception:
+        return False
+
+def get_thumbnails(sources, size=THUMBNAIL_SIZE):
+    """
+    Retorna {foto original: miniatura} para as fotos informadas.
+    As existentes são reaproveitadas; as que faltam são geradas agora.
+    Fotos ausentes ou inválidas ficam com None.
+    """
+    result = {}
+    missing = {}
+    for source in set(sources):
+        target = thumbnail_path(source, size)
+        result[source] = target
+        if target and not os.path.exists(target):
+            missing[source] = target
+    if not missing:
+        return result
+
+    workers = min(len(missing), getattr(settings, 'THUMBNAIL_WORKERS', None) or os.cpu_count() or 1)
+    if workers <= 1:
+        done = [_make_thumbnail(s, t, size) for s, t in missing.items()]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            done = list(pool.map(_make_thumbnail, missing.keys(), missing.values(), [size] * len(missing)))
+    for source, ok in zip(missing, done):
+        if not ok:
+            result[source] = None
+    return result
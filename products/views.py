@@ -6,6 +6,7 @@ from django.db.models import Q, F
 from django.http import JsonResponse
 from .forms import ProductForm, StockMovementForm
 from .models import Product, OlfactoryFamily, Brand, StockMovement, ProductComponent
+from .search import search_products
 from datetime import date, timedelta
 import unicodedata
 from sales.decorators import admin_required
@@ -26,11 +27,7 @@ def get_common_context(request):
 
     search_query = request.GET.get('q', '')
     if search_query:
-        products = Product.objects.select_related('brand').filter(
-            Q(name__icontains=search_query) |
-            Q(brand__name__icontains=search_query) |
-            Q(barcode__icontains=search_query)
-        ).order_by('name')
+        products = search_products(search_query).select_related('brand')
     else:
         products = Product.objects.all().select_related('brand').order_by('-created_at')
     return products
@@ -43,11 +40,8 @@ def product_list(request):
     queryset = Product.objects.select_related('brand').all()
 
     if q:
-        queryset = queryset.filter(
-            Q(name__icontains=q) | 
-            Q(barcode__icontains=q) | 
-            Q(brand__name__icontains=q)
-        ).order_by('name')
+        # Mesmo motor de busca do PDV (ignora acentos e ordena por relevância)
+        queryset = search_products(q, queryset)
     else:
         queryset = queryset.order_by('name')
     
@@ -126,6 +120,7 @@ def stock_purchase(request):
         if form.is_valid():
             movement = form.save(commit=False)
             movement.movement_type = 'E' # Força Entrada
+            movement.source = 'purchase'
             if not movement.reason:
                 movement.reason = "Compra / Entrada de Estoque"
             
@@ -251,10 +246,9 @@ def kit_manage(request):
     if q:
         # Otimização: Removemos o loop 'for p in all_products' que consome muita RAM.
         # O filtro abaixo é executado diretamente no SQL.
-        products_search = Product.objects.exclude(product_type='kit').filter(
-            Q(name__icontains=q) | 
-            Q(barcode__icontains=q)
-        ).select_related('brand').order_by('name')[:15]
+        products_search = search_products(
+            q, Product.objects.exclude(product_type='kit')
+        ).select_related('brand')[:15]
     elif active_kit:
         # Se estiver editando um kit, mostra mais produtos para facilitar
         products_search = Product.objects.exclude(product_type='kit').select_related('brand').order_by('-created_at')[:10]
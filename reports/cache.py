@@ -0,0 +1,30 @@
+"""
+Cache dos KPIs do Dashboard.
+
+Os indicadores (métricas de vendas, comparação, pagamentos, horários de pico e
+top produtos) são guardados no cache compartilhado com a chave:
+    (período, período de comparação, versão dos dados)
+
+A versão dos dados é incrementada após o commit de qualquer gravação em Venda,
+Item de Venda, Despesa ou no Resumo Diário de Vendas
+(ver os sinais em reports/models.py). Com isso, abrir o Dashboard várias vezes
+com o mesmo filtro não refaz as consultas até que os dados mudem de verdade.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from core.versioning import get_version, bump_on_commit
+
+VERSION_KEY = 'reports:data_version'
+
+def get_data_version():
+    return get_version(VERSION_KEY)
+
+def bump_data_version():
+    """Invalida todos os KPIs guardados após o commit (os antigos expiram sozinhos)."""
+    bump_on_commit(VERSION_KEY)
+
+def cached_kpis(compute, *period):
+    """Retorna os KPIs do período (calculando com 'compute()' só se não estiverem no cache)."""
+    key = 'reports:kpi:%s:%s' % (get_data_version(), ':'.join(str(p or '') for p in period))
+    return cache.get_or_set(key, compute, timeout=getattr(settings, 'REPORTS_KPI_CACHE_TIMEOUT', 3600))
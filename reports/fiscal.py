@@ -0,0 +1,463 @@
+"""
+Documentos fiscais da venda (Cupom em PDF, XML da NF-e e DANFE em PDF).
+
+Antes cada clique em download_fiscal gerava o documento do zero (inclusive o
+desenho do QR Code), relendo CompanySettings e os itens da venda sem
+select_related. Agora:
+    1. Os dados usados no documento (venda, itens, cliente e empresa) são
+       reunidos em um dicionário simples; o hash desse conteúdo identifica a versão.
+    2. O documento é gerado uma vez por (venda, tipo, hash) e gravado no storage
+       (FiscalDocument). Os downloads seguintes servem o arquivo gravado, com
+       ETag/Last-Modified (o navegador recebe 304 se já tem o arquivo).
+    3. Se a venda ou a empresa mudar, o hash muda e o documento é gerado de novo;
+       a edição pela tela da venda (sale_detail) também apaga os arquivos na hora.
+
+As funções de renderização recebem só o dicionário de dados (sem ORM), então
+podem rodar em outro processo: a exportação do período para a contabilidade
+(export_zip) gera os documentos que faltam em um ProcessPoolExecutor (o ReportLab
+usa só CPU) e envia o ZIP aos poucos, à medida que cada documento fica pronto.
+"""
+import hashlib
+import json
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from sales.models import Sale, SaleItem
+from .models import CompanySettings, FiscalDocument
+from .rollup import _local_day_range
+from .theme import get_theme_version
+
+try:
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.units import mm
+    from reportlab.graphics.barcode import qr
+    from reportlab.graphics.shapes import Drawing
+    from reportlab.graphics import renderPDF
+except ImportError:
+    canvas = None
+
+# Aumente ao mudar o layout: todos os documentos guardados são gerados de novo
+RENDER_VERSION = 1
+
+# Documentos da exportação do período (o cupom não vai para a contabilidade)
+EXPORT_DOC_TYPES = ('nfe', 'danfe')
+EXPORT_CHUNK_SIZE = 200 # Vendas lidas do banco por vez
+
+# Tipo -> (content type, nome do arquivo, precisa do ReportLab)
+DOC_TYPES = {
+    'cupom': ('application/pdf', 'cupom_{id}.pdf', True),
+    'nfe': ('application/xml', 'nfe_{id}.xml', False),
+    'danfe': ('application/pdf', 'danfe_{id}.pdf', True),
+}
+
+def is_available(doc_type):
+    return doc_type in DOC_TYPES and (canvas is not None or not DOC_TYPES[doc_type][2])
+
+def filename(doc_type, sale_id):
+    return DOC_TYPES[doc_type][1].format(id=sale_id)
+
+# --- Dados do documento ---
+
+def company_data():
+    """
+    Dados da empresa usados nos documentos. Ficam no cache junto com a versão do
+    tema, que já muda a cada gravação de CompanySettings (ver reports/models.py).
+    """
+    key = f'fiscal:company:{get_theme_version()}'
+    data = cache.get(key)
+    if data is None:
+        try:
+            company = CompanySettings.objects.only('name', 'cnpj', 'address', 'phone').first()
+        except DatabaseError:
+            company = None
+        data = {
+            'name': company.name if company else "Perfume ERP Ltda",
+            'cnpj': company.cnpj if company else "00.000.000/0001-91",
+            'address': company.address if company else '',
+            'phone': company.phone if company else '',
+        }
+        cache.set(key, data, timeout=None)
+    return data
+
+def sale_data(sale, items=None):
+    """Venda, cliente e itens como tipos simples (a venda deve vir com select_related('customer'))."""
+    if items is None:
+        items = sale.items.select_related('product').only('quantity', 'price', 'sale_id', 'product__name').order_by('pk')
+    return {
+        'id': sale.id,
+        'created_at': sale.created_at,
+        'total': sale.total,
+        'payment_method': sale.get_payment_method_display(),
+        'customer_name': sale.customer.name if sale.customer else None,
+        'customer_doc': sale.customer.cpf_cnpj if sale.customer and sale.customer.cpf_cnpj else '',
+        'items': [(item.product.name, item.quantity, item.price) for item in items],
+    }
+
+def content_hash(doc_type, data):
+    payload = json.dumps([RENDER_VERSION, doc_type, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+# --- Renderização (só dados simples: pode rodar em outro processo) ---
+
+def render(doc_type, sale, company):
+    return RENDERERS[doc_type](sale, company)
+
+def render_cupom(sale, company):
+    output = BytesIO()
+    # Gera PDF estilo Cupom Térmico (80mm largura) - Layout Moderno
+    width = 80*mm
+    height = 250*mm # Altura maior para garantir que caibam os itens
+    p = canvas.Canvas(output, pagesize=(width, height))
+
+    # Coordenadas e Configurações
+    y = 240*mm
+    left_x = 5*mm
+    center_x = 40*mm
+    right_x = 75*mm
+    line_height = 4*mm
+
+    # --- Cabeçalho da Empresa ---
+    p.setFont("Helvetica-Bold", 10)
+    p.drawCentredString(center_x, y, company['name'].upper())
+    y -= line_height + 1*mm
+
+    p.setFont("Helvetica", 8)
+    p.drawCentredString(center_x, y, f"CNPJ: {company['cnpj']}")
+    y -= line_height
+
+    if company['address']:
+        p.drawCentredString(center_x, y, company['address'][:45]) # Trunca para caber
+        y -= line_height
+    if company['phone']:
+        p.drawCentredString(center_x, y, f"Tel: {company['phone']}")
+        y -= line_height
+
+    y -= 2*mm
+    p.setLineWidth(0.5)
+    p.line(left_x, y, right_x, y)
+    y -= line_height + 2*mm
+
+    # --- Dados da Venda ---
+    p.setFont("Helvetica-Bold", 9)
+    p.drawCentredString(center_x, y, "CUPOM NÃO FISCAL")
+    y -= line_height
+
+    p.setFont("Helvetica", 8)
+    p.drawCentredString(center_x, y, f"Venda Nº {sale['id']:06d}")
+    y -= line_height
+    p.drawCentredString(center_x, y, sale['created_at'].strftime('%d/%m/%Y %H:%M:%S'))
+    y -= line_height + 2*mm
+
+    p.line(left_x, y, right_x, y)
+    y -= line_height + 2*mm
+
+    # --- Itens ---
+    p.setFont("Helvetica-Bold", 8)
+    p.drawString(left_x, y, "ITEM")
+    p.drawRightString(right_x, y, "TOTAL")
+    y -= line_height
+
+    p.setFont("Helvetica", 8)
+    for name, quantity, price in sale['items']:
+        # Nome do Produto
+        if len(name) > 30: name = name[:30] + "..."
+        p.drawString(left_x, y, name)
+        y -= line_height
+
+        # Detalhes
+        details = f"{quantity} x R$ {price:.2f}"
+        total_item = quantity * price
+
+        p.setFont("Helvetica", 7)
+        p.drawString(left_x + 2*mm, y, details)
+        p.drawRightString(right_x, y, f"R$ {total_item:.2f}")
+        p.setFont("Helvetica", 8)
+        y -= line_height + 1*mm
+
+    y -= 2*mm
+    p.line(left_x, y, right_x, y)
+    y -= line_height + 2*mm
+
+    # --- Totais ---
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(left_x, y, "TOTAL A PAGAR")
+    p.drawRightString(right_x, y, f"R$ {sale['total']:.2f}")
+    y -= line_height + 4*mm
+
+    p.setFont("Helvetica", 8)
+    p.drawString(left_x, y, "Forma de Pagamento:")
+    p.drawRightString(right_x, y, sale['payment_method'])
+    y -= line_height + 2*mm
+
+    # --- Cliente ---
+    if sale['customer_name'] is not None:
+        p.line(left_x, y, right_x, y)
+        y -= line_height + 2*mm
+        p.setFont("Helvetica-Bold", 8)
+        p.drawString(left_x, y, "CLIENTE")
+        y -= line_height
+        p.setFont("Helvetica", 8)
+        p.drawString(left_x, y, sale['customer_name'][:35])
+        y -= line_height
+        if sale['customer_doc']:
+            p.drawString(left_x, y, f"CPF/CNPJ: {sale['customer_doc']}")
+            y -= line_height
+
+    # --- Rodapé ---
+    y -= 10*mm
+    p.setFont("Helvetica-Oblique", 8)
+    p.drawCentredString(center_x, y, "Obrigado pela preferência!")
+    y -= line_height
+    p.setFont("Helvetica", 6)
+    p.drawCentredString(center_x, y, "Gerado por Perfume ERP")
+
+    # --- QR Code ---
+    y -= 5*mm
+    qr_data = "https://www.seusite.com.br" # Substitua pelo seu site
+    qr_code = qr.QrCodeWidget(qr_data)
+    bounds = qr_code.getBounds()
+    width = bounds[2] - bounds[0]
+    height = bounds[3] - bounds[1]
+    d = Drawing(45, 45, transform=[45/width,0,0,45/height,0,0])
+    d.add(qr_code)
+    renderPDF.draw(d, p, center_x - 8*mm, y - 18*mm)
+
+    p.showPage()
+    p.save()
+    return output.getvalue()
+
+def render_nfe(sale, company):
+    # Gera XML Simulado de NF-e
+    xml_content = f"""<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">
+    <NFe>
+        <infNFe Id="NFe{sale['id']}">
+            <ide>
+                <nNF>{sale['id']}</nNF>
+                <dhEmi>{sale['created_at'].isoformat()}</dhEmi>
+                <tpNF>1</tpNF>
+                <natOp>Venda de Mercadoria</natOp>
+            </ide>
+            <emit>
+                <xNome>{company['name']}</xNome>
+                <CNPJ>{company['cnpj']}</CNPJ>
+            </emit>
+            <dest>
+                <xNome>{sale['customer_name'] or 'Consumidor Final'}</xNome>
+                <CPF>{sale['customer_doc']}</CPF>
+            </dest>
+            <det nItem="1">
+                <prod>
+                    <xProd>Venda de Perfumes e Cosmeticos</xProd>
+                    <vProd>{sale['total']}</vProd>
+                </prod>
+            </det>
+            <total>
+                <ICMSTot>
+                    <vNF>{sale['total']}</vNF>
+                </ICMSTot>
+            </total>
+        </infNFe>
+    </NFe>
+</nfeProc>"""
+    return xml_content.encode('utf-8')
+
+def render_danfe(sale, company):
+    output = BytesIO()
+    # Configuração A4 (210mm x 297mm)
+    width, height = 210*mm, 297*mm
+    p = canvas.Canvas(output, pagesize=(width, height))
+
+    # --- Cabeçalho ---
+    p.setLineWidth(1)
+    p.rect(10*mm, height - 40*mm, 190*mm, 30*mm)
+
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(15*mm, height - 20*mm, "DANFE - Documento Auxiliar da Nota Fiscal Eletrônica")
+
+    p.setFont("Helvetica", 10)
+    p.drawString(15*mm, height - 25*mm, company['name'])
+    p.drawString(15*mm, height - 30*mm, f"CNPJ: {company['cnpj']}")
+
+    p.drawString(120*mm, height - 20*mm, f"Nº: {sale['id']}")
+    p.drawString(120*mm, height - 25*mm, "Série: 1")
+    p.drawString(120*mm, height - 30*mm, f"Emissão: {sale['created_at'].strftime('%d/%m/%Y')}")
+
+    # --- Destinatário ---
+    y = height - 50*mm
+    p.rect(10*mm, y - 25*mm, 190*mm, 25*mm)
+    p.setFont("Helvetica-Bold", 10)
+    p.drawString(12*mm, y - 5*mm, "DESTINATÁRIO / REMETENTE")
+
+    p.setFont("Helvetica", 9)
+    p.drawString(15*mm, y - 12*mm, f"Nome/Razão Social: {sale['customer_name'] or 'Consumidor Final'}")
+    p.drawString(130*mm, y - 12*mm, f"CNPJ/CPF: {sale['customer_doc']}")
+
+    # --- Itens ---
+    y = height - 85*mm
+    p.setFont("Helvetica-Bold", 9)
+    p.drawString(10*mm, y, "DADOS DOS PRODUTOS / SERVIÇOS")
+    y -= 5*mm
+    p.line(10*mm, y, 200*mm, y)
+    y -= 5*mm
+
+    p.setFont("Helvetica", 9)
+    for name, quantity, price in sale['items']:
+        line_text = f"{name[:50]} | Qtd: {quantity} | Unit: R$ {price:.2f} | Total: R$ {quantity * price:.2f}"
+        p.drawString(12*mm, y, line_text)
+        y -= 5*mm
+
+    # --- Totais ---
+    y -= 5*mm
+    p.line(10*mm, y, 200*mm, y)
+    y -= 8*mm
+    p.setFont("Helvetica-Bold", 11)
+    p.drawString(140*mm, y, f"VALOR TOTAL: R$ {sale['total']:.2f}")
+
+    p.showPage()
+    p.save()
+    return output.getvalue()
+
+RENDERERS = {'cupom': render_cupom, 'nfe': render_nfe, 'danfe': render_danfe}
+
+# --- Armazenamento ---
+
+def store(sale_id, doc_type, digest, content):
+    """Grava o documento gerado, substituindo a versão anterior desta venda/tipo."""
+    doc = FiscalDocument(sale_id=sale_id, doc_type=doc_type, content_hash=digest)
+    doc.file.save(filename(doc_type, sale_id), ContentFile(content), save=False)
+    try:
+        with transaction.atomic():
+            FiscalDocument.objects.filter(sale_id=sale_id, doc_type=doc_type).delete()
+            doc.save()
+    except IntegrityError:
+        # Outra requisição gravou o mesmo documento ao mesmo tempo: usa o dela
+        doc.file.delete(save=False)
+        return FiscalDocument.objects.get(sale_id=sale_id, doc_type=doc_type)
+    return doc
+
+def get_document(sale, doc_type):
+    """Documento (FiscalDocument) da venda: o já gravado, se ainda vale, ou um gerado agora."""
+    sale_info, company = sale_data(sale), company_data()
+    digest = content_hash(doc_type, [sale_info, company])
+    doc = FiscalDocument.objects.filter(sale_id=sale.id, doc_type=doc_type, content_hash=digest).first()
+    if doc is not None and doc.file.storage.exists(doc.file.name):
+        return doc
+    return store(sale.id, doc_type, digest, render(doc_type, sale_info, company))
+
+def invalidate(sale_id):
+    """Apaga os documentos gravados da venda (a venda foi editada)."""
+    FiscalDocument.objects.filter(sale_id=sale_id).delete()
+
+# --- Exportação do período (ZIP) ---
+
+class _ZipStream:
+    """
+    Destino do zipfile sem seek(): guarda os bytes escritos até serem enviados.
+    Sem tell()/seek() o zipfile grava cada arquivo em sequência (com data descriptor),
+    então o ZIP pode sair aos poucos em um StreamingHttpResponse.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+def export_sales(start, end):
+    """Vendas concluídas no período, com itens, cliente e documentos já gravados (poucas queries por bloco)."""
+    return (
+        Sale.objects.filter(_local_day_range(start, end), status='completed')
+        .select_related('customer')
+        .prefetch_related(
+            Prefetch('items', queryset=SaleItem.objects.select_related('product').order_by('pk')),
+            'fiscal_documents',
+        )
+        .order_by('created_at', 'pk')
+    )
+
+def _add_entry(archive, doc_type, sale_id, created_at, content):
+    name = f"{doc_type}/{filename(doc_type, sale_id)}"
+    entry = zipfile.ZipInfo(name, date_time=timezone.localtime(created_at).timetuple()[:6])
+    entry.compress_type = zipfile.ZIP_DEFLATED
+    archive.writestr(entry, content)
+
+def export_zip(sales, doc_types=EXPORT_DOC_TYPES):
+    """
+    Gera o ZIP com os documentos das vendas, em pedaços de bytes (para StreamingHttpResponse).
+    Documentos já gravados com o mesmo hash são copiados do storage; os que faltam são
+    gerados no pool de processos e gravados (FiscalDocument) para os próximos downloads.
+    """
+    company = company_data()
+    stream = _ZipStream()
+    # Poucos processos: o pool nasce dentro da requisição (não pode tomar todas as CPUs do servidor)
+    workers = min(getattr(settings, 'FISCAL_EXPORT_WORKERS', 2), os.cpu_count() or 1)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending = {} # future -> (venda, data da venda, tipo, hash)
+    errors = []
+
+    def add(sale_id, created_at, doc_type, digest, render_fn):
+        try:
+            content = render_fn()
+        except Exception as e:
+            errors.append(f"Venda #{sale_id} ({doc_type}): {e}")
+            return
+        try:
+            store(sale_id, doc_type, digest, content)
+        except Exception as e:
+            # Falha do storage/banco: o documento vai no ZIP mesmo assim, só não fica gravado
+            errors.append(f"Venda #{sale_id} ({doc_type}): gerado, mas não gravado ({e})")
+        _add_entry(archive, doc_type, sale_id, created_at, content)
+
+    def finish(futures):
+        for future in futures:
+            add(*pending.pop(future), future.result)
+
+    try:
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for sale in sales:
+                info = sale_data(sale, sale.items.all())
+                stored = {doc.doc_type: doc for doc in sale.fiscal_documents.all()}
+                for doc_type in doc_types:
+                    digest = content_hash(doc_type, [info, company])
+                    doc = stored.get(doc_type)
+                    if doc is not None and doc.content_hash == digest and doc.file.storage.exists(doc.file.name):
+                        with doc.file.open('rb') as fh:
+                            _add_entry(archive, doc_type, sale.id, sale.created_at, fh.read())
+                    elif pool is None:
+                        add(sale.id, sale.created_at, doc_type, digest, lambda: render(doc_type, info, company))
+                    else:
+                        pending[pool.submit(render, doc_type, info, company)] = (sale.id, sale.created_at, doc_type, digest)
+                        # Limita os documentos em memória: grava os que já ficaram prontos
+                        if len(pending) >= workers * 2:
+                            finish(wait(pending, return_when=FIRST_COMPLETED).done)
+                chunk = stream.pop()
+                if chunk:
+                    yield chunk
+
+            while pending:
+                finish(wait(pending, return_when=FIRST_COMPLETED).done)
+                yield stream.pop()
+
+            if errors:
+                archive.writestr('erros.txt', '\n'.join(errors))
+        yield stream.pop() # Diretório central do ZIP
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
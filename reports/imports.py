@@ -0,0 +1,135 @@
+"""
+Importação de arquivos em segundo plano (ImportRun), em lotes confirmados.
+
+Antes a importação inteira rodava dentro da requisição: se o worker do Gunicorn
+estourasse o tempo no meio do arquivo, parte das linhas ficava gravada e não
+havia como saber quais. Agora:
+    1. A view só identifica o tipo de dados, grava o arquivo e cria o ImportRun.
+    2. O 'manage.py run_report_worker' lê o arquivo em fluxo (reports/parsers.py)
+       e grava um lote por transação, junto com o avanço de 'rows_processed'.
+    3. A página da importação consulta o progresso (linhas, gravados, erros).
+    4. Se o worker cair, a importação fica 'running' sem avançar; depois de
+       settings.IMPORT_STALE_MINUTES ela volta para a fila e é retomada do
+       último lote confirmado (as linhas já gravadas são puladas). Enviar de
+       novo o mesmo arquivo (mesmo hash) também retoma a importação inacabada.
+"""
+import hashlib
+import itertools
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from core import audit
+from customers.importer import CustomerImporter
+from products.importer import ProductImporter, IMPORT_BATCH_SIZE
+from .models import ImportRun
+from .parsers import read_rows
+
+# Colunas típicas de cada tipo (quando o tipo não foi selecionado na tela)
+PRODUCT_KEYS = ['estoque', 'stock', 'stock_quantity', 'preço', 'price', 'selling_price']
+CUSTOMER_KEYS = ['email', 'telefone', 'phone']
+
+def detect_model(model_type, first_row):
+    """'products' ou 'customers' pelo tipo selecionado ou pelos cabeçalhos (None se não identificar)."""
+    if model_type in IMPORTERS:
+        return model_type
+    if model_type:
+        return None
+    keys = {k.lower().strip() for k in first_row}
+    if any(k in keys for k in PRODUCT_KEYS):
+        return 'products'
+    if any(k in keys for k in CUSTOMER_KEYS):
+        return 'customers'
+    return None
+
+IMPORTERS = {
+    'products': ("Produtos", ProductImporter),
+    'customers': ("Clientes", CustomerImporter),
+}
+
+def file_hash(uploaded_file):
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def start_import(uploaded_file, model_type, user):
+    """
+    Grava o arquivo e coloca a importação na fila. Se o mesmo arquivo (hash) já tem
+    uma importação inacabada deste usuário, ela é reaproveitada. Retorna (run, retomada).
+    """
+    digest = file_hash(uploaded_file)
+    unfinished = ImportRun.objects.filter(file_hash=digest, user=user, model_type=model_type).exclude(status='done').first()
+    if unfinished is not None:
+        ImportRun.objects.filter(pk=unfinished.pk, status='failed').update(status='pending', error='')
+        unfinished.refresh_from_db()
+        return unfinished, True
+    run = ImportRun(original_name=uploaded_file.name, file_hash=digest, model_type=model_type, user=user)
+    run.file.save(uploaded_file.name, uploaded_file, save=False)
+    run.save()
+    return run, False
+
+def requeue_stale():
+    """Importações 'running' sem avançar há muito tempo (worker caiu) voltam para a fila."""
+    limit = timezone.now() - timedelta(minutes=getattr(settings, 'IMPORT_STALE_MINUTES', 10))
+    return ImportRun.objects.filter(status='running', updated_at__lt=limit).update(status='pending')
+
+def claim_next():
+    """Pega a importação mais antiga da fila (UPDATE condicional, como em jobs.claim_next)."""
+    requeue_stale()
+    for run_id in ImportRun.objects.filter(status='pending').order_by('created_at').values_list('id', flat=True)[:10]:
+        now = timezone.now()
+        claimed = ImportRun.objects.filter(pk=run_id, status='pending').update(status='running', started_at=now, updated_at=now)
+        if claimed:
+            return ImportRun.objects.get(pk=run_id)
+    return None
+
+def _save_progress(run, importer, rows):
+    """Grava o avanço do lote (na mesma transação das linhas do lote)."""
+    run.rows_processed += rows
+    run.success_count += importer.success_count
+    run.error_count += len(importer.errors)
+    run.errors = (run.errors + importer.errors)[:ImportRun.MAX_ERRORS]
+    importer.success_count, importer.errors = 0, []
+    run.save(update_fields=['model_name', 'rows_processed', 'success_count', 'error_count', 'errors', 'updated_at'])
+
+def run_import(run):
+    """Executa (ou retoma) uma importação já marcada como 'running'."""
+    try:
+        with run.file.open('rb'):
+            rows = read_rows(run.file)
+            first = next(rows, None)
+            if first is None:
+                raise ValueError("O arquivo está vazio.")
+            model = detect_model(run.model_type, first)
+            if model is None:
+                raise ValueError("Não foi possível identificar o tipo de dados (Produtos ou Clientes). Verifique os cabeçalhos.")
+            run.model_name, importer_class = IMPORTERS[model]
+            importer = importer_class(user=run.user)
+
+            # Retoma após o último lote confirmado
+            rows = itertools.islice(itertools.chain([first], rows), run.rows_processed, None)
+            while True:
+                batch = list(itertools.islice(rows, IMPORT_BATCH_SIZE))
+                if not batch:
+                    break
+                with audit.audit_buffer(), transaction.atomic():
+                    importer.import_batch(batch)
+                    _save_progress(run, importer, len(batch))
+        run.status = 'done'
+        run.file.delete(save=False) # Concluída: o arquivo enviado não é mais necessário
+    except Exception as e:
+        run.status = 'failed'
+        run.error = str(e)
+    run.finished_at = timezone.now()
+    run.save()
+    return run
+
+def run_in_thread(run):
+    """Usado pelo pool de threads do worker: cada thread usa (e fecha) a própria conexão."""
+    try:
+        return run_import(run)
+    finally:
+        connections.close_all()
@@ -0,0 +1,142 @@
+"""
+Fila de geração de arquivos em segundo plano (ReportJob).
+
+Exportações grandes (Excel/PDF/CSV de export_data e download_report_file)
+passavam do timeout do Gunicorn. Com '?background=1' a view só grava um
+ReportJob 'pending' e devolve a página de acompanhamento; o comando
+'manage.py run_report_worker' pega os pedidos da fila, gera o arquivo com a
+mesma função da view, grava no storage padrão e marca como 'done'.
+
+Os arquivos (e os pedidos) expiram após settings.REPORT_JOB_TTL_HOURS, contadas
+desde o pedido e renovadas ao terminar. Enquanto gera o arquivo, o worker grava
+'heartbeat_at' a cada settings.REPORT_JOB_HEARTBEAT_SECONDS; um pedido 'running'
+sem sinal há mais de settings.REPORT_JOB_STALE_MINUTES (worker caiu ou foi
+reiniciado no deploy) volta para a fila. Exportações demoradas, mas vivas, não.
+"""
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ReportJob
+
+def _expiration(start):
+    return start + timedelta(hours=getattr(settings, 'REPORT_JOB_TTL_HOURS', 24))
+
+def enqueue(kind, params, user=None):
+    return ReportJob.objects.create(
+        kind=kind, params=params, user=user if user and user.is_authenticated else None,
+        expires_at=_expiration(timezone.now()), # Pedido abandonado na fila também expira
+    )
+
+def requeue_stale():
+    """Pedidos 'running' sem sinal do worker há muito tempo (worker caiu) voltam para a fila."""
+    limit = timezone.now() - timedelta(minutes=getattr(settings, 'REPORT_JOB_STALE_MINUTES', 5))
+    return ReportJob.objects.filter(
+        Q(heartbeat_at__lt=limit) | Q(heartbeat_at__isnull=True, started_at__lt=limit),
+        status='running',
+    ).update(status='pending')
+
+def claim_next():
+    """
+    Pega o pedido mais antigo da fila. A troca 'pending' -> 'running' é um UPDATE
+    condicional, então dois workers nunca processam o mesmo pedido.
+    """
+    requeue_stale()
+    for job_id in ReportJob.objects.filter(status='pending').order_by('created_at').values_list('id', flat=True)[:10]:
+        now = timezone.now()
+        claimed = ReportJob.objects.filter(pk=job_id, status='pending').update(status='running', started_at=now, heartbeat_at=now)
+        if claimed:
+            return ReportJob.objects.get(pk=job_id)
+    return None
+
+def render(job):
+    """Gera a resposta HTTP do pedido com as mesmas funções usadas pelas views."""
+    from . import views
+    params = job.params
+    if job.kind == 'export':
+        return views.render_export(params['model_name'], params['file_format'], params.get('query', {}))
+    return views.render_report_file(params.get('query', {}))
+
+def _response_filename(response, default):
+    match = re.search(r'filename="([^"]+)"', response.get('Content-Disposition', ''))
+    return unquote(match.group(1)) if match else default
+
+@contextmanager
+def _heartbeat(job):
+    """Enquanto o bloco roda, outra thread grava 'heartbeat_at' do pedido periodicamente."""
+    stop = threading.Event()
+    interval = getattr(settings, 'REPORT_JOB_HEARTBEAT_SECONDS', 30)
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                ReportJob.objects.filter(pk=job.pk, status='running').update(heartbeat_at=timezone.now())
+        finally:
+            connections.close_all() # Conexão própria desta thread
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+def run_job(job):
+    """Executa um pedido já marcado como 'running' e grava o resultado (ou o erro)."""
+    with _heartbeat(job):
+        return _run_job(job)
+
+def _run_job(job):
+    try:
+        response = render(job)
+        if response.status_code != 200:
+            raise ValueError(f"Resposta inválida ({response.status_code})")
+        with tempfile.TemporaryFile() as output:
+            chunks = response.streaming_content if response.streaming else [response.content]
+            for chunk in chunks:
+                output.write(chunk)
+            response.close()
+            filename = _response_filename(response, f"arquivo_{job.pk}")
+            output.seek(0)
+            job.result.save(filename, File(output, name=filename), save=False)
+        job.filename = filename
+        job.status = 'done'
+    except Exception as e:
+        job.status = 'failed'
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    job.expires_at = _expiration(job.finished_at)
+    # Sem 'heartbeat_at': o valor em memória é o do claim (a thread de sinal grava o atual)
+    job.save(update_fields=['status', 'error', 'result', 'filename', 'finished_at', 'expires_at'])
+    return job
+
+def run_in_thread(job):
+    """Usado pelo pool de threads do worker: cada thread usa (e fecha) a própria conexão."""
+    try:
+        return run_job(job)
+    finally:
+        connections.close_all() # Conexões são por thread: fecha as desta thread
+
+def expire_jobs():
+    """
+    Apaga os arquivos e os pedidos vencidos. Retorna quantos foram removidos.
+    Pedidos em geração ficam de fora (voltam para a fila por requeue_stale).
+    """
+    expired = ReportJob.objects.filter(expires_at__lte=timezone.now()).exclude(status='running')
+    count = 0
+    for job in expired.iterator():
+        if job.result:
+            job.result.delete(save=False)
+        job.delete()
+        count += 1
+    return count
@@ -0,0 +1,170 @@
+import random
+import time
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum, F
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from products.models import Product
+from reports.models import Expense
+from reports.rollup import rebuild_range, month_ranges
+from reports.views import _calculate_metrics_for_periods, _period_filter, _sales_summary
+from sales.models import Sale, SaleItem
+
+def legacy_sales_metrics(start_date, end_date):
+    """
+    Cálculo antigo de _calculate_sales_metrics (4 consultas sobre Vendas/Itens/Despesas),
+    mantido só para comparação: mesmo dicionário de retorno da função atual.
+    """
+    sales_qs = Sale.objects.filter(status='completed')
+    if start_date:
+        sales_qs = sales_qs.filter(created_at__date__gte=start_date)
+    if end_date:
+        sales_qs = sales_qs.filter(created_at__date__lte=end_date)
+
+    expenses_qs = Expense.objects.all()
+    if start_date:
+        expenses_qs = expenses_qs.filter(date__gte=start_date)
+    if end_date:
+        expenses_qs = expenses_qs.filter(date__lte=end_date)
+
+    total_revenue = sales_qs.aggregate(Sum('total'))['total__sum'] or 0
+    total_count = sales_qs.count()
+    avg_ticket = (total_revenue / total_count) if total_count > 0 else 0
+    total_cost = SaleItem.objects.filter(sale__in=sales_qs).aggregate(
+        cost=Sum(F('product__cost_price') * F('quantity'))
+    )['cost'] or 0
+    total_expenses = expenses_qs.aggregate(Sum('amount'))['amount__sum'] or 0
+    gross_profit = total_revenue - total_cost
+    net_profit = gross_profit - total_expenses
+    profit_margin = (gross_profit / total_revenue * 100) if total_revenue > 0 else 0
+
+    return {
+        'total_revenue': float(total_revenue),
+        'total_count': int(total_count),
+        'avg_ticket': float(avg_ticket),
+        'total_cost': float(total_cost),
+        'gross_profit': float(gross_profit),
+        'total_expenses': float(total_expenses),
+        'net_profit': float(net_profit),
+        'profit_margin': float(profit_margin)
+    }
+
+def summary_four_queries(start_date, end_date):
+    """
+    Consultas separadas por KPI (receita, quantidade, CMV e despesas) no Resumo Diário:
+    isola o ganho da agregação condicional do ganho do próprio Resumo.
+    """
+    summary = _sales_summary(start_date, end_date)
+    return (
+        summary.aggregate(Sum('revenue'))['revenue__sum'] or 0,
+        summary.aggregate(Sum('sale_count'))['sale_count__sum'] or 0,
+        summary.aggregate(Sum('cost'))['cost__sum'] or 0,
+        Expense.objects.filter(_period_filter(start_date, end_date)).aggregate(Sum('amount'))['amount__sum'] or 0,
+    )
+
+class Command(BaseCommand):
+    help = (
+        "Compara o cálculo antigo dos KPIs do Dashboard (período + comparação) com a "
+        "consulta única no Resumo Diário, sobre vendas sintéticas. Nada é gravado (rollback)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sales', type=int, default=100000, help="Quantidade de vendas sintéticas.")
+        parser.add_argument('--days', type=int, default=730, help="Dias de histórico.")
+        parser.add_argument('--repeat', type=int, default=5, help="Repetições de cada medição.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options['sales'], options['days'], options['repeat'])
+            transaction.set_rollback(True) # Descarta os dados sintéticos
+
+    def run(self, total_sales, days, repeat):
+        rng = random.Random(42)
+        today = timezone.localdate()
+        first_day = today - timedelta(days=days - 1)
+        tz = timezone.get_current_timezone()
+
+        self.stdout.write(f"Gerando {total_sales} vendas em {days} dias...")
+        products = Product.objects.bulk_create([
+            Product(name=f'Benchmark {i}', selling_price=100, cost_price=rng.randint(20, 60), stock_quantity=0)
+            for i in range(50)
+        ])
+        per_day = max(1, total_sales // days)
+        created = 0
+        for offset in range(days):
+            count = min(per_day, total_sales - created) if offset < days - 1 else total_sales - created
+            if count <= 0:
+                break
+            day = first_day + timedelta(days=offset)
+            sales = Sale.objects.bulk_create([
+                Sale(status='completed', payment_method=rng.choice(['pix', 'cash', 'credit', 'debit']), total=0)
+                for _ in range(count)
+            ])
+            items = []
+            for sale in sales:
+                quantity = rng.randint(1, 3)
+                product = rng.choice(products)
+                items.append(SaleItem(sale=sale, product=product, quantity=quantity, price=Decimal('100'),
+                                      subtotal=Decimal(100 * quantity), unit_cost=product.cost_price))
+            SaleItem.objects.bulk_create(items, batch_size=1000)
+            # bulk_create usa a data de hoje (auto_now_add): move as vendas para o dia simulado
+            Sale.objects.filter(pk__in=[s.pk for s in sales]).update(
+                created_at=timezone.make_aware(datetime.combine(day, dt_time(rng.randint(9, 20))), tz),
+                total=Decimal('150.00'),
+            )
+            created += count
+        Expense.objects.bulk_create([
+            Expense(description='Benchmark', amount=Decimal('500.00'), date=first_day + timedelta(days=d))
+            for d in range(0, days, 7)
+        ])
+
+        started = time.perf_counter()
+        for block_start, block_end in month_ranges(first_day, today):
+            rebuild_range(block_start, block_end)
+        self.stdout.write(f"Resumo Diário reconstruído em {time.perf_counter() - started:.2f}s")
+
+        main = (today - timedelta(days=364), today)
+        compare = (today - timedelta(days=729), today - timedelta(days=365))
+
+        def legacy():
+            return [legacy_sales_metrics(*main), legacy_sales_metrics(*compare)]
+
+        def summary_per_kpi():
+            return [summary_four_queries(*main), summary_four_queries(*compare)]
+
+        def one_pass():
+            return _calculate_metrics_for_periods([main, compare])
+
+        # Os dois cálculos de KPIs precisam devolver o mesmo dicionário, campo a campo
+        for old, new in zip(legacy(), one_pass()):
+            if old.keys() != new.keys() or any(round(old[k], 2) != round(new[k], 2) for k in old):
+                self.stderr.write(f"Resultados diferentes: {old} x {new}")
+
+        timings = {}
+        for name, func in [
+            ('antigo: 4 consultas por período em Vendas/Itens', legacy),
+            ('Resumo Diário: 4 consultas por período', summary_per_kpi),
+            ('Resumo Diário: agregação condicional', one_pass),
+        ]:
+            with CaptureQueriesContext(connection) as queries:
+                func()
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+            self.stdout.write(f"{name}: {len(queries)} consultas, {best * 1000:.1f} ms (melhor de {repeat})")
+
+        old_time, per_kpi_time, new_time = timings.values()
+        if new_time:
+            self.stdout.write(self.style.SUCCESS(
+                f"Ganho da agregação condicional: {per_kpi_time / new_time:.1f}x sobre consultas separadas "
+                f"no mesmo Resumo; {old_time / new_time:.1f}x sobre o cálculo antigo"
+            ))
@@ -0,0 +1,61 @@
+import io
+import itertools
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import openpyxl
+from django.core.management.base import BaseCommand
+
+from reports.xlsx import write_workbook
+
+HEADERS = ['ID', 'Data', 'Total', 'Status', 'Pagamento']
+
+def sample_rows(count):
+    """Linhas no formato da exportação de Vendas, geradas sob demanda."""
+    start = datetime(2024, 1, 1, 9, 0)
+    for i in range(count):
+        yield [i + 1, start + timedelta(minutes=i), Decimal(100 + i % 500) + Decimal('0.90'), 'Finalizada', 'pix']
+
+def legacy_workbook(count):
+    """Como era antes: planilha normal em memória, com todas as células convertidas em texto."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(HEADERS)
+    for row in list(sample_rows(count)):
+        ws.append([str(cell) if cell is not None else "" for cell in row])
+    output = io.BytesIO()
+    wb.save(output)
+    return output
+
+def write_only_workbook(count):
+    """Como é agora: linhas tipadas gravadas direto no arquivo temporário."""
+    return write_workbook(itertools.chain([HEADERS], sample_rows(count)))
+
+class Command(BaseCommand):
+    help = "Compara memória (pico) e tempo da exportação Excel antiga com a planilha write-only."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help="Quantidade de linhas.")
+
+    def measure(self, name, func, count):
+        tracemalloc.start()
+        started = time.perf_counter()
+        output = func(count)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        output.seek(0, io.SEEK_END)
+        size = output.tell()
+        output.close()
+        self.stdout.write(f"{name}: pico {peak / 1024 / 1024:.1f} MB, {elapsed:.2f}s (com tracemalloc), arquivo {size / 1024 / 1024:.1f} MB")
+        return peak
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        self.stdout.write(f"Gerando planilhas com {count} linhas...")
+        old = self.measure("antiga (Workbook em memória, texto)", legacy_workbook, count)
+        new = self.measure("write-only (arquivo temporário, tipada)", write_only_workbook, count)
+        if new:
+            self.stdout.write(self.style.SUCCESS(f"Memória de pico: {old / new:.1f}x menor"))
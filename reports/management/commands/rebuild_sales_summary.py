@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min, Max, Q
+from django.utils import timezone
+
+from reports.models import DailySalesSummary
+from reports.rollup import rebuild_range, month_ranges
+from sales.models import Sale
+
+class Command(BaseCommand):
+    help = "Recalcula o Resumo Diário de Vendas (Dashboard) a partir das vendas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="Data inicial (AAAA-MM-DD). Padrão: primeira venda.")
+        parser.add_argument('--end', help="Data final (AAAA-MM-DD). Padrão: última venda.")
+        parser.add_argument('--if-empty', action='store_true',
+                            help="Só reconstrói se o resumo ainda estiver vazio (primeiro deploy).")
+
+    def handle(self, *args, **options):
+        if options['if_empty'] and DailySalesSummary.objects.exists():
+            self.stdout.write("Resumo já preenchido: nada a fazer (mantido incrementalmente).")
+            return
+        try:
+            start = datetime.strptime(options['start'], '%Y-%m-%d').date() if options['start'] else None
+            end = datetime.strptime(options['end'], '%Y-%m-%d').date() if options['end'] else None
+        except ValueError:
+            raise CommandError("Use datas no formato AAAA-MM-DD.")
+
+        bounds = Sale.objects.aggregate(first=Min('created_at'), last=Max('created_at'))
+        full_rebuild = start is None and end is None
+        start = start or (timezone.localdate(bounds['first']) if bounds['first'] else None)
+        end = end or (timezone.localdate(bounds['last']) if bounds['last'] else None)
+
+        if full_rebuild:
+            # Remove resumos de dias que não têm mais vendas (fora do intervalo atual)
+            stale = DailySalesSummary.objects.all()
+            if start and end:
+                stale = stale.filter(~Q(date__range=(start, end)))
+            stale.delete()
+        if not start or not end:
+            self.stdout.write("Nenhuma venda encontrada.")
+            return
+
+        total = 0
+        for block_start, block_end in month_ranges(start, end):
+            total += rebuild_range(block_start, block_end)
+        self.stdout.write(self.style.SUCCESS(f"Resumo reconstruído de {start} a {end}: {total} linhas."))
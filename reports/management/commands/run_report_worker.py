@@ -0,0 +1,103 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django.core.management.base import BaseCommand
+
+from reports import imports, jobs
+
+logger = logging.getLogger(__name__)
+
+# Filas atendidas pelo worker: (pegar o próximo, executar na thread do pool, executar inline)
+QUEUES = [
+    (jobs.claim_next, jobs.run_in_thread, jobs.run_job),
+    (imports.claim_next, imports.run_in_thread, imports.run_import),
+]
+
+class Command(BaseCommand):
+    help = (
+        "Processa a fila de exportações/relatórios (ReportJob) e de importações (ImportRun) "
+        "em segundo plano e apaga os arquivos expirados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Arquivos processados ao mesmo tempo (threads).")
+        parser.add_argument('--poll', type=float, default=2.0, help="Intervalo (segundos) entre consultas à fila vazia.")
+        parser.add_argument('--once', action='store_true', help="Processa o que estiver na fila e termina.")
+
+    def claim(self):
+        """Próximo pedido de qualquer fila: (pedido, função da thread, função inline) ou None."""
+        for claim_next, threaded, inline in QUEUES:
+            item = claim_next()
+            if item is not None:
+                return item, threaded, inline
+        return None
+
+    def finished(self, item):
+        self.stdout.write(f"Finalizado: {item}" + (f" ({item.error})" if item.error else ""))
+
+    def crashed(self, item, error):
+        """
+        Erro inesperado fora do tratamento do próprio pedido (ex.: banco indisponível ao
+        gravar o resultado): registra e segue atendendo a fila. O pedido fica 'running'
+        e volta para a fila pelo requeue_stale.
+        """
+        logger.error("Falha ao processar %s", item, exc_info=error)
+        self.stderr.write(f"Falha: {item} ({error})")
+
+    def handle(self, *args, **options):
+        workers, poll, once = options['workers'], options['poll'], options['once']
+        if workers <= 1:
+            return self.run_inline(poll, once)
+        self.stdout.write(f"Worker de relatórios iniciado ({workers} threads).")
+        running = set()
+        submitted = {} # future -> pedido (para registrar falhas)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                expired = jobs.expire_jobs()
+                if expired:
+                    self.stdout.write(f"{expired} arquivo(s) expirado(s) removido(s).")
+
+                # Preenche as vagas livres com os próximos pedidos da fila
+                while len(running) < workers:
+                    claimed = self.claim()
+                    if claimed is None:
+                        break
+                    item, threaded, _ = claimed
+                    self.stdout.write(f"Processando: {item}")
+                    future = pool.submit(threaded, item)
+                    submitted[future] = item
+                    running.add(future)
+
+                if running:
+                    done, running = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        item = submitted.pop(future)
+                        try:
+                            self.finished(future.result())
+                        except Exception as e:
+                            self.crashed(item, e)
+                elif once:
+                    break
+                else:
+                    time.sleep(poll)
+
+    def run_inline(self, poll, once):
+        """Um pedido por vez, na própria thread do comando (--workers 1)."""
+        self.stdout.write("Worker de relatórios iniciado (1 por vez).")
+        while True:
+            expired = jobs.expire_jobs()
+            if expired:
+                self.stdout.write(f"{expired} arquivo(s) expirado(s) removido(s).")
+            claimed = self.claim()
+            if claimed is not None:
+                item, _, inline = claimed
+                self.stdout.write(f"Processando: {item}")
+                try:
+                    self.finished(inline(item))
+                except Exception as e:
+                    self.crashed(item, e)
+            elif once:
+                break
+            else:
+                time.sleep(poll)
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.3 on 2026-10-17 03:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0004_companysettings_background_color_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='Data')),
+                ('hour', models.PositiveSmallIntegerField(verbose_name='Hora')),
+                ('payment_method', models.CharField(max_length=20, verbose_name='Pagamento')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Receita')),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Custo (CMV)')),
+                ('item_count', models.IntegerField(default=0, verbose_name='Itens Vendidos')),
+                ('sale_count', models.IntegerField(default=0, verbose_name='Vendas')),
+                ('salesperson', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Vendedor')),
+            ],
+            options={
+                'verbose_name': 'Resumo Diário de Vendas',
+                'verbose_name_plural': 'Resumos Diários de Vendas',
+            },
+        ),
+    ]
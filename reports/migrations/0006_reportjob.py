@@ -0,0 +1,38 @@
+# Generated by Django 6.0.3 on 2026-10-17 03:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0005_dailysalessummary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('export', 'Exportação de Dados'), ('report', 'Relatório')], max_length=20, verbose_name='Tipo')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Parâmetros')),
+                ('status', models.CharField(choices=[('pending', 'Na Fila'), ('running', 'Processando'), ('done', 'Concluído'), ('failed', 'Falhou')], db_index=True, default='pending', max_length=20, verbose_name='Status')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Criado em')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Iniciado em')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finalizado em')),
+                ('expires_at', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Expira em')),
+                ('result', models.FileField(blank=True, upload_to='report_jobs/', verbose_name='Arquivo')),
+                ('filename', models.CharField(blank=True, max_length=255, verbose_name='Nome do Arquivo')),
+                ('error', models.TextField(blank=True, verbose_name='Erro')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Usuário')),
+            ],
+            options={
+                'verbose_name': 'Geração de Arquivo',
+                'verbose_name_plural': 'Gerações de Arquivos',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.3 on 2026-10-17 10:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0006_reportjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(blank=True, upload_to='imports/', verbose_name='Arquivo')),
+                ('original_name', models.CharField(max_length=255, verbose_name='Nome do Arquivo')),
+                ('file_hash', models.CharField(db_index=True, max_length=64, verbose_name='Hash (SHA-256)')),
+                ('model_type', models.CharField(blank=True, max_length=20, verbose_name='Tipo Selecionado')),
+                ('model_name', models.CharField(blank=True, max_length=50, verbose_name='Dados Importados')),
+                ('status', models.CharField(choices=[('pending', 'Na Fila'), ('running', 'Importando'), ('done', 'Concluída'), ('failed', 'Falhou')], db_index=True, default='pending', max_length=20, verbose_name='Status')),
+                ('rows_processed', models.PositiveIntegerField(default=0, verbose_name='Linhas Processadas')),
+                ('success_count', models.PositiveIntegerField(default=0, verbose_name='Registros Gravados')),
+                ('error_count', models.PositiveIntegerField(default=0, verbose_name='Erros')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Mensagens de Erro')),
+                ('error', models.TextField(blank=True, verbose_name='Erro Fatal')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Criado em')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Iniciado em')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Último Lote em')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finalizado em')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Usuário')),
+            ],
+            options={
+                'verbose_name': 'Importação de Arquivo',
+                'verbose_name_plural': 'Importações de Arquivos',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
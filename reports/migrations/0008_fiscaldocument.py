@@ -0,0 +1,31 @@
+# Generated by Django 6.0.3 on 2026-10-17 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0007_importrun'),
+        ('sales', '0005_auditlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FiscalDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doc_type', models.CharField(choices=[('cupom', 'Cupom (PDF)'), ('nfe', 'NF-e (XML)'), ('danfe', 'DANFE (PDF)')], max_length=10, verbose_name='Tipo')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='Hash do Conteúdo (SHA-256)')),
+                ('file', models.FileField(upload_to='fiscal/', verbose_name='Arquivo')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Gerado em')),
+                ('sale', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fiscal_documents', to='sales.sale', verbose_name='Venda')),
+            ],
+            options={
+                'verbose_name': 'Documento Fiscal',
+                'verbose_name_plural': 'Documentos Fiscais',
+                'constraints': [models.UniqueConstraint(fields=('sale', 'doc_type'), name='unique_fiscal_document_per_sale')],
+            },
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
 from django.utils import timezone
 
 class CompanySettings(models.Model):
@@ -57,4 +60,174 @@ class Expense(models.Model):
 
     class Meta:
         verbose_name = "Despesa"
-        verbose_name_plural = "Despesas"
\ No newline at end of file
+        verbose_name_plural = "Despesas"
+
+class DailySalesSummary(models.Model):
+    """
+    Resumo diário das vendas finalizadas (tabela de fatos do Dashboard).
+    Uma linha por Dia x Hora x Forma de Pagamento x Vendedor, mantida pelos sinais
+    de Venda (ver reports/rollup.py) e reconstruível com 'manage.py rebuild_sales_summary'.
+    """
+    date = models.DateField("Data", db_index=True)
+    hour = models.PositiveSmallIntegerField("Hora")
+    payment_method = models.CharField("Pagamento", max_length=20)
+    salesperson = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Vendedor")
+
+    revenue = models.DecimalField("Receita", max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField("Custo (CMV)", max_digits=14, decimal_places=2, default=0)
+    item_count = models.IntegerField("Itens Vendidos", default=0)
+    sale_count = models.IntegerField("Vendas", default=0)
+
+    def __str__(self):
+        return f"{self.date} {self.hour:02d}h - {self.payment_method}"
+
+    class Meta:
+        verbose_name = "Resumo Diário de Vendas"
+        verbose_name_plural = "Resumos Diários de Vendas"
+
+class ReportJob(models.Model):
+    """
+    Exportação / relatório pesado gerado fora da requisição web.
+    A tela enfileira o pedido; 'manage.py run_report_worker' processa a fila
+    (ver reports/jobs.py), grava o arquivo no storage padrão e o usuário baixa
+    pelo link quando estiver pronto. Arquivos expiram após REPORT_JOB_TTL_HOURS.
+    """
+    KIND_CHOICES = [
+        ('export', 'Exportação de Dados'),
+        ('report', 'Relatório'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Na Fila'),
+        ('running', 'Processando'),
+        ('done', 'Concluído'),
+        ('failed', 'Falhou'),
+    ]
+
+    kind = models.CharField("Tipo", max_length=20, choices=KIND_CHOICES)
+    params = models.JSONField("Parâmetros", default=dict, blank=True)
+    status = models.CharField("Status", max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Usuário")
+    created_at = models.DateTimeField("Criado em", auto_now_add=True)
+    started_at = models.DateTimeField("Iniciado em", null=True, blank=True)
+    # Atualizado pelo worker enquanto gera o arquivo: parado há muito tempo = worker caiu
+    heartbeat_at = models.DateTimeField("Último Sinal do Worker", null=True, blank=True)
+    finished_at = models.DateTimeField("Finalizado em", null=True, blank=True)
+    expires_at = models.DateTimeField("Expira em", null=True, blank=True, db_index=True)
+    result = models.FileField("Arquivo", upload_to='report_jobs/', blank=True)
+    filename = models.CharField("Nome do Arquivo", max_length=255, blank=True)
+    error = models.TextField("Erro", blank=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} - {self.get_status_display()}"
+
+    class Meta:
+        verbose_name = "Geração de Arquivo"
+        verbose_name_plural = "Gerações de Arquivos"
+        ordering = ['-created_at']
+
+class ImportRun(models.Model):
+    """
+    Importação de arquivo (Produtos/Clientes) processada fora da requisição web,
+    em lotes confirmados um a um (ver reports/imports.py). 'rows_processed' só
+    avança junto com o commit do lote: se o worker cair, a importação é retomada
+    a partir do último lote gravado.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Na Fila'),
+        ('running', 'Importando'),
+        ('done', 'Concluída'),
+        ('failed', 'Falhou'),
+    ]
+    MAX_ERRORS = 100 # Erros guardados para exibição (o total fica em error_count)
+
+    file = models.FileField("Arquivo", upload_to='imports/', blank=True)
+    original_name = models.CharField("Nome do Arquivo", max_length=255)
+    file_hash = models.CharField("Hash (SHA-256)", max_length=64, db_index=True)
+    model_type = models.CharField("Tipo Selecionado", max_length=20, blank=True)
+    model_name = models.CharField("Dados Importados", max_length=50, blank=True)
+    status = models.CharField("Status", max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Usuário")
+    rows_processed = models.PositiveIntegerField("Linhas Processadas", default=0)
+    success_count = models.PositiveIntegerField("Registros Gravados", default=0)
+    error_count = models.PositiveIntegerField("Erros", default=0)
+    errors = models.JSONField("Mensagens de Erro", default=list, blank=True)
+    error = models.TextField("Erro Fatal", blank=True)
+    created_at = models.DateTimeField("Criado em", auto_now_add=True)
+    started_at = models.DateTimeField("Iniciado em", null=True, blank=True)
+    updated_at = models.DateTimeField("Último Lote em", auto_now=True)
+    finished_at = models.DateTimeField("Finalizado em", null=True, blank=True)
+
+    def __str__(self):
+        return f"Importação #{self.pk} ({self.original_name}) - {self.get_status_display()}"
+
+    class Meta:
+        verbose_name = "Importação de Arquivo"
+        verbose_name_plural = "Importações de Arquivos"
+        ordering = ['-created_at']
+
+class FiscalDocument(models.Model):
+    """
+    Documento fiscal já gerado de uma venda (ver reports/fiscal.py). 'content_hash'
+    identifica os dados usados (venda, itens, cliente e empresa): se mudarem, o
+    documento é gerado de novo e substitui este.
+    """
+    DOC_TYPE_CHOICES = [
+        ('cupom', 'Cupom (PDF)'),
+        ('nfe', 'NF-e (XML)'),
+        ('danfe', 'DANFE (PDF)'),
+    ]
+
+    sale = models.ForeignKey('sales.Sale', on_delete=models.CASCADE, related_name='fiscal_documents', verbose_name="Venda")
+    doc_type = models.CharField("Tipo", max_length=10, choices=DOC_TYPE_CHOICES)
+    content_hash = models.CharField("Hash do Conteúdo (SHA-256)", max_length=64)
+    file = models.FileField("Arquivo", upload_to='fiscal/')
+    created_at = models.DateTimeField("Gerado em", auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.get_doc_type_display()} - Venda #{self.sale_id}"
+
+    class Meta:
+        verbose_name = "Documento Fiscal"
+        verbose_name_plural = "Documentos Fiscais"
+        constraints = [
+            models.UniqueConstraint(fields=['sale', 'doc_type'], name='unique_fiscal_document_per_sale'),
+        ]
+
+# --- SINAIS: invalida o tema (cores/fonte) guardado em todos os workers ---
+from .theme import bump_theme_version
+
+@receiver(post_save, sender=CompanySettings)
+@receiver(post_delete, sender=CompanySettings)
+def invalidate_theme(sender, **kwargs):
+    # Após o commit: uma requisição em andamento não guarda a versão antiga com a nova versão
+    bump_theme_version()
+
+# --- SINAIS: mantém o Resumo Diário de Vendas atualizado ---
+from sales.models import Sale
+from . import rollup
+
+@receiver(pre_save, sender=Sale)
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+def refresh_sales_summary(sender, instance, **kwargs):
+    # pre_save: ainda com a data original (snapshot de from_db), caso a data seja editada
+    rollup.mark_sale_dirty(instance)
+
+# --- SINAIS: invalida os KPIs do Dashboard guardados em cache (reports/cache.py) ---
+# O CMV usa o custo guardado no item da venda (SaleItem.unit_cost): mudanças de custo
+# do produto não alteram os KPIs já calculados.
+from sales.models import SaleItem
+from .cache import bump_data_version
+
+@receiver(post_save, sender=SaleItem)
+@receiver(post_delete, sender=SaleItem)
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+def invalidate_dashboard_kpis(sender, **kwargs):
+    bump_data_version()
+
+# --- SINAIS: apaga o arquivo do documento fiscal substituído ---
+@receiver(post_delete, sender=FiscalDocument)
+def delete_fiscal_file(sender, instance, **kwargs):
+    if instance.file:
+        transaction.on_commit(lambda: instance.file.delete(save=False))
@@ -0,0 +1,161 @@
+"""
+Leitura dos arquivos da tela de Importação (CSV, JSON e Excel) em fluxo.
+
+Antes o arquivo inteiro era carregado de uma vez (list(csv.DictReader),
+json.load, load_workbook + list(iter_rows)), ficando várias cópias da planilha
+em memória: uma tabela de fornecedor com 200 mil linhas derrubava a instância
+de 512MB. Agora cada leitor é um gerador que devolve uma linha (dict) por vez,
+lendo o upload (que o Django já guarda em arquivo temporário) aos poucos:
+    - CSV: csv.DictReader direto sobre o arquivo;
+    - Excel: openpyxl em modo read_only (lê a planilha sem montar as células);
+    - JSON: a lista de registros é decodificada objeto a objeto.
+O importador agrupa as linhas em lotes (ver ProductImporter.run).
+"""
+import codecs
+import csv
+import json
+from io import TextIOWrapper
+
+READ_SIZE = 64 * 1024
+
+# Palavras-chave para identificar se uma linha da planilha é o cabeçalho
+HEADER_KEYWORDS = ['nome', 'name', 'código', 'codigo', 'barcode', 'preço', 'price', 'estoque', 'stock', 'email', 'telefone']
+HEADER_SEARCH_ROWS = 20
+
+class UnsupportedFormat(Exception):
+    pass
+
+def read_rows(uploaded_file):
+    """Gerador de linhas (dict) do arquivo enviado, escolhido pela extensão."""
+    filename = uploaded_file.name.lower()
+    if filename.endswith('.csv'):
+        return read_csv(uploaded_file.file)
+    if filename.endswith('.json'):
+        return read_json(uploaded_file.file)
+    if filename.endswith('.xlsx'):
+        return read_xlsx(uploaded_file.file)
+    raise UnsupportedFormat(filename)
+
+def _detect_encoding(sample):
+    """UTF-8 (com ou sem BOM do Excel) se a amostra decodificar; senão Latin-1 (comum no Excel BR)."""
+    try:
+        # final=False: um caractere cortado no fim da amostra não é erro
+        codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+def read_csv(raw):
+    raw.seek(0)
+    sample = raw.read(READ_SIZE)
+    raw.seek(0)
+    encoding = _detect_encoding(sample)
+    text = TextIOWrapper(raw, encoding=encoding, newline='')
+    try:
+        # Tenta detectar se usa ponto e vírgula (comum no Excel Brasil) ou vírgula
+        head = sample[:2048].decode(encoding, errors='ignore')
+        delimiter = ';' if head.count(';') > head.count(',') else ','
+        yield from csv.DictReader(text, delimiter=delimiter)
+    finally:
+        text.detach() # Não fecha o arquivo do upload junto com o wrapper
+
+def read_json(raw):
+    """Decodifica uma lista JSON de registros um objeto por vez (sem carregar o arquivo todo)."""
+    raw.seek(0)
+    decoder = json.JSONDecoder()
+    chunks = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        data = raw.read(READ_SIZE)
+        eof = not data
+        buffer = buffer[pos:] + chunks.decode(data, final=eof)
+        pos = 0
+
+    def skip(chars):
+        """Avança sobre espaços (e os separadores em 'chars'); retorna o próximo caractere."""
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] in chars):
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos] if pos < len(buffer) else ''
+            fill()
+
+    fill()
+    if skip('') != '[':
+        raise ValueError("O JSON deve ser uma lista de registros.")
+    pos += 1
+    while True:
+        char = skip(',')
+        if char == ']':
+            return
+        if not char:
+            raise ValueError("JSON incompleto: a lista não foi fechada.")
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill() # O objeto continua no próximo bloco
+                continue
+            if end == len(buffer) and not eof:
+                fill() # Um número no fim do bloco pode estar cortado: lê mais e decodifica de novo
+                continue
+            break
+        pos = end
+        yield item
+
+def find_header(rows):
+    """
+    Busca inteligente da linha de cabeçalho (ignora linhas vazias ou títulos no topo):
+    a primeira, entre as 20 primeiras, que contém uma palavra-chave. Sem nenhuma, usa a primeira.
+    """
+    for i, row in enumerate(rows[:HEADER_SEARCH_ROWS]):
+        row_values = [str(cell).lower().strip() for cell in row if cell is not None]
+        if any(k in row_values for k in HEADER_KEYWORDS):
+            return i
+    return 0
+
+def read_xlsx(raw):
+    import openpyxl
+    raw.seek(0)
+    wb = openpyxl.load_workbook(raw, read_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        # Só as primeiras linhas ficam em memória, para achar o cabeçalho
+        top = []
+        for row in rows:
+            top.append(row)
+            if len(top) == HEADER_SEARCH_ROWS:
+                break
+        if not top:
+            return
+        header_row_index = find_header(top)
+
+        # Mapeia as colunas baseadas no cabeçalho encontrado
+        raw_headers = top[header_row_index]
+        header_map = {i: str(h).lower().strip() for i, h in enumerate(raw_headers) if h is not None and str(h).strip()}
+
+        for row in top[header_row_index + 1:]:
+            row_dict = _xlsx_row(row, header_map)
+            if row_dict: yield row_dict
+        for row in rows:
+            row_dict = _xlsx_row(row, header_map)
+            if row_dict: yield row_dict
+    finally:
+        wb.close() # O modo read_only mantém o arquivo aberto
+
+def _xlsx_row(row, header_map):
+    row_dict = {}
+    has_data = False
+    for i, cell in enumerate(row):
+        if i in header_map:
+            val = str(cell) if cell is not None else ''
+            # Remove .0 de números inteiros (comum no Excel)
+            if val.endswith('.0'): val = val[:-2]
+            row_dict[header_map[i]] = val.strip()
+            if val.strip(): has_data = True
+    return row_dict if has_data else None
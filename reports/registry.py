@@ -0,0 +1,429 @@
+"""
+Motor de Relatórios (registro declarativo).
+
+Cada relatório declara:
+    - base: função (início, fim, parâmetros) -> QuerySet já filtrado;
+    - prepare: ajuste do QuerySet das linhas (agrupamento, select_related, ordenação);
+    - columns: cabeçalho + como obter o valor de cada linha + formatador;
+    - summary: totais calculados no banco (aggregate) ou derivados dos totais.
+
+As linhas são lidas sob demanda com .iterator(chunk_size=...), então a tela,
+o Excel e o PDF consomem o mesmo gerador sem carregar tudo na memória.
+
+A visualização na tela é paginada por "keyset": a ordenação (coluna escolhida +
+chave única de desempate) é feita no SQL e cada página continua a partir do
+último valor visto (cursor), sem OFFSET. Abrir um relatório grande custa uma
+página, não o relatório inteiro.
+"""
+import base64
+import json
+
+from django.db.models import Sum, Count, F, Q, Value, DecimalField
+from django.db.models.functions import Coalesce
+
+from products.models import Product
+from sales.models import Sale, SaleItem
+from .models import Expense
+
+PAYMENT_LABELS = {'pix': 'PIX', 'credit': 'Crédito', 'debit': 'Débito', 'cash': 'Dinheiro'}
+ZERO = Value(0, output_field=DecimalField(max_digits=14, decimal_places=2))
+
+# --- Formatadores ---
+def money(value):
+    return f"R$ {(value or 0):.2f}"
+
+def percent(value):
+    return f"{(value or 0):.1f}%"
+
+def date_time(value):
+    return value.strftime('%d/%m/%Y %H:%M')
+
+def date_only(value):
+    return value.strftime('%d/%m/%Y')
+
+def margin(profit, revenue):
+    return (profit / revenue * 100) if revenue and revenue > 0 else 0
+
+class Column:
+    def __init__(self, header, value, fmt=None, sort=None):
+        self.header = header
+        self.value = value # Função que recebe a linha (objeto ou dicionário) e retorna o valor bruto
+        self.fmt = fmt
+        # Campo ou expressão usada para ordenar no banco (None = coluna não ordenável).
+        # Não pode resultar em NULL (use Coalesce), pois o cursor compara com < e >.
+        self.sort = sort
+
+    def format(self, value):
+        if self.fmt:
+            return self.fmt(value)
+        return value
+
+class Summary:
+    """Total do rodapé: 'aggregate' (expressão calculada no banco) ou 'compute(qs, totais)'."""
+    def __init__(self, key, aggregate=None, compute=None, fmt=money):
+        self.key = key
+        self.aggregate = aggregate
+        self.compute = compute
+        self.fmt = fmt
+
+class Report:
+    def __init__(self, key, title, columns, base, prepare=None, summary=(), default_sort='0',
+                 unique='pk', chunk_size=2000):
+        self.key = key
+        self.title = title
+        self.columns = columns
+        self.base = base
+        self.prepare = prepare or (lambda qs: qs)
+        self.summary = summary
+        self.default_sort = default_sort # Índice da coluna, com '-' para decrescente
+        self.unique = unique # Campo único de cada linha (desempate da ordenação e do cursor)
+        self.chunk_size = chunk_size
+
+    @property
+    def headers(self):
+        return [c.header for c in self.columns]
+
+    def parse_sort(self, sort):
+        """'3' / '-3' -> (índice, decrescente). Colunas inválidas ou não ordenáveis usam o padrão."""
+        for value in (sort, self.default_sort):
+            try:
+                index = int(value)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= abs(index) < len(self.columns) and self.columns[abs(index)].sort is not None:
+                return abs(index), str(value).startswith('-')
+        return None, False
+
+    def run(self, start_date=None, end_date=None, params=None, sort=None):
+        # Tratamento para datas "None" ou vazias (vindas da URL)
+        if start_date in ['None', '']: start_date = None
+        if end_date in ['None', '']: end_date = None
+        return ReportResult(self, self.base(start_date, end_date, params or {}), *self.parse_sort(sort))
+
+def _row_value(row, name):
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) and len(values) == 2 else None
+
+class ReportResult:
+    def __init__(self, report, base_qs, sort_index=None, descending=False):
+        self.report = report
+        self.title = report.title
+        self.headers = report.headers
+        self.base_qs = base_qs
+        self.sort_index = sort_index
+        self.descending = descending
+        self.queryset = self._ordered(report.prepare(base_qs))
+        self._totals = None
+
+    def _ordered(self, qs):
+        unique = self.report.unique
+        if self.sort_index is None:
+            return qs.order_by(unique)
+        sort = self.report.columns[self.sort_index].sort
+        qs = qs.annotate(sort_value=F(sort) if isinstance(sort, str) else sort)
+        if self.descending:
+            return qs.order_by(F('sort_value').desc(), F(unique).desc())
+        return qs.order_by('sort_value', unique)
+
+    def page(self, cursor=None, size=50):
+        """
+        Uma página de linhas formatadas a partir do cursor (None = primeira página).
+        Retorna (linhas, próximo_cursor); próximo_cursor é None na última página.
+        """
+        qs = self.queryset
+        unique = self.report.unique
+        after = decode_cursor(cursor) if cursor else None
+        if after:
+            # Linhas depois de (valor, chave) na ordem atual
+            op = 'lt' if self.descending else 'gt'
+            if self.sort_index is None:
+                qs = qs.filter(**{f'{unique}__{op}': after[1]})
+            else:
+                qs = qs.filter(
+                    Q(**{f'sort_value__{op}': after[0]})
+                    | Q(**{'sort_value': after[0], f'{unique}__{op}': after[1]})
+                )
+        objects = list(qs[:size + 1])
+        columns = self.report.columns
+        rows = [[c.format(c.value(obj)) for c in columns] for obj in objects[:size]]
+        next_cursor = None
+        if len(objects) > size:
+            last = objects[size - 1]
+            sort_value = _row_value(last, 'sort_value') if self.sort_index is not None else None
+            next_cursor = encode_cursor([sort_value, _row_value(last, unique)])
+        return rows, next_cursor
+
+    def values(self):
+        """Linhas com os valores brutos (Decimal, int, datetime...), lidas em blocos."""
+        columns = self.report.columns
+        for obj in self.queryset.iterator(chunk_size=self.report.chunk_size):
+            yield [c.value(obj) for c in columns]
+
+    def rows(self):
+        """Linhas já formatadas para exibição (tela e PDF)."""
+        columns = self.report.columns
+        for values in self.values():
+            yield [c.format(v) for c, v in zip(columns, values)]
+
+    @property
+    def totals(self):
+        """Totais do rodapé com os valores brutos, calculados no banco uma única vez."""
+        if self._totals is None:
+            aggregates = {s.key: s.aggregate for s in self.report.summary if s.aggregate is not None}
+            totals = self.base_qs.aggregate(**aggregates) if aggregates else {}
+            for s in self.report.summary:
+                if s.compute is not None:
+                    totals[s.key] = s.compute(self.base_qs, totals)
+            self._totals = {s.key: totals[s.key] or 0 for s in self.report.summary}
+        return self._totals
+
+    @property
+    def summary(self):
+        """Totais do rodapé formatados (chave -> texto)."""
+        return {s.key: s.fmt(self.totals[s.key]) for s in self.report.summary}
+
+REPORTS = {}
+
+def register(report):
+    REPORTS[report.key] = report
+    return report
+
+def get_report(report_type):
+    return REPORTS.get(report_type)
+
+# --- Filtros de período ---
+def _sales_in_period(qs, start_date, end_date, prefix=''):
+    if start_date: qs = qs.filter(**{f'{prefix}created_at__date__gte': start_date})
+    if end_date: qs = qs.filter(**{f'{prefix}created_at__date__lte': end_date})
+    return qs
+
+def _customer_name(sale, default='Consumidor Final'):
+    return sale.customer.name if sale.customer else default
+
+# --- Relatórios ---
+CUSTOMER_NAME = Coalesce('customer__name', Value('Consumidor Final'))
+
+register(Report(
+    'sales', "Relatório Geral de Vendas",
+    columns=[
+        Column('ID', lambda s: s.id, sort='id'),
+        Column('Data', lambda s: s.created_at, date_time, sort='created_at'),
+        Column('Cliente', _customer_name, sort=CUSTOMER_NAME),
+        Column('Status', lambda s: s.get_status_display(), sort='status'),
+        Column('Pagamento', lambda s: s.get_payment_method_display(), sort='payment_method'),
+        Column('Total', lambda s: s.total, money, sort='total'),
+    ],
+    base=lambda start, end, params: _sales_in_period(Sale.objects.all(), start, end),
+    prepare=lambda qs: qs.select_related('customer'),
+    summary=[Summary('total_vendas', Sum('total'))],
+    default_sort='-1',
+))
+
+def _pending_products(sale):
+    return "; ".join(f"{item.product.name} ({item.quantity})" for item in sale.items.all())
+
+register(Report(
+    'pending', "Relatório de Vendas Pendentes / Orçamentos",
+    columns=[
+        Column('ID', lambda s: s.id, sort='id'),
+        Column('Data', lambda s: s.created_at, date_time, sort='created_at'),
+        Column('Cliente', _customer_name, sort=CUSTOMER_NAME),
+        Column('Produtos', _pending_products),
+        Column('Qtd. Total', lambda s: sum(item.quantity for item in s.items.all())),
+        Column('Valor Total', lambda s: s.total, money, sort='total'),
+    ],
+    base=lambda start, end, params: _sales_in_period(Sale.objects.filter(status='pending'), start, end),
+    prepare=lambda qs: qs.select_related('customer').prefetch_related('items__product'),
+    summary=[Summary('total_pendente', Sum('total'))],
+    default_sort='-1',
+    chunk_size=500,
+))
+
+def _inventory_base(start, end, params):
+    qs = Product.objects.all()
+    # --- Filtros Profissionais Adicionais ---
+    brand_id = params.get('brand')
+    if brand_id and brand_id != 'all':
+        qs = qs.filter(brand_id=brand_id)
+
+    category_id = params.get('category')
+    if category_id and category_id != 'all':
+        qs = qs.filter(category_id=category_id)
+
+    supplier_id = params.get('supplier')
+    if supplier_id and supplier_id != 'all':
+        qs = qs.filter(supplier_id=supplier_id)
+
+    stock_status = params.get('stock_status')
+    if stock_status == 'in_stock':
+        qs = qs.filter(stock_quantity__gt=0)
+    elif stock_status == 'low_stock':
+        qs = qs.filter(stock_quantity__lte=F('min_stock'))
+    elif stock_status == 'out_of_stock':
+        qs = qs.filter(stock_quantity__lte=0)
+    return qs
+
+register(Report(
+    'inventory', "Relatório de Estoque e Valoração",
+    columns=[
+        Column('Produto', lambda p: p.name, sort='name'),
+        Column('Marca', lambda p: p.brand.name if p.brand else '-', sort=Coalesce('brand__name', Value('-'))),
+        Column('Estoque', lambda p: p.stock_quantity, sort='stock_quantity'),
+        Column('Custo Unit.', lambda p: p.cost_price, money, sort='cost_price'),
+        Column('Venda Unit.', lambda p: p.selling_price, money, sort='selling_price'),
+        Column('Total Custo', lambda p: p.stock_quantity * p.cost_price, money, sort=F('stock_quantity') * F('cost_price')),
+        Column('Total Venda', lambda p: p.stock_quantity * p.selling_price, money, sort=F('stock_quantity') * F('selling_price')),
+    ],
+    base=_inventory_base,
+    prepare=lambda qs: qs.select_related('brand'),
+    summary=[
+        Summary('custo_total', Sum(F('stock_quantity') * F('cost_price'))),
+        Summary('venda_total', Sum(F('stock_quantity') * F('selling_price'))),
+        Summary('lucro_potencial', compute=lambda qs, t: (t['venda_total'] or 0) - (t['custo_total'] or 0)),
+    ],
+    default_sort='0',
+))
+
+register(Report(
+    'best_sellers', "Produtos Mais Vendidos",
+    columns=[
+        Column('Produto', lambda r: r['product__name'], sort='product__name'),
+        Column('Qtd. Vendida', lambda r: r['total_qty'], sort='total_qty'),
+        Column('Receita Total', lambda r: r['total_rev'], money, sort='total_rev'),
+    ],
+    base=lambda start, end, params: _sales_in_period(SaleItem.objects.filter(sale__status='completed'), start, end, 'sale__'),
+    prepare=lambda qs: qs.values('product__name').annotate(
+        total_qty=Sum('quantity'), total_rev=Sum(F('quantity') * F('price'))
+    ),
+    default_sort='-1',
+    unique='product__name',
+))
+
+# Relatórios agrupados por nome: o rótulo (sem NULL) é o próprio agrupamento e a chave única
+register(Report(
+    'sales_by_customer', "Vendas por Cliente",
+    columns=[
+        Column('Cliente', lambda r: r['label'], sort='label'),
+        Column('Qtd. Compras', lambda r: r['count'], sort='count'),
+        Column('Total Gasto', lambda r: r['total_spent'], money, sort='total_spent'),
+    ],
+    base=lambda start, end, params: _sales_in_period(Sale.objects.filter(status='completed'), start, end),
+    prepare=lambda qs: qs.annotate(label=CUSTOMER_NAME).values('label')
+        .annotate(total_spent=Sum('total'), count=Count('id')),
+    default_sort='-2',
+    unique='label',
+))
+
+register(Report(
+    'sales_by_brand', "Vendas por Marca",
+    columns=[
+        Column('Marca', lambda r: r['label'], sort='label'),
+        Column('Qtd. Itens', lambda r: r['qty'], sort='qty'),
+        Column('Total Vendido', lambda r: r['total_sold'], money, sort='total_sold'),
+    ],
+    base=lambda start, end, params: _sales_in_period(SaleItem.objects.filter(sale__status='completed'), start, end, 'sale__'),
+    prepare=lambda qs: qs.annotate(label=Coalesce('product__brand__name', Value('Sem Marca'))).values('label')
+        .annotate(total_sold=Sum(F('quantity') * F('price')), qty=Sum('quantity')),
+    default_sort='-2',
+    unique='label',
+))
+
+register(Report(
+    'sales_by_user', "Vendas por Vendedor",
+    columns=[
+        Column('Vendedor', lambda r: r['label'], sort='label'),
+        Column('Qtd. Vendas', lambda r: r['count'], sort='count'),
+        Column('Total Vendido', lambda r: r['total_sold'], money, sort='total_sold'),
+    ],
+    base=lambda start, end, params: _sales_in_period(Sale.objects.filter(status='completed'), start, end),
+    prepare=lambda qs: qs.annotate(label=Coalesce('salesperson__username', Value('Sistema'))).values('label')
+        .annotate(total_sold=Sum('total'), count=Count('id')),
+    default_sort='-2',
+    unique='label',
+))
+
+register(Report(
+    'sales_by_payment', "Vendas por Forma de Pagamento",
+    columns=[
+        Column('Forma de Pagamento', lambda r: PAYMENT_LABELS.get(r['payment_method'], r['payment_method']), sort='payment_method'),
+        Column('Qtd. Vendas', lambda r: r['count'], sort='count'),
+        Column('Total', lambda r: r['total'], money, sort='total'),
+    ],
+    base=lambda start, end, params: _sales_in_period(Sale.objects.filter(status='completed'), start, end),
+    prepare=lambda qs: qs.values('payment_method').annotate(total=Sum('total'), count=Count('id')),
+    default_sort='-2',
+    unique='payment_method',
+))
+
+# Lucro por Produto: agrupado no banco (Nota: usa o custo atual do produto)
+register(Report(
+    'profit_by_product', "Relatório de Lucro por Produto",
+    columns=[
+        Column('Produto', lambda r: r['product__name'], sort='product__name'),
+        Column('Qtd Vendida', lambda r: r['qty'], sort='qty'),
+        Column('Receita Total', lambda r: r['revenue'], money, sort='revenue'),
+        Column('Custo Total', lambda r: r['cost'], money, sort='cost'),
+        Column('Lucro Bruto', lambda r: r['profit'], money, sort='profit'),
+        Column('Margem %', lambda r: margin(r['profit'], r['revenue']), percent),
+    ],
+    base=lambda start, end, params: _sales_in_period(SaleItem.objects.filter(sale__status='completed'), start, end, 'sale__'),
+    prepare=lambda qs: qs.values('product_id', 'product__name').annotate(
+        qty=Sum('quantity'),
+        revenue=Sum(F('price') * F('quantity')),
+        cost=Sum(F('unit_cost') * F('quantity')),
+    ).annotate(profit=F('revenue') - F('cost')),
+    summary=[Summary(
+        'lucro_bruto_total', Sum(F('price') * F('quantity') - F('unit_cost') * F('quantity'))
+    )],
+    default_sort='-4',
+    unique='product_id',
+))
+
+def _sale_profit_summary(qs, totals):
+    cost = SaleItem.objects.filter(sale__in=qs).aggregate(
+        cost=Sum(F('unit_cost') * F('quantity'))
+    )['cost'] or 0
+    return (qs.aggregate(total=Sum('total'))['total'] or 0) - cost
+
+register(Report(
+    'profit_by_sale', "Relatório de Lucro por Venda",
+    columns=[
+        Column('ID Venda', lambda s: s.id, sort='id'),
+        Column('Data', lambda s: s.created_at, date_only, sort='created_at'),
+        Column('Cliente', lambda s: _customer_name(s, 'Consumidor'), sort=Coalesce('customer__name', Value('Consumidor'))),
+        Column('Total Venda', lambda s: s.total, money, sort='total'),
+        Column('Custo Produtos', lambda s: s.items_cost, money, sort='items_cost'),
+        Column('Lucro', lambda s: s.total - s.items_cost, money, sort=F('total') - F('items_cost')),
+        Column('Margem %', lambda s: margin(s.total - s.items_cost, s.total), percent),
+    ],
+    base=lambda start, end, params: _sales_in_period(Sale.objects.filter(status='completed'), start, end),
+    prepare=lambda qs: qs.select_related('customer').annotate(
+        items_cost=Coalesce(Sum(F('items__unit_cost') * F('items__quantity')), ZERO)
+    ),
+    summary=[Summary('lucro_liquido_periodo', compute=_sale_profit_summary)],
+    default_sort='-1',
+))
+
+register(Report(
+    'financial_expenses', "Relatório de Despesas Operacionais",
+    columns=[
+        Column('Data', lambda e: e.date, date_only, sort='date'),
+        Column('Descrição', lambda e: e.description, sort='description'),
+        Column('Categoria', lambda e: e.get_category_display(), sort='category'),
+        Column('Valor', lambda e: e.amount, money, sort='amount'),
+    ],
+    base=lambda start, end, params: Expense.objects.filter(
+        **({'date__gte': start} if start else {}), **({'date__lte': end} if end else {})
+    ),
+    summary=[Summary('total_despesas', Sum('amount'))],
+    default_sort='-0',
+))
@@ -0,0 +1,158 @@
+"""
+Resumo Diário de Vendas (DailySalesSummary).
+
+O Dashboard lê os KPIs, gráficos e comparações desta tabela pequena em vez de
+somar todas as Vendas/Itens a cada acesso. A manutenção é incremental:
+    - Qualquer save()/delete() de Venda marca o(s) dia(s) afetado(s) (o dia atual
+      e, se a data foi editada, o dia antigo, lido do snapshot de from_db).
+    - Após o commit da transação, só esses dias são recalculados (DELETE + INSERT).
+
+O custo (CMV) usa o custo guardado em cada item no momento da venda
+(SaleItem.unit_cost): entradas de estoque e edições de custo posteriores não
+alteram dias já resumidos.
+'manage.py rebuild_sales_summary' recalcula tudo (ou um período) do zero.
+"""
+import threading
+from datetime import date, datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Sum, Count, F, Q
+from django.db.models.functions import TruncDate, ExtractHour
+from django.utils import timezone
+
+from .cache import bump_data_version
+
+_pending = threading.local()
+
+def _local_date(value):
+    """Data local (America/Sao_Paulo) de um datetime; ignora valores ainda não convertidos (texto)."""
+    if isinstance(value, datetime):
+        return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+    if isinstance(value, date):
+        return value
+    return None
+
+def _pending_sets():
+    if not hasattr(_pending, 'days'):
+        _pending.days = set()
+        _pending.sale_ids = set()
+    return _pending.days, _pending.sale_ids
+
+def mark_sale_dirty(sale):
+    """Chamado pelos sinais de Venda: agenda o recálculo dos dias afetados para o commit."""
+    days, sale_ids = _pending_sets()
+    for value in (getattr(sale, '_audit_snapshot', {}).get('created_at'), sale.created_at):
+        day = _local_date(value)
+        if day:
+            days.add(day)
+    if sale.pk:
+        sale_ids.add(sale.pk) # A data atual é confirmada no banco (pode ter vindo como texto do formulário)
+    # Vários sinais na mesma transação: o primeiro callback processa tudo, os demais não fazem nada
+    transaction.on_commit(flush_dirty_days)
+
+def flush_dirty_days():
+    from sales.models import Sale
+    days, sale_ids = _pending_sets()
+    if not days and not sale_ids:
+        return
+    days, ids = set(days), set(sale_ids)
+    _pending.days.clear()
+    _pending.sale_ids.clear()
+    if ids:
+        days.update(
+            Sale.objects.filter(pk__in=ids).annotate(day=TruncDate('created_at'))
+            .values_list('day', flat=True)
+        )
+    rebuild_days(days)
+
+def _local_day_range(start, end):
+    """
+    Filtro por intervalo de data/hora (início do dia 'start' até o fim do dia 'end', horário local).
+    Evita converter a data de cada venda no banco (created_at__date), que no SQLite é feito
+    linha a linha em Python e impede o uso de índice.
+    """
+    begin = timezone.make_aware(datetime.combine(start, datetime.min.time()))
+    finish = timezone.make_aware(datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    return Q(created_at__gte=begin, created_at__lt=finish)
+
+def _days_filter(days):
+    """Une dias consecutivos em intervalos (poucas condições mesmo para muitos dias)."""
+    condition = Q()
+    days = sorted(days)
+    start = previous = days[0]
+    for day in days[1:] + [None]:
+        if day is not None and day - previous == timedelta(days=1):
+            previous = day
+            continue
+        condition |= _local_day_range(start, previous)
+        start = previous = day
+    return condition
+
+def _summary_rows(sale_filter):
+    """
+    Agrupa as vendas finalizadas por Dia x Hora x Pagamento x Vendedor.
+    Duas consultas (vendas e itens), qualquer que seja o número de dias.
+    'sale_filter' é um Q() sobre os campos da Venda.
+    """
+    from sales.models import Sale, SaleItem
+    from .models import DailySalesSummary
+
+    rows = {}
+    def row(day, hour, payment_method, salesperson_id):
+        key = (day, hour, payment_method, salesperson_id)
+        if key not in rows:
+            rows[key] = DailySalesSummary(
+                date=day, hour=hour, payment_method=payment_method, salesperson_id=salesperson_id
+            )
+        return rows[key]
+
+    sales = Sale.objects.filter(sale_filter, status='completed')\
+        .annotate(day=TruncDate('created_at'), hour=ExtractHour('created_at'))\
+        .values('day', 'hour', 'payment_method', 'salesperson_id')\
+        .annotate(revenue=Sum('total'), sale_count=Count('id')).order_by()
+    for s in sales:
+        summary = row(s['day'], s['hour'], s['payment_method'], s['salesperson_id'])
+        summary.revenue = s['revenue'] or 0
+        summary.sale_count = s['sale_count']
+
+    items = SaleItem.objects.filter(sale__in=Sale.objects.filter(sale_filter, status='completed'))\
+        .annotate(day=TruncDate('sale__created_at'), hour=ExtractHour('sale__created_at'))\
+        .values('day', 'hour', 'sale__payment_method', 'sale__salesperson_id')\
+        .annotate(cost=Sum(F('unit_cost') * F('quantity')), item_count=Sum('quantity')).order_by()
+    for i in items:
+        summary = row(i['day'], i['hour'], i['sale__payment_method'], i['sale__salesperson_id'])
+        summary.cost = i['cost'] or 0
+        summary.item_count = i['item_count'] or 0
+
+    return list(rows.values())
+
+def rebuild_days(days):
+    """Recalcula o resumo dos dias informados. Retorna o número de linhas gravadas."""
+    from .models import DailySalesSummary
+    days = sorted(d for d in days if d)
+    if not days:
+        return 0
+    rows = _summary_rows(_days_filter(days))
+    with transaction.atomic():
+        DailySalesSummary.objects.filter(date__in=days).delete()
+        DailySalesSummary.objects.bulk_create(rows, batch_size=1000)
+    bump_data_version() # Invalida os KPIs do Dashboard em cache
+    return len(rows)
+
+def rebuild_range(start, end):
+    """Recalcula o resumo de um período inteiro (usado pelo comando de reconstrução)."""
+    from .models import DailySalesSummary
+    rows = _summary_rows(_local_day_range(start, end))
+    with transaction.atomic():
+        DailySalesSummary.objects.filter(date__gte=start, date__lte=end).delete()
+        DailySalesSummary.objects.bulk_create(rows, batch_size=1000)
+    bump_data_version()
+    return len(rows)
+
+def month_ranges(start, end):
+    """Divide [start, end] em blocos mensais (transações menores na reconstrução)."""
+    current = start
+    while current <= end:
+        next_month = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+        yield current, min(next_month - timedelta(days=1), end)
+        current = next_month
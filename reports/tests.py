@@ -0,0 +1,747 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+import openpyxl
+from PIL import Image
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from config.middleware import _thread_locals
+from core.testing import local_cache
+from products.ledger import post_movements
+from products.models import Product, StockMovement
+from products.thumbnails import thumbnail_path, THUMBNAIL_SIZE
+from sales.models import Sale, SaleItem
+from . import fiscal, imports, jobs, parsers, views
+from .management.commands import run_report_worker
+from .management.commands.benchmark_dashboard_metrics import legacy_sales_metrics
+from .models import CompanySettings, Expense, DailySalesSummary, ReportJob, ImportRun, FiscalDocument
+from .registry import get_report
+from .theme import get_theme_version
+
+
+@local_cache
+class ThemeMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser('admin', password='123'))
+        self.company = CompanySettings.objects.create(primary_color='#111111')
+
+    def settings_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [q for q in ctx.captured_queries if 'reports_companysettings' in q['sql']]
+
+    def test_api_requests_do_not_read_settings(self):
+        _, queries = self.settings_queries(reverse('product_search_api') + '?q=perfume')
+        self.assertEqual(queries, [])
+
+    def test_theme_is_cached_until_settings_change(self):
+        response, queries = self.settings_queries(reverse('pos_view'))
+        self.assertContains(response, '#111111')
+        self.assertEqual(len(queries), 1)
+
+        _, queries = self.settings_queries(reverse('pos_view'))
+        self.assertEqual(queries, [])
+
+        self.company.primary_color = '#222222'
+        version = get_theme_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.save()
+            self.assertEqual(get_theme_version(), version) # Só muda após o commit
+        response, queries = self.settings_queries(reverse('pos_view'))
+        self.assertContains(response, '#222222')
+        self.assertEqual(len(queries), 1)
+
+
+class MonthlyProfitTests(TestCase):
+    def setUp(self):
+        _thread_locals.user = None
+        self.client.force_login(User.objects.create_superuser('admin', password='123'))
+        product = Product.objects.create(name='Perfume', selling_price=100, cost_price=40, stock_quantity=100)
+        for year, month in [(2023, 1), (2024, 3), (2024, 3), (2025, 12)]:
+            sale = Sale.objects.create(status='completed', payment_method='pix')
+            SaleItem.objects.create(sale=sale, product=product, quantity=2, price=100)
+            created = timezone.make_aware(datetime(year, month, 15, 12, 0))
+            Sale.objects.filter(pk=sale.pk).update(created_at=created)
+        Sale.objects.create(status='pending', payment_method='credit') # Não entra na receita
+        Expense.objects.create(description='Aluguel', amount=Decimal('50.00'), date=date(2024, 3, 5))
+        Expense.objects.create(description='Luz', amount=Decimal('30.00'), date=date(2024, 7, 10))
+        call_command('rebuild_sales_summary', stdout=StringIO()) # As datas foram alteradas via update()
+
+    def get_dashboard(self, start, end):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('reports_dashboard'), {'start_date': start, 'end_date': end})
+        self.assertEqual(response.status_code, 200)
+        return response.context['monthly_profit'], len(ctx.captured_queries)
+
+    def test_query_count_does_not_depend_on_range(self):
+        _, short = self.get_dashboard('2024-03-01', '2024-04-30')
+        _, long = self.get_dashboard('2020-01-01', '2025-12-31')
+        self.assertEqual(short, long)
+
+    def test_monthly_values(self):
+        series, _ = self.get_dashboard('2024-01-10', '2024-07-01')
+        self.assertEqual(series, [
+            {'month': '2024-03', 'revenue': 400.0, 'cost': 160.0, 'expenses': 50.0, 'profit': 190.0},
+            {'month': '2024-07', 'revenue': 0.0, 'cost': 0.0, 'expenses': 30.0, 'profit': -30.0},
+        ])
+
+
+class DailySalesSummaryTests(TestCase):
+    def setUp(self):
+        _thread_locals.user = None
+        self.seller = User.objects.create_user('vendedor', password='123')
+        self.product = Product.objects.create(name='Perfume', selling_price=100, cost_price=40, stock_quantity=100)
+
+    def make_sale(self, quantity=1, status='completed', payment_method='pix'):
+        with self.captureOnCommitCallbacks(execute=True):
+            sale = Sale.objects.create(status=status, payment_method=payment_method, salesperson=self.seller)
+            SaleItem.objects.create(sale=sale, product=self.product, quantity=quantity, price=100)
+        return sale
+
+    def totals(self, **filters):
+        return DailySalesSummary.objects.filter(**filters).aggregate(
+            revenue=Sum('revenue'), cost=Sum('cost'), items=Sum('item_count'), sales=Sum('sale_count')
+        )
+
+    def test_incremental_updates(self):
+        sale = self.make_sale(quantity=2)
+        self.make_sale(status='pending', payment_method='credit') # Pendente não entra
+        today = timezone.localdate()
+        self.assertEqual(self.totals(date=today), {'revenue': Decimal('200'), 'cost': Decimal('80'), 'items': 2, 'sales': 1})
+
+        # Edição de data: sai do dia antigo e entra no novo
+        sale = Sale.objects.get(pk=sale.pk)
+        sale.created_at = timezone.make_aware(datetime(2024, 5, 10, 15, 30))
+        with self.captureOnCommitCallbacks(execute=True):
+            sale.save()
+        self.assertEqual(self.totals(date=today)['sales'], None)
+        row = DailySalesSummary.objects.get(date=date(2024, 5, 10))
+        self.assertEqual((row.hour, row.payment_method, row.salesperson, row.revenue), (15, 'pix', self.seller, Decimal('200')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            sale.delete()
+        self.assertFalse(DailySalesSummary.objects.exists())
+
+    def test_rebuild_matches_incremental(self):
+        for qty in (1, 2, 3):
+            self.make_sale(quantity=qty)
+        incremental = self.totals()
+        DailySalesSummary.objects.update(cost=0)
+        call_command('rebuild_sales_summary', '--if-empty', stdout=StringIO()) # Já preenchido: não mexe
+        self.assertEqual(self.totals()['cost'], Decimal('0'))
+        DailySalesSummary.objects.all().delete()
+        call_command('rebuild_sales_summary', '--if-empty', stdout=StringIO())
+        self.assertEqual(self.totals(), incremental)
+        self.assertEqual(incremental['sales'], 3)
+
+
+@local_cache
+class DashboardKpiCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        _thread_locals.user = None
+        self.client.force_login(User.objects.create_superuser('admin', password='123'))
+        self.product = Product.objects.create(name='Perfume', selling_price=100, cost_price=40, stock_quantity=100)
+
+    def load(self, period='month'):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('reports_dashboard'), {'period': period})
+        self.assertEqual(response.status_code, 200)
+        return response.context['sales_metrics'], len(ctx.captured_queries)
+
+    def test_repeated_loads_hit_cache_until_data_changes(self):
+        metrics, first = self.load()
+        _, second = self.load()
+        self.assertLess(second, first)
+        self.assertEqual(metrics['total_count'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            sale = Sale.objects.create(status='completed', payment_method='pix')
+            SaleItem.objects.create(sale=sale, product=self.product, quantity=1, price=100)
+        metrics, third = self.load()
+        self.assertGreater(third, second)
+        self.assertEqual(metrics['total_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.create(description='Luz', amount=Decimal('10.00'), date=timezone.localdate())
+        metrics, _ = self.load()
+        self.assertEqual(metrics['total_expenses'], 10.0)
+
+    def test_cost_change_keeps_cmv_of_past_sales(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            sale = Sale.objects.create(status='completed', payment_method='pix')
+            SaleItem.objects.create(sale=sale, product=self.product, quantity=2, price=100)
+        self.assertEqual(self.load()[0]['total_cost'], 80.0)
+        summary = list(DailySalesSummary.objects.values_list('id', 'cost'))
+
+        # Edição do produto e entrada de estoque (preço médio) não tocam nas vendas já feitas
+        self.product.cost_price = Decimal('45.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            post_movements([StockMovement(product=self.product, movement_type='E', quantity=100, entry_cost=Decimal('55'))])
+        self.assertEqual(list(DailySalesSummary.objects.values_list('id', 'cost')), summary) # Nada reconstruído
+        self.assertEqual(self.load()[0]['total_cost'], 80.0)
+
+        # Venda nova usa o custo médio do momento: (100 * 45 + 100 * 55) / 200 = 50
+        with self.captureOnCommitCallbacks(execute=True):
+            sale = Sale.objects.create(status='completed', payment_method='pix')
+            SaleItem.objects.create(sale=sale, product=self.product, quantity=1, price=100)
+        metrics, _ = self.load()
+        self.assertEqual((metrics['total_cost'], metrics['gross_profit']), (130.0, 170.0))
+
+    def test_presets_have_separate_entries(self):
+        self.load('month')
+        _, year_first = self.load('year')
+        _, year_second = self.load('year')
+        self.assertLess(year_second, year_first)
+
+
+class SalesMetricsEquivalenceTests(TestCase):
+    """A agregação condicional no Resumo Diário deve reproduzir o cálculo antigo (4 consultas)."""
+
+    def setUp(self):
+        _thread_locals.user = None
+        self.perfume = Product.objects.create(name='Perfume', selling_price=100, cost_price=Decimal('42.50'), stock_quantity=100)
+        self.creme = Product.objects.create(name='Creme', selling_price=30, cost_price=Decimal('11.20'), stock_quantity=100)
+
+    def make_sale(self, day, items, status='completed', payment_method='pix'):
+        with self.captureOnCommitCallbacks(execute=True):
+            sale = Sale.objects.create(status=status, payment_method=payment_method)
+            for product, quantity in items:
+                SaleItem.objects.create(sale=sale, product=product, quantity=quantity, price=product.selling_price)
+        sale = Sale.objects.get(pk=sale.pk)
+        sale.created_at = timezone.make_aware(datetime.combine(day, datetime.min.time().replace(hour=14)))
+        with self.captureOnCommitCallbacks(execute=True):
+            sale.save()
+
+    def test_main_and_comparison_periods_match_legacy(self):
+        main = (date(2024, 6, 1), date(2024, 6, 30))
+        compare = (date(2024, 5, 1), date(2024, 5, 31))
+        self.make_sale(date(2024, 6, 1), [(self.perfume, 2), (self.creme, 1)])
+        self.make_sale(date(2024, 6, 15), [(self.creme, 3)], payment_method='credit')
+        self.make_sale(date(2024, 6, 30), [(self.perfume, 1)], payment_method='cash')
+        self.make_sale(date(2024, 6, 20), [(self.perfume, 5)], status='pending') # Não entra
+        self.make_sale(date(2024, 5, 31), [(self.creme, 2)])
+        self.make_sale(date(2024, 4, 30), [(self.perfume, 1)]) # Fora dos dois períodos
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.create(description='Aluguel', amount=Decimal('120.00'), date=date(2024, 6, 5))
+            Expense.objects.create(description='Luz', amount=Decimal('33.33'), date=date(2024, 5, 1))
+
+        expected = [legacy_sales_metrics(*main), legacy_sales_metrics(*compare)]
+        self.assertEqual(expected[0]['total_count'], 3)
+        with CaptureQueriesContext(connection) as ctx:
+            results = views._calculate_metrics_for_periods([main, compare])
+        self.assertEqual(len(ctx.captured_queries), 2)
+        for result, legacy in zip(results, expected):
+            self.assertEqual(result.keys(), legacy.keys())
+            for key, value in legacy.items():
+                self.assertEqual(type(result[key]), type(value), key)
+                self.assertAlmostEqual(result[key], value, places=6, msg=key)
+
+        # Período único e período sem limites (tudo)
+        for period in (main, (None, None)):
+            single = views._calculate_sales_metrics(*period)
+            legacy = legacy_sales_metrics(*period)
+            self.assertEqual(single.keys(), legacy.keys())
+            for key, value in legacy.items():
+                self.assertAlmostEqual(single[key], value, places=6, msg=key)
+
+
+class ReportRegistryTests(TestCase):
+    def setUp(self):
+        _thread_locals.user = None
+        self.cheap = Product.objects.create(name='Colônia', selling_price=50, cost_price=20, stock_quantity=10)
+        self.expensive = Product.objects.create(name='Perfume', selling_price=200, cost_price=80, stock_quantity=3)
+        for product, quantity in [(self.cheap, 4), (self.expensive, 1), (self.expensive, 2)]:
+            sale = Sale.objects.create(status='completed', payment_method='pix')
+            SaleItem.objects.create(sale=sale, product=product, quantity=quantity, price=product.selling_price)
+
+    def test_profit_by_product_grouped_in_database(self):
+        result = get_report('profit_by_product').run()
+        with CaptureQueriesContext(connection) as ctx:
+            rows = list(result.rows())
+            summary = result.summary
+        self.assertEqual(len(ctx.captured_queries), 2) # Linhas + totais, independente do volume
+        self.assertEqual(rows, [
+            ['Perfume', 3, 'R$ 600.00', 'R$ 240.00', 'R$ 360.00', '60.0%'],
+            ['Colônia', 4, 'R$ 200.00', 'R$ 80.00', 'R$ 120.00', '60.0%'],
+        ])
+        self.assertEqual(summary, {'lucro_bruto_total': 'R$ 480.00'})
+
+    def test_values_keep_raw_types(self):
+        result = get_report('inventory').run(params={'stock_status': 'in_stock'})
+        first = next(result.values())
+        self.assertEqual(first[0], 'Colônia')
+        self.assertEqual(first[5], Decimal('200.00'))
+        self.assertEqual(result.summary['lucro_potencial'], 'R$ 660.00')
+
+    def test_dashboard_preview_and_download_use_registry(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='123'))
+        response = self.client.get(reverse('reports_dashboard'), {'report_type': 'profit_by_sale', 'period': 'today'})
+        self.assertContains(response, 'Relatório de Lucro por Venda')
+        self.assertContains(response, 'R$ 480.00')
+        response = self.client.get(reverse('download_report_file'), {'report_type': 'sales', 'format': 'excel'})
+        self.assertEqual(response.status_code, 200)
+
+    @mock.patch('reports.views.REPORT_PAGE_SIZE', 2)
+    def test_preview_is_paginated_by_cursor(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='123'))
+        params = {'report_type': 'sales', 'period': 'today', 'sort': '5'} # Total crescente
+        response = self.client.get(reverse('reports_dashboard'), params)
+        report_data = response.context['report_data']
+        self.assertEqual([row[5] for row in report_data['data']], ['R$ 200.00', 'R$ 200.00'])
+        self.assertEqual(report_data['columns'][5]['arrow'], '▲')
+        self.assertIn('sort=-5', report_data['columns'][5]['url'])
+
+        response = self.client.get(report_data['page_url'] + '&cursor=' + report_data['next_cursor'])
+        page = response.json()
+        self.assertEqual([row[5] for row in page['rows']], ['R$ 400.00'])
+        self.assertIsNone(page['next_cursor'])
+
+        response = self.client.get(report_data['page_url'] + '&cursor=lixo')
+        self.assertEqual(response.status_code, 200) # Cursor ilegível volta para a primeira página
+        self.assertEqual(len(response.json()['rows']), 2)
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        _thread_locals.user = None
+        self.client.force_login(User.objects.create_superuser('admin', password='123'))
+        product = Product.objects.create(name='Perfume', selling_price=100, cost_price=40, stock_quantity=10)
+        for quantity in (1, 3):
+            sale = Sale.objects.create(status='completed', payment_method='pix')
+            SaleItem.objects.create(sale=sale, product=product, quantity=quantity, price=100)
+
+    def download(self, model_name, file_format):
+        response = self.client.get(reverse('export_data', args=[model_name, file_format]))
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_financial_csv_cost_computed_in_database(self):
+        with CaptureQueriesContext(connection) as ctx:
+            content = self.download('financial', 'csv')
+        lines = content.strip().splitlines()
+        self.assertEqual(lines[0], 'ID Venda,Data,Total Venda,Custo Produtos,Lucro Bruto,Margem %')
+        self.assertEqual([line.split(',')[2:] for line in lines[1:]], [
+            ['100.00', '40.00', '60.00', '60.00'], ['300.00', '120.00', '180.00', '60.00'],
+        ])
+        self.assertFalse([q for q in ctx.captured_queries if 'sales_saleitem' in q['sql'] and 'SUM' not in q['sql']])
+
+    def test_json_and_ndjson(self):
+        rows = json.loads(self.download('sales', 'json'))
+        self.assertEqual([r['Total'] for r in rows], ['100.00', '300.00'])
+        lines = self.download('customers', 'ndjson').splitlines()
+        self.assertEqual(lines, [])
+        lines = self.download('sales', 'ndjson').splitlines()
+        self.assertEqual(json.loads(lines[1])['Status'], 'Finalizada')
+
+    def test_excel_keeps_numeric_types(self):
+        response = self.client.get(reverse('export_data', args=['financial', 'excel']))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="relatorio_financeiro_lucros.xlsx"')
+        ws = openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content))).active
+        rows = list(ws.iter_rows(values_only=True))
+        self.assertEqual(rows[3], ('ID Venda', 'Data', 'Total Venda', 'Custo Produtos', 'Lucro Bruto', 'Margem %'))
+        self.assertEqual(rows[4][2:], (100, 40, 60, 60))
+        self.assertIsInstance(rows[4][1], datetime)
+
+        response = self.client.get(reverse('download_report_file'), {'report_type': 'inventory', 'format': 'excel'})
+        rows = list(openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content))).active.iter_rows(values_only=True))
+        self.assertEqual(rows[4], ('Perfume', '-', 10, 40, 100, 400, 1000))
+        self.assertEqual(rows[-1][:2], ('Lucro Potencial', 600))
+
+
+class CatalogPdfTests(TestCase):
+    def setUp(self):
+        _thread_locals.user = None
+        self.client.force_login(User.objects.create_superuser('admin', password='123'))
+        self.media = tempfile.mkdtemp()
+        self.thumbs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        self.addCleanup(shutil.rmtree, self.thumbs)
+
+    def test_catalog_uses_cached_thumbnails(self):
+        with override_settings(MEDIA_ROOT=self.media, THUMBNAIL_DIR=self.thumbs, THUMBNAIL_WORKERS=1):
+            photo = BytesIO()
+            Image.new('RGB', (2000, 1500), 'purple').save(photo, 'JPEG')
+            product = Product.objects.create(name='Perfume', selling_price=100, cost_price=40, stock_quantity=1)
+            product.image.save('foto.jpg', ContentFile(photo.getvalue()))
+            for i in range(9):
+                Product.objects.create(name=f'Sem foto {i}', selling_price=10, cost_price=5, stock_quantity=1)
+
+            response = self.client.get(reverse('export_data', args=['products', 'pdf']))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.content.startswith(b'%PDF'))
+
+            thumb = thumbnail_path(product.image.path)
+            with Image.open(thumb) as img:
+                self.assertLessEqual(max(img.size), THUMBNAIL_SIZE)
+            created = os.stat(thumb).st_mtime_ns
+            self.client.get(reverse('export_data', args=['products', 'pdf']))
+            self.assertEqual(os.stat(thumb).st_mtime_ns, created) # Reaproveitada, não gerada de novo
+
+
+# TransactionTestCase: o worker fecha a resposta gerada, o que dispara request_finished,
+# e o Django fecha a conexão que estiver dentro de uma transação (a do TestCase)
+class ReportJobTests(TransactionTestCase):
+    def setUp(self):
+        _thread_locals.user = None
+        self.admin = User.objects.create_superuser('admin', password='123')
+        self.client.force_login(self.admin)
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        Product.objects.create(name='Perfume', selling_price=100, cost_price=40, stock_quantity=10)
+
+    def test_background_export_is_queued_and_processed(self):
+        with override_settings(MEDIA_ROOT=self.media):
+            response = self.client.get(reverse('export_data', args=['products', 'csv']), {'background': '1', 'stock_status': 'in_stock'})
+            job = ReportJob.objects.get()
+            self.assertRedirects(response, reverse('report_job_detail', args=[job.id]))
+            self.assertEqual(job.params, {'model_name': 'products', 'file_format': 'csv', 'query': {'stock_status': 'in_stock'}})
+            self.assertIsNone(self.client.get(reverse('report_job_status', args=[job.id])).json()['download_url'])
+
+            call_command('run_report_worker', '--once', '--workers', '1', stdout=StringIO())
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.filename), ('done', 'produtos.csv'))
+            status = self.client.get(reverse('report_job_status', args=[job.id])).json()
+            response = self.client.get(status['download_url'])
+            self.assertIn('Perfume', b''.join(response.streaming_content).decode())
+
+            other = User.objects.create_user('vendedor', password='123')
+            self.client.force_login(other)
+            self.assertEqual(self.client.get(status['download_url']).status_code, 404)
+
+            # Após expirar, o arquivo e o pedido são apagados pelo worker
+            path = job.result.path
+            ReportJob.objects.filter(pk=job.pk).update(expires_at=timezone.now())
+            call_command('run_report_worker', '--once', '--workers', '1', stdout=StringIO())
+            self.assertFalse(ReportJob.objects.exists())
+            self.assertFalse(os.path.exists(path))
+
+    def test_background_report_file(self):
+        with override_settings(MEDIA_ROOT=self.media):
+            self.client.get(reverse('download_report_file'), {'report_type': 'inventory', 'format': 'excel', 'background': '1'})
+            job = jobs.run_job(jobs.claim_next())
+            self.assertEqual((job.status, job.filename), ('done', 'relatorio_inventory.xlsx'))
+            self.assertIsNone(jobs.claim_next())
+
+
+    def test_job_expires_from_enqueue(self):
+        job = jobs.enqueue('report', {'query': {'report_type': 'inventory', 'format': 'excel'}})
+        self.assertIsNotNone(job.expires_at)
+        ReportJob.objects.filter(pk=job.pk).update(expires_at=timezone.now())
+        self.assertEqual(jobs.expire_jobs(), 1) # Pedido abandonado na fila também é apagado
+
+    def test_stale_running_job_is_requeued(self):
+        with override_settings(MEDIA_ROOT=self.media):
+            job = jobs.enqueue('report', {'query': {'report_type': 'inventory', 'format': 'excel'}})
+            self.assertEqual(jobs.claim_next().pk, job.pk)
+            self.assertIsNone(jobs.claim_next()) # Ainda 'running' e recente
+
+            # Começou há muito tempo, mas o worker segue dando sinal: não volta para a fila
+            ReportJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=2))
+            self.assertIsNone(jobs.claim_next())
+
+            # Worker caiu: o pedido continua 'running', vencido e sem sinal
+            ReportJob.objects.filter(pk=job.pk).update(
+                heartbeat_at=timezone.now() - timedelta(minutes=6), expires_at=timezone.now()
+            )
+            self.assertEqual(jobs.expire_jobs(), 0)
+            job = jobs.run_job(jobs.claim_next())
+            self.assertEqual(job.status, 'done')
+            self.assertGreater(job.expires_at, timezone.now())
+
+    @override_settings(REPORT_JOB_HEARTBEAT_SECONDS=0.05)
+    def test_heartbeat_while_job_runs(self):
+        jobs.enqueue('report', {'query': {'report_type': 'inventory', 'format': 'excel'}})
+        job = jobs.claim_next()
+        beats = []
+
+        def slow_render(job):
+            first = ReportJob.objects.get(pk=job.pk).heartbeat_at
+            time.sleep(0.3)
+            beats.append(ReportJob.objects.get(pk=job.pk).heartbeat_at > first)
+            return HttpResponse(b'ok', headers={'Content-Disposition': 'attachment; filename="lento.txt"'})
+
+        with override_settings(MEDIA_ROOT=self.media), mock.patch.object(jobs, 'render', slow_render):
+            job = jobs.run_job(job)
+        self.assertEqual((job.status, beats), ('done', [True]))
+
+    def test_worker_survives_unexpected_error(self):
+        first = jobs.enqueue('report', {'query': {'report_type': 'inventory', 'format': 'excel'}})
+        second = jobs.enqueue('report', {'query': {'report_type': 'inventory', 'format': 'pdf'}})
+
+        def run(job):
+            if job.pk == first.pk:
+                raise RuntimeError("banco indisponível")
+            return jobs.run_job(job)
+
+        def threaded(job):
+            if job.pk == first.pk:
+                raise RuntimeError("banco indisponível")
+            return jobs.run_in_thread(job)
+
+        for workers in ('1', '2'):
+            ReportJob.objects.filter(pk__in=[first.pk, second.pk]).update(status='pending')
+            stderr = StringIO()
+            with override_settings(MEDIA_ROOT=self.media), \
+                    mock.patch.object(run_report_worker, 'QUEUES', [(jobs.claim_next, threaded, run)]), \
+                    self.assertLogs(run_report_worker.logger, 'ERROR'):
+                call_command('run_report_worker', '--once', '--workers', workers, stdout=StringIO(), stderr=stderr)
+            self.assertIn("banco indisponível", stderr.getvalue())
+            self.assertEqual(ReportJob.objects.get(pk=first.pk).status, 'running') # Volta pelo requeue_stale
+            self.assertEqual(ReportJob.objects.get(pk=second.pk).status, 'done')
+
+
+class ImportParserTests(TestCase):
+    def setUp(self):
+        _thread_locals.user = None
+        self.admin = User.objects.create_superuser('admin', password='123')
+        self.client.force_login(self.admin)
+
+    def test_csv_latin1_with_semicolon(self):
+        content = 'Nome;Preço;Estoque\nÁgua de Colônia;10,50;3\nLoção;5;1\n'.encode('latin-1')
+        rows = parsers.read_rows(SimpleUploadedFile('lista.csv', content))
+        self.assertEqual(list(rows), [
+            {'Nome': 'Água de Colônia', 'Preço': '10,50', 'Estoque': '3'},
+            {'Nome': 'Loção', 'Preço': '5', 'Estoque': '1'},
+        ])
+
+    def test_json_is_decoded_across_read_blocks(self):
+        records = [{'nome': f'Perfume {i}', 'preço': 10 + i, 'notas': 'ç' * i} for i in range(50)]
+        content = json.dumps(records, ensure_ascii=False, indent=2).encode()
+        with mock.patch.object(parsers, 'READ_SIZE', 7):
+            rows = list(parsers.read_rows(SimpleUploadedFile('lista.json', content)))
+        self.assertEqual(rows, records)
+        with self.assertRaises(ValueError):
+            list(parsers.read_rows(SimpleUploadedFile('lista.json', b'{"nome": "x"}')))
+
+    def test_xlsx_header_detection_in_read_only_mode(self):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(['Tabela de Preços - Fornecedor'])
+        ws.append([])
+        ws.append(['Código de Barras', 'Nome', 'Preço', None])
+        ws.append([789, 'Perfume A', 99.9, 'ignorado'])
+        ws.append([None, None, None])
+        ws.append([790, 'Perfume B', 120.0])
+        output = BytesIO()
+        wb.save(output)
+
+        rows = list(parsers.read_rows(SimpleUploadedFile('lista.xlsx', output.getvalue())))
+        self.assertEqual(rows, [
+            {'código de barras': '789', 'nome': 'Perfume A', 'preço': '99.9'},
+            {'código de barras': '790', 'nome': 'Perfume B', 'preço': '120'},
+        ])
+
+    def test_empty_file_is_rejected_by_the_view(self):
+        response = self.client.post(reverse('import_data'), {'file': SimpleUploadedFile('vazio.csv', b'nome,preco\n')}, follow=True)
+        self.assertContains(response, 'O arquivo está vazio.')
+        self.assertFalse(ImportRun.objects.exists())
+
+
+class ImportRunTests(TestCase):
+    def setUp(self):
+        _thread_locals.user = None
+        self.admin = User.objects.create_superuser('admin', password='123')
+        self.client.force_login(self.admin)
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        self.content = ('nome,preço,estoque\n' + ''.join(f'Perfume {i},{i + 1},2\n' for i in range(30))).encode()
+
+    def upload(self, content, name='lista.csv'):
+        return self.client.post(reverse('import_data'), {'file': SimpleUploadedFile(name, content)})
+
+    def test_import_runs_in_worker_with_progress(self):
+        with override_settings(MEDIA_ROOT=self.media):
+            response = self.upload(self.content + b',sem nome,1\n')
+            run = ImportRun.objects.get()
+            self.assertRedirects(response, reverse('import_run_detail', args=[run.id]))
+            self.assertEqual((run.status, run.model_type), ('pending', 'products'))
+            self.assertFalse(Product.objects.exists()) # Nada é gravado na requisição
+
+            with mock.patch('reports.imports.IMPORT_BATCH_SIZE', 7):
+                call_command('run_report_worker', '--once', '--workers', '1', stdout=StringIO())
+            status = self.client.get(reverse('import_run_status', args=[run.id])).json()
+            self.assertEqual(
+                (status['status'], status['model_name'], status['rows_processed'], status['success_count'], status['error_count']),
+                ('done', 'Produtos', 31, 30, 1),
+            )
+            self.assertIn("não conter 'Nome'", status['errors'][0])
+            self.assertEqual(Product.objects.count(), 30)
+            run.refresh_from_db()
+            self.assertFalse(run.file) # Arquivo removido ao concluir
+
+    def test_crashed_import_resumes_from_last_chunk(self):
+        with override_settings(MEDIA_ROOT=self.media):
+            self.upload(self.content)
+            run = ImportRun.objects.get()
+            # Worker caiu depois de confirmar os 10 primeiros registros
+            for i in range(10):
+                Product.objects.create(name=f'Perfume {i}', selling_price=i + 1, stock_quantity=5)
+            ImportRun.objects.filter(pk=run.pk).update(status='running', rows_processed=10, success_count=10)
+            self.assertIsNone(imports.claim_next()) # Ainda não é considerado travado
+
+            ImportRun.objects.filter(pk=run.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+            run = imports.run_import(imports.claim_next())
+            self.assertEqual((run.status, run.rows_processed, run.success_count), ('done', 30, 30))
+            self.assertEqual(Product.objects.count(), 30)
+            # As linhas já confirmadas não foram aplicadas de novo
+            self.assertEqual(Product.objects.filter(stock_quantity=5).count(), 10)
+
+    def test_same_file_resumes_failed_import(self):
+        with override_settings(MEDIA_ROOT=self.media):
+            self.upload(self.content)
+            run = ImportRun.objects.get()
+            ImportRun.objects.filter(pk=run.pk).update(status='failed', rows_processed=20, error='Worker reiniciado')
+            response = self.upload(self.content, name='lista_de_novo.csv')
+            self.assertRedirects(response, reverse('import_run_detail', args=[run.id]))
+            run.refresh_from_db()
+            self.assertEqual((ImportRun.objects.count(), run.status, run.error), (1, 'pending', ''))
+
+            run = imports.run_import(imports.claim_next())
+            self.assertEqual(Product.objects.count(), 10) # Só as linhas 21 a 30
+
+@local_cache
+class FiscalDocumentTests(TestCase):
+    def setUp(self):
+        _thread_locals.user = None
+        cache.clear()
+        self.admin = User.objects.create_superuser('admin', password='123')
+        self.client.force_login(self.admin)
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        product = Product.objects.create(name='Perfume', selling_price=100, stock_quantity=10)
+        self.sale = Sale.objects.create(status='completed', payment_method='pix')
+        self.item = SaleItem.objects.create(sale=self.sale, product=product, quantity=1, price=100)
+
+    def download(self, doc_type='nfe', **headers):
+        return self.client.get(reverse('download_fiscal', args=[self.sale.id, doc_type]), headers=headers)
+
+    def test_rendered_once_and_served_from_storage(self):
+        with override_settings(MEDIA_ROOT=self.media), mock.patch('reports.fiscal.render', wraps=fiscal.render) as render:
+            first = self.download()
+            self.assertEqual(first['Content-Disposition'], 'attachment; filename="nfe_%d.xml"' % self.sale.id)
+            self.assertIn(b'<vNF>100.00</vNF>', b''.join(first.streaming_content))
+            second = self.download()
+            self.assertEqual(b''.join(second.streaming_content).count(b'<nNF>'), 1)
+            self.assertEqual(render.call_count, 1)
+            self.assertEqual(first['ETag'], second['ETag'])
+            self.assertIn('Last-Modified', second)
+
+            # O navegador que já tem o arquivo recebe 304
+            self.assertEqual(self.download(If_None_Match=first['ETag']).status_code, 304)
+            self.assertEqual(render.call_count, 1)
+
+    def test_pdf_documents(self):
+        with override_settings(MEDIA_ROOT=self.media):
+            for doc_type in ('cupom', 'danfe'):
+                response = self.download(doc_type)
+                self.assertEqual(response['Content-Type'], 'application/pdf')
+                self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+            self.assertEqual(FiscalDocument.objects.filter(sale=self.sale).count(), 2)
+
+    def test_edit_in_sale_detail_invalidates(self):
+        with override_settings(MEDIA_ROOT=self.media):
+            etag = self.download()['ETag']
+            path = FiscalDocument.objects.get().file.path
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('sale_detail', args=[self.sale.id]), {
+                    'payment_method': 'pix', 'created_at': '2026-01-10T10:00',
+                    f'quantity_{self.item.id}': '2', f'price_{self.item.id}': '90,00',
+                })
+            self.assertFalse(FiscalDocument.objects.exists())
+            self.assertFalse(os.path.exists(path)) # Arquivo antigo apagado
+
+            response = self.download(If_None_Match=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'<vNF>180.00</vNF>', b''.join(response.streaming_content))
+
+    def test_changes_elsewhere_change_the_hash(self):
+        with override_settings(MEDIA_ROOT=self.media), mock.patch('reports.fiscal.render', wraps=fiscal.render) as render:
+            etag = self.download()['ETag']
+            with self.captureOnCommitCallbacks(execute=True):
+                CompanySettings.objects.create(name='Nova Razão Social')
+            response = self.download(If_None_Match=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Nova Razão Social'.encode(), b''.join(response.streaming_content))
+            self.assertEqual((render.call_count, FiscalDocument.objects.count()), (2, 1))
+
+@local_cache
+class FiscalExportTests(TestCase):
+    def setUp(self):
+        _thread_locals.user = None
+        cache.clear()
+        self.admin = User.objects.create_superuser('admin', password='123')
+        self.client.force_login(self.admin)
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        product = Product.objects.create(name='Perfume', selling_price=100, stock_quantity=10)
+        self.sales = []
+        for day, status in ((10, 'completed'), (11, 'completed'), (12, 'pending'), (20, 'completed')):
+            sale = Sale.objects.create(status=status, payment_method='pix')
+            SaleItem.objects.create(sale=sale, product=product, quantity=1, price=100)
+            Sale.objects.filter(pk=sale.pk).update(created_at=timezone.make_aware(datetime(2026, 3, day, 15)))
+            self.sales.append(sale)
+
+    def export(self, **params):
+        params = {'start_date': '2026-03-01', 'end_date': '2026-03-15', **params}
+        return self.client.get(reverse('export_fiscal'), params)
+
+    def test_zip_with_completed_sales_of_the_period(self):
+        with override_settings(MEDIA_ROOT=self.media, FISCAL_EXPORT_WORKERS=1):
+            # O DANFE da 1ª venda já foi baixado: entra no ZIP sem ser gerado de novo
+            self.client.get(reverse('download_fiscal', args=[self.sales[0].id, 'danfe']))
+            with mock.patch('reports.fiscal.render', wraps=fiscal.render) as render:
+                response = self.export()
+                archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+            self.assertEqual(response['Content-Type'], 'application/zip')
+            self.assertEqual(sorted(archive.namelist()), [
+                f'danfe/danfe_{self.sales[0].id}.pdf', f'danfe/danfe_{self.sales[1].id}.pdf',
+                f'nfe/nfe_{self.sales[0].id}.xml', f'nfe/nfe_{self.sales[1].id}.xml',
+            ])
+            self.assertIsNone(archive.testzip())
+            self.assertIn(b'<vNF>100.00</vNF>', archive.read(f'nfe/nfe_{self.sales[1].id}.xml'))
+            self.assertEqual(render.call_count, 3)
+            # Os documentos gerados ficam gravados para os próximos downloads
+            self.assertEqual(FiscalDocument.objects.count(), 4)
+
+    def test_store_failure_still_sends_the_document(self):
+        with override_settings(MEDIA_ROOT=self.media, FISCAL_EXPORT_WORKERS=1), \
+                mock.patch('reports.fiscal.store', side_effect=OSError('disco cheio')):
+            response = self.export(doc_type='nfe')
+            archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(sorted(archive.namelist()), [
+            'erros.txt', f'nfe/nfe_{self.sales[0].id}.xml', f'nfe/nfe_{self.sales[1].id}.xml',
+        ])
+        self.assertIn('gerado, mas não gravado (disco cheio)', archive.read('erros.txt').decode())
+        self.assertFalse(FiscalDocument.objects.exists())
+
+    def test_doc_type_and_validation(self):
+        with override_settings(MEDIA_ROOT=self.media, FISCAL_EXPORT_WORKERS=1):
+            response = self.export(doc_type='nfe')
+            names = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))).namelist()
+            self.assertTrue(all(name.startswith('nfe/') for name in names))
+            self.assertRedirects(self.export(start_date=''), reverse('import_data'))
+            self.assertRedirects(self.export(start_date='2025-01-01', end_date='2025-01-31'), reverse('import_data'))
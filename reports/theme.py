@@ -0,0 +1,59 @@
+"""
+Tema visual (cores/fonte) vindo de CompanySettings.
+
+O middleware não consulta mais o banco a cada requisição: o dicionário do tema
+fica em memória de cada worker e só é recalculado quando a versão guardada no
+cache compartilhado muda (CompanySettings salvo/excluído, ver reports/models.py).
+"""
+from django.db import DatabaseError
+
+from core.versioning import get_version, bump_on_commit
+
+VERSION_KEY = 'theme:version'
+
+DEFAULT_THEME = {
+    'primary_color': '#3498db', 'secondary_color': '#2c3e50',
+    'background_color': '#f4f6f9', 'card_bg': '#ffffff',
+    'text_color': '#333333', 'font_family': "'Poppins', sans-serif", 'font_size': '14px'
+}
+
+_cached = (None, None) # (versão, tema) deste worker
+
+def get_theme_version():
+    return get_version(VERSION_KEY)
+
+def bump_theme_version():
+    """Invalida o tema guardado em todos os workers (após o commit)."""
+    bump_on_commit(VERSION_KEY)
+
+def build_theme():
+    """Lê CompanySettings e monta o dicionário usado pelo base.html."""
+    from .models import CompanySettings
+    try:
+        settings = CompanySettings.objects.only(
+            'primary_color', 'secondary_color', 'background_color', 'font_family', 'font_size'
+        ).first()
+    except DatabaseError:
+        # Banco ainda sem as tabelas (antes do migrate): usa o tema padrão
+        return dict(DEFAULT_THEME)
+    if settings is None:
+        return dict(DEFAULT_THEME)
+    return {
+        'primary_color': settings.primary_color,
+        'secondary_color': settings.secondary_color,
+        'background_color': settings.background_color,
+        'card_bg': '#ffffff',
+        'text_color': '#333333',
+        'font_family': f"'{settings.font_family}', sans-serif",
+        'font_size': f"{settings.font_size}px"
+    }
+
+def get_theme():
+    """Tema atual: uma leitura no cache compartilhado e, só se mudou, uma query."""
+    global _cached
+    version = get_theme_version()
+    cached_version, theme = _cached
+    if cached_version != version or theme is None:
+        theme = build_theme()
+        _cached = (version, theme)
+    return theme
@@ -11,13 +11,20 @@ urlpatterns = [
     path('exportar/', views.export_dashboard, name='export_dashboard'),
     path('download/<str:model_name>/<str:file_format>/', views.export_data, name='export_data'),
     path('importar/', views.import_data, name='import_data'),
+    path('importar/<int:run_id>/', views.import_run_detail, name='import_run_detail'),
+    path('importar/<int:run_id>/status/', views.import_run_status, name='import_run_status'),
     path('despesas/', views.expense_manage, name='expense_manage'),
     path('fiscal/download/<int:sale_id>/<str:doc_type>/', views.download_fiscal, name='download_fiscal'),
+    path('fiscal/exportar/', views.export_fiscal, name='export_fiscal'),
     path('backup/', views.download_db_backup, name='download_db_backup'),
     path('api/products/', sales_views.product_search_api, name='product_search_api'),
     path('api/customers/', sales_views.customer_search_api, name='customer_search_api'),
     path('save/', sales_views.save_sale, name='save_sale'),
+    path('relatorios/pagina/', views.report_preview_api, name='report_preview_api'),
     path('relatorios/download/', views.download_report_file, name='download_report_file'),
+    path('arquivos/<int:job_id>/', views.report_job_detail, name='report_job_detail'),
+    path('arquivos/<int:job_id>/status/', views.report_job_status, name='report_job_status'),
+    path('arquivos/<int:job_id>/download/', views.report_job_download, name='report_job_download'),
     path('vendas/excluir/<int:sale_id>/', views.delete_sale, name='delete_sale'),
     path('vendas/item/<int:item_id>/delete/', views.delete_sale_item, name='delete_sale_item'),
     path('vendas/detalhe/<int:sale_id>/', views.sale_detail, name='sale_detail'),
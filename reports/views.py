@@ -1,5 +1,5 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse, Http404
 from django import forms
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_exempt
@@ -7,18 +7,22 @@ from django.contrib.auth.decorators import login_required
 from decimal import Decimal
 from django.db import transaction
 from django.db.utils import OperationalError, ProgrammingError
-from django.db.models import Sum, Count, F, Avg, Q, Case, When, Value
-from django.db.models.functions import TruncMonth, ExtractHour
+from django.core.exceptions import ValidationError
+from django.db.models import Sum, F, Avg, Q, Case, When, Value, DecimalField
+from django.db.models.functions import TruncMonth, Coalesce
 from django.utils import timezone
 from django.conf import settings
 from datetime import date, timedelta
 from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.encoding import escape_uri_path
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.utils.dateparse import parse_datetime
 import json
+import itertools
 import unicodedata
 import csv
 import os
-from io import TextIOWrapper
 import calendar
 import re
 from datetime import datetime
@@ -32,16 +36,20 @@ except ImportError:
 
 from sales.models import Sale, SaleItem, AuditLog
 from products.models import Product, Brand, OlfactoryFamily, StockMovement, Category, Supplier, ProductComponent
+from products.ledger import post_movements
+from products.thumbnails import get_thumbnails
 from customers.models import Customer
 # from finance.models import Expense  <-- Removido, agora importamos do local correto
-from .models import CompanySettings, PaymentMethod, Expense
+from .models import CompanySettings, PaymentMethod, Expense, DailySalesSummary, ReportJob, ImportRun
+from .cache import cached_kpis
+from .registry import get_report
+from .xlsx import write_workbook, CONTENT_TYPE as XLSX_CONTENT_TYPE
+from .parsers import read_rows, UnsupportedFormat
+from . import fiscal, imports, jobs
 
 try:
     from reportlab.pdfgen import canvas
     from reportlab.lib.units import mm
-    from reportlab.graphics.barcode import qr
-    from reportlab.graphics.shapes import Drawing
-    from reportlab.graphics import renderPDF
 except ImportError:
     canvas = None
 
@@ -212,48 +220,208 @@ def home_view(request):
 # Alias para manter compatibilidade com config/urls.py que busca a view antiga
 company_settings = home_view
 
+def _period_filter(start_date, end_date, field='date'):
+    """Q() do período (limites opcionais) sobre o campo de data informado."""
+    q = Q()
+    if start_date:
+        q &= Q(**{f'{field}__gte': start_date})
+    if end_date:
+        q &= Q(**{f'{field}__lte': end_date})
+    return q
+
+def _sales_summary(start_date, end_date):
+    """Resumo Diário de Vendas (DailySalesSummary) filtrado pelo período."""
+    return DailySalesSummary.objects.filter(_period_filter(start_date, end_date))
+
+def _calculate_metrics_for_periods(periods):
+    """
+    Calcula os KPIs financeiros de vários períodos [(início, fim), ...] de uma vez:
+    uma única consulta no Resumo Diário com agregação condicional (Sum(..., filter=...))
+    para receita, quantidade de vendas e CMV de todos os períodos, e uma consulta de despesas.
+    Retorna uma lista de dicionários (mesma ordem dos períodos).
+    """
+    sales_aggregates = {}
+    expense_aggregates = {}
+    filters = []
+    for i, (start_date, end_date) in enumerate(periods):
+        in_period = _period_filter(start_date, end_date)
+        filters.append(in_period)
+        sales_aggregates[f'revenue_{i}'] = Sum('revenue', filter=in_period)
+        sales_aggregates[f'count_{i}'] = Sum('sale_count', filter=in_period)
+        sales_aggregates[f'cost_{i}'] = Sum('cost', filter=in_period)
+        expense_aggregates[f'expenses_{i}'] = Sum('amount', filter=in_period)
+
+    # Restringe as linhas lidas à união dos períodos (usa o índice de data).
+    # Um período sem limites (Q() vazio) significa "tudo".
+    where = Q()
+    if all(filters):
+        for in_period in filters:
+            where |= in_period
+
+    totals = DailySalesSummary.objects.filter(where).aggregate(**sales_aggregates)
+    expenses = Expense.objects.filter(where).aggregate(**expense_aggregates)
+
+    results = []
+    for i in range(len(periods)):
+        total_revenue = totals[f'revenue_{i}'] or 0
+        total_count = totals[f'count_{i}'] or 0
+        avg_ticket = (total_revenue / total_count) if total_count > 0 else 0
+        total_cost = totals[f'cost_{i}'] or 0
+        total_expenses = expenses[f'expenses_{i}'] or 0
+        gross_profit = total_revenue - total_cost
+        net_profit = gross_profit - total_expenses
+        profit_margin = (gross_profit / total_revenue * 100) if total_revenue > 0 else 0
+
+        results.append({
+            'total_revenue': float(total_revenue),
+            'total_count': int(total_count),
+            'avg_ticket': float(avg_ticket),
+            'total_cost': float(total_cost),
+            'gross_profit': float(gross_profit),
+            'total_expenses': float(total_expenses),
+            'net_profit': float(net_profit),
+            'profit_margin': float(profit_margin)
+        })
+    return results
+
 def _calculate_sales_metrics(start_date, end_date):
     """
     Função Auxiliar (Privada): Calcula todos os KPIs (Indicadores) financeiros
     para um intervalo de datas específico. Retorna um dicionário com os valores.
     """
-    # Filtra vendas finalizadas
+    return _calculate_metrics_for_periods([(start_date, end_date)])[0]
+
+def _monthly_profit_series(start_date_str, end_date_str):
+    """
+    Evolução Mensal (Receita, CMV, Despesas e Lucro) para o gráfico do Dashboard.
+    São sempre 2 consultas agrupadas por mês (TruncMonth): Resumo Diário de Vendas
+    (receita e CMV) e despesas, qualquer que seja o tamanho do período; os meses
+    são montados em Python, garantindo que despesas entrem mesmo em meses sem vendas.
+    """
+    if not (start_date_str and end_date_str):
+        return []
+    try:
+        dt_start = datetime.strptime(start_date_str, '%Y-%m-%d').date().replace(day=1)
+        dt_end = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+    except ValueError:
+        return [] # Datas inválidas
+    # Meses completos: do dia 1 do mês inicial ao último dia do mês final
+    dt_end = dt_end.replace(day=calendar.monthrange(dt_end.year, dt_end.month)[1])
+
+    # 1. Receita e Custo do Produto (CMV) por Mês (Vendas Finalizadas)
+    revenue_by_month = {}
+    cost_by_month = {}
+    for row in _sales_summary(dt_start, dt_end).annotate(month=TruncMonth('date'))\
+            .values('month').annotate(revenue=Sum('revenue'), cost=Sum('cost')).order_by():
+        key = row['month'].strftime('%Y-%m')
+        revenue_by_month[key] = row['revenue'] or 0
+        cost_by_month[key] = row['cost'] or 0
+
+    # 2. Despesas Operacionais por Mês (Considera parcelas que caem em cada mês)
+    expenses_by_month = {
+        row['month'].strftime('%Y-%m'): row['total'] or Decimal('0')
+        for row in Expense.objects.filter(date__gte=dt_start, date__lte=dt_end)
+        .annotate(month=TruncMonth('date')).values('month').annotate(total=Sum('amount')).order_by()
+    }
+
+    monthly_profit = []
+    current_dt = dt_start
+    while current_dt <= dt_end:
+        key = current_dt.strftime('%Y-%m')
+        month_revenue = revenue_by_month.get(key, 0)
+        month_cost = cost_by_month.get(key, 0)
+        month_expenses = expenses_by_month.get(key, Decimal('0'))
+
+        # Apenas adiciona ao gráfico se houver alguma movimentação financeira
+        if month_revenue > 0 or month_expenses > 0:
+            monthly_profit.append({
+                'month': key,
+                'revenue': float(month_revenue),
+                'cost': float(month_cost),
+                'expenses': float(month_expenses),
+                # Lucro Líquido = Receita - Custo Produto - Despesas
+                'profit': float(month_revenue - month_cost - month_expenses)
+            })
+
+        # Avança para o próximo mês
+        days_in_month = calendar.monthrange(current_dt.year, current_dt.month)[1]
+        current_dt = current_dt + timedelta(days=days_in_month)
+    return monthly_profit
+
+def _completed_sales(start_date_str, end_date_str):
+    """Vendas finalizadas do período (consultas que precisam das vendas em si)."""
     sales_qs = Sale.objects.filter(status='completed')
-    if start_date:
-        sales_qs = sales_qs.filter(created_at__date__gte=start_date)
-    if end_date:
-        sales_qs = sales_qs.filter(created_at__date__lte=end_date)
-    
-    expenses_qs = Expense.objects.all()
-    if start_date:
-        expenses_qs = expenses_qs.filter(date__gte=start_date)
-    if end_date:
-        expenses_qs = expenses_qs.filter(date__lte=end_date)
+    if start_date_str:
+        sales_qs = sales_qs.filter(created_at__date__gte=start_date_str)
+    if end_date_str:
+        sales_qs = sales_qs.filter(created_at__date__lte=end_date_str)
+    return sales_qs
 
-    # Soma o total das vendas
-    total_revenue = sales_qs.aggregate(Sum('total'))['total__sum'] or 0
-    total_count = sales_qs.count()
-    avg_ticket = (total_revenue / total_count) if total_count > 0 else 0
+def _dashboard_kpis(start_date_str, end_date_str, compare_start_date_str, compare_end_date_str):
+    """
+    Calcula os KPIs do Dashboard (métricas, comparação, evolução mensal, pagamentos,
+    horários de pico e top produtos). Resultado guardado no cache (reports/cache.py).
+    """
+    # 1. Métricas de Vendas e Financeiras (período principal e, se houver, comparação na mesma consulta)
+    compare = bool(compare_start_date_str and compare_end_date_str)
+    periods = [(start_date_str, end_date_str)]
+    if compare:
+        periods.append((compare_start_date_str, compare_end_date_str))
+    metrics = _calculate_metrics_for_periods(periods)
+    sales_metrics = metrics[0]
 
-    # Calcula Custo da Mercadoria Vendida (CMV)
-    total_cost = SaleItem.objects.filter(sale__in=sales_qs).aggregate(
-        cost=Sum(F('product__cost_price') * F('quantity'))
-    )['cost'] or 0
+    # [MELHORIA] Lógica de Comparação de Períodos
+    if compare:
+        comparison_metrics = metrics[1]
+        
+        # Calcula a variação percentual para cada KPI
+        for key in ['total_revenue', 'total_count', 'avg_ticket', 'net_profit', 'total_expenses']:
+            current_val = sales_metrics.get(key, 0)
+            previous_val = comparison_metrics.get(key, 0)
+            
+            if previous_val != 0:
+                change = ((current_val - previous_val) / abs(previous_val)) * 100
+            elif current_val > 0:
+                change = 100.0 # Crescimento "infinito" se o anterior era zero
+            else:
+                change = 0.0
+            
+            # Inverte a lógica para despesas: uma queda é um resultado positivo
+            if key == 'total_expenses':
+                change *= -1
+
+            sales_metrics[f'{key}_change'] = change
+
+    # 1.2 Evolução Mensal (Vendas e Lucros)
+    monthly_profit = _monthly_profit_series(start_date_str, end_date_str)
+
+    # 1.3 Vendas por Forma de Pagamento (Resumo Diário)
+    summary_qs = _sales_summary(start_date_str, end_date_str)
+    payment_stats_qs = summary_qs.values('payment_method')\
+        .annotate(total=Sum('revenue'), count=Sum('sale_count'))\
+        .order_by('-total')
+    
+    payment_stats = list(payment_stats_qs)
+
+    # 1.4 Horários de Pico (Operacional)
+    peak_hours_qs = summary_qs.values('hour')\
+        .annotate(count=Sum('sale_count'))\
+        .order_by('hour')
+    
+    peak_hours = [{'hour': item['hour'], 'count': item['count']} for item in peak_hours_qs]
 
-    total_expenses = expenses_qs.aggregate(Sum('amount'))['amount__sum'] or 0
-    gross_profit = total_revenue - total_cost
-    net_profit = gross_profit - total_expenses
-    profit_margin = (gross_profit / total_revenue * 100) if total_revenue > 0 else 0
+    # 2. Top Produtos
+    top_products = SaleItem.objects.filter(sale__in=_completed_sales(start_date_str, end_date_str))\
+        .values('product__name')\
+        .annotate(total_qty=Sum('quantity'))\
+        .order_by('-total_qty')[:5]
 
     return {
-        'total_revenue': float(total_revenue),
-        'total_count': int(total_count),
-        'avg_ticket': float(avg_ticket),
-        'total_cost': float(total_cost),
-        'gross_profit': float(gross_profit),
-        'total_expenses': float(total_expenses),
-        'net_profit': float(net_profit),
-        'profit_margin': float(profit_margin)
+        'sales_metrics': sales_metrics,
+        'monthly_profit': monthly_profit,
+        'payment_stats': payment_stats,
+        'peak_hours': peak_hours,
+        'top_products': list(top_products),
     }
 
 @admin_required
@@ -294,114 +462,20 @@ def reports_dashboard(request):
             start_date_str = today.replace(month=1, day=1).strftime('%Y-%m-%d')
             end_date_str = today.strftime('%Y-%m-%d')
     
-    # 1. Métricas de Vendas e Financeiras (período principal)
-    sales_metrics = _calculate_sales_metrics(start_date_str, end_date_str)
-
-    # [MELHORIA] Lógica de Comparação de Períodos
-    if compare_start_date_str and compare_end_date_str:
-        comparison_metrics = _calculate_sales_metrics(compare_start_date_str, compare_end_date_str)
-        
-        # Calcula a variação percentual para cada KPI
-        for key in ['total_revenue', 'total_count', 'avg_ticket', 'net_profit', 'total_expenses']:
-            current_val = sales_metrics.get(key, 0)
-            previous_val = comparison_metrics.get(key, 0)
-            
-            if previous_val != 0:
-                change = ((current_val - previous_val) / abs(previous_val)) * 100
-            elif current_val > 0:
-                change = 100.0 # Crescimento "infinito" se o anterior era zero
-            else:
-                change = 0.0
-            
-            # Inverte a lógica para despesas: uma queda é um resultado positivo
-            if key == 'total_expenses':
-                change *= -1
-
-            sales_metrics[f'{key}_change'] = change
-
-    # Recria o queryset principal para os relatórios de "Top Produtos", etc.
-    sales_qs = Sale.objects.filter(status='completed')
-    if start_date_str:
-        sales_qs = sales_qs.filter(created_at__date__gte=start_date_str)
-    if end_date_str:
-        sales_qs = sales_qs.filter(created_at__date__lte=end_date_str)
-    
-    # 1.2 Evolução Mensal (Vendas e Lucros)
-    # Gera loop preciso mês a mês para popular o gráfico, garantindo que despesas entrem
-    # mesmo em meses sem vendas.
-    monthly_profit = []
-    
-    if start_date_str and end_date_str:
-        try:
-            # Converte para objetos date
-            dt_start = datetime.strptime(start_date_str, '%Y-%m-%d').date().replace(day=1)
-            dt_end = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-            
-            # Loop iterando pelo primeiro dia de cada mês
-            current_dt = dt_start
-            
-            while current_dt <= dt_end.replace(day=1):
-                year = current_dt.year
-                month = current_dt.month
-                
-                # 1. Receita do Mês (Vendas Finalizadas)
-                month_revenue = Sale.objects.filter(
-                    status='completed',
-                    created_at__year=year, 
-                    created_at__month=month
-                ).aggregate(total=Sum('total'))['total'] or 0
-                
-                # 2. Custo do Produto (CMV) do Mês
-                month_cost = SaleItem.objects.filter(
-                    sale__status='completed', 
-                    sale__created_at__year=year, 
-                    sale__created_at__month=month
-                ).aggregate(cost=Sum(F('product__cost_price') * F('quantity')))['cost'] or 0
-                
-                # 3. Despesas Operacionais do Mês (Considera parcelas que caem neste mês)
-                month_expenses = Expense.objects.filter(
-                    date__year=year, date__month=month
-                ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
-
-                # Apenas adiciona ao gráfico se houver alguma movimentação financeira
-                if month_revenue > 0 or month_expenses > 0:
-                    monthly_profit.append({
-                        'month': current_dt.strftime('%Y-%m'),
-                        'revenue': float(month_revenue),
-                        'cost': float(month_cost),
-                        'expenses': float(month_expenses),
-                        # Lucro Líquido = Receita - Custo Produto - Despesas
-                        'profit': float(month_revenue - month_cost - month_expenses) 
-                    })
-                
-                # Avança para o próximo mês
-                days_in_month = calendar.monthrange(current_dt.year, current_dt.month)[1]
-                current_dt = current_dt + timedelta(days=days_in_month)
-                current_dt = current_dt.replace(day=1)
-        except ValueError:
-            pass # Datas inválidas
-
-    # 1.3 Vendas por Forma de Pagamento
-    payment_stats_qs = sales_qs.values('payment_method')\
-        .annotate(total=Sum('total'), count=Count('id'))\
-        .order_by('-total')
-    
-    payment_stats = list(payment_stats_qs)
+    # 1 e 2. KPIs, gráficos e Top Produtos: guardados no cache por (período, comparação, versão dos dados)
+    kpis = cached_kpis(
+        lambda: _dashboard_kpis(start_date_str, end_date_str, compare_start_date_str, compare_end_date_str),
+        start_date_str, end_date_str, compare_start_date_str, compare_end_date_str
+    )
+    sales_metrics = kpis['sales_metrics']
+    monthly_profit = kpis['monthly_profit']
+    payment_stats = kpis['payment_stats']
+    peak_hours = kpis['peak_hours']
+    top_products = kpis['top_products']
 
-    # 1.4 Horários de Pico (Operacional)
-    peak_hours_qs = sales_qs.annotate(hour=ExtractHour('created_at'))\
-        .values('hour')\
-        .annotate(count=Count('id'))\
-        .order_by('hour')
-    
-    peak_hours = [{'hour': item['hour'], 'count': item['count']} for item in peak_hours_qs]
+    # Recria o queryset principal para a lista de vendas recentes
+    sales_qs = _completed_sales(start_date_str, end_date_str)
 
-    # 2. Top Produtos
-    top_products = SaleItem.objects.filter(sale__in=sales_qs)\
-        .values('product__name')\
-        .annotate(total_qty=Sum('quantity'))\
-        .order_by('-total_qty')[:5]
-        
     # 3. Métricas de Estoque
     stock_metrics = Product.objects.aggregate(
         total_value=Sum(F('stock_quantity') * F('cost_price')),
@@ -422,11 +496,11 @@ def reports_dashboard(request):
     report_type = request.GET.get('report_type')
     report_data = None
     if report_type:
-        # Gera os dados do relatório escolhido para exibir na tela
-        r_title, r_headers, r_data, r_summary = _get_report_data(report_type, start_date_str, end_date_str, request=request)
-        report_data = {
-            'title': r_title, 'headers': r_headers, 'data': r_data, 'summary': r_summary
-        }
+        # Só a primeira página vai no HTML; as seguintes vêm de report_preview_api
+        report = get_report(report_type)
+        if report:
+            report_data = _report_page(request, report, start_date_str, end_date_str)
+            report_data['summary'] = report_data.pop('result').summary
 
     context = {
         'sales_metrics': sales_metrics,
@@ -461,40 +535,98 @@ def reports_dashboard(request):
     }
     return render(request, 'reports/index.html', context)
 
+REPORT_PAGE_SIZE = 50
+
+def _report_page(request, report, start_date, end_date):
+    """Uma página do relatório (ordenação e cursor vindos da URL) + links de ordenação das colunas."""
+    sort = request.GET.get('sort')
+    result = report.run(start_date, end_date, request.GET, sort=sort)
+    rows, next_cursor = result.page(request.GET.get('cursor'), size=REPORT_PAGE_SIZE)
+
+    columns = []
+    for index, column in enumerate(report.columns):
+        url = None
+        if column.sort is not None:
+            params = request.GET.copy()
+            params.pop('cursor', None)
+            # Clicar na coluna já ordenada inverte a direção
+            descending = not result.descending if index == result.sort_index else False
+            params['sort'] = f"{'-' if descending else ''}{index}"
+            url = '?' + params.urlencode()
+        arrow = ''
+        if index == result.sort_index:
+            arrow = '▼' if result.descending else '▲'
+        columns.append({'header': column.header, 'url': url, 'arrow': arrow})
+
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    params['start_date'] = start_date or ''
+    params['end_date'] = end_date or ''
+    return {
+        'title': result.title, 'headers': result.headers, 'columns': columns, 'data': rows,
+        'next_cursor': next_cursor, 'page_url': reverse('report_preview_api') + '?' + params.urlencode(),
+        'result': result,
+    }
+
+@admin_required
+@login_required
+def report_preview_api(request):
+    """Próximas páginas da visualização do relatório (JSON, paginação por cursor)."""
+    report = get_report(request.GET.get('report_type'))
+    if not report:
+        return JsonResponse({'status': 'error', 'message': 'Tipo de relatório inválido'}, status=400)
+    try:
+        page = _report_page(request, report, request.GET.get('start_date'), request.GET.get('end_date'))
+    except (ValidationError, ValueError, TypeError):
+        return JsonResponse({'status': 'error', 'message': 'Cursor inválido'}, status=400)
+    return JsonResponse({'rows': page['data'], 'next_cursor': page['next_cursor']}, encoder=DjangoJSONEncoder)
+
+def _job_query(request):
+    query = request.GET.dict()
+    query.pop('background', None)
+    return query
+
+def _enqueue_job(request, kind, params):
+    """Coloca a geração do arquivo na fila (run_report_worker) e abre a página de acompanhamento."""
+    job = jobs.enqueue(kind, params, request.user)
+    messages.success(request, "Arquivo colocado na fila. O download aparece aqui quando estiver pronto.")
+    return redirect('report_job_detail', job_id=job.id)
+
 @admin_required
 @login_required
 def download_report_file(request):
-    report_type = request.GET.get('report_type', 'sales')
-    file_format = request.GET.get('format', 'excel')
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
+    if not get_report(request.GET.get('report_type', 'sales')):
+        messages.error(request, "Tipo de relatório inválido.")
+        return redirect('reports_dashboard')
+    # Relatórios grandes: '?background=1' gera o arquivo fora da requisição
+    if request.GET.get('background'):
+        return _enqueue_job(request, 'report', {'query': _job_query(request)})
+    return render_report_file(request.GET)
+
+def render_report_file(params):
+    """Gera o Excel/PDF do relatório (usado pela view e pelo worker de ReportJob)."""
+    report_type = params.get('report_type', 'sales')
+    file_format = params.get('format', 'excel')
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
     
-    title, headers, data, summary = _get_report_data(report_type, start_date, end_date, request=request)
+    report = get_report(report_type)
+    if not report:
+        return HttpResponse("Tipo de relatório inválido.", status=400)
+    result = report.run(start_date, end_date, params)
+    title, headers, summary = result.title, result.headers, result.summary
     
     if file_format == 'excel':
         try:
-            response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response['Content-Disposition'] = f'attachment; filename="{escape_uri_path("relatorio_" + report_type)}.xlsx"'
-            
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "Relatório"
-            
-            ws.append([title])
-            ws.append([f"Período: {start_date or 'Início'} a {end_date or 'Hoje'}"])
-            ws.append([])
-            ws.append(headers)
-            
-            for row in data:
-                # Garante que os dados sejam strings para evitar erros de tipo no Excel
-                ws.append([str(cell) if cell is not None else "" for cell in row])
-                
-            ws.append([])
-            for k, v in summary.items():
-                ws.append([k.replace('_', ' ').title(), str(v)])
-                
-            wb.save(response)
-            return response
+            # Planilha write-only, com números/datas no tipo original (o Excel consegue somar)
+            rows = itertools.chain(
+                [[title], [f"Período: {start_date or 'Início'} a {end_date or 'Hoje'}"], [], headers],
+                result.values(),
+                [[]],
+                ([k.replace('_', ' ').title(), v] for k, v in result.totals.items()),
+            )
+            output = write_workbook(rows, "Relatório")
+            return FileResponse(output, as_attachment=True, filename=f"relatorio_{report_type}.xlsx", content_type=XLSX_CONTENT_TYPE)
         except Exception as e:
             return HttpResponse(f"Erro ao gerar Excel: {str(e)}", status=500)
 
@@ -515,7 +647,7 @@ def download_report_file(request):
         elements.append(Paragraph(f"Período: {start_date or 'Início'} a {end_date or 'Hoje'}", styles['Normal']))
         elements.append(Spacer(1, 12))
         
-        table_data = [headers] + data
+        table_data = [headers] + list(result.rows())
         t = Table(table_data)
         t.setStyle(TableStyle([
             ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
@@ -538,204 +670,6 @@ def download_report_file(request):
 
     return redirect('reports_dashboard')
 
-def _get_report_data(report_type, start_date, end_date, request=None):
-    """
-    Motor de Relatórios: Função genérica que retorna (Título, Cabeçalhos, Dados, Resumo).
-    Isso permite que a mesma lógica alimente a visualização na tela, o PDF e o Excel,
-    mantendo o princípio DRY (Don't Repeat Yourself).
-    """
-    data = []
-    headers = []
-    title = ""
-    summary = {}
-
-    # CORREÇÃO DO ERRO: Tratamento para datas "None" ou vazias
-    if start_date in ['None', '', None]: start_date = None
-    if end_date in ['None', '', None]: end_date = None
-
-    if report_type == 'sales':
-        qs = Sale.objects.all().select_related('customer').order_by('-created_at')
-        if start_date: qs = qs.filter(created_at__date__gte=start_date)
-        if end_date: qs = qs.filter(created_at__date__lte=end_date)
-        title = "Relatório Geral de Vendas"
-        headers = ['ID', 'Data', 'Cliente', 'Status', 'Pagamento', 'Total']
-        for s in qs:
-            data.append([s.id, s.created_at.strftime('%d/%m/%Y %H:%M'), s.customer.name if s.customer else 'Consumidor Final', s.get_status_display(), s.get_payment_method_display(), f"R$ {s.total:.2f}"])
-        summary['total_vendas'] = f"R$ {sum(s.total for s in qs):.2f}"
-
-    elif report_type == 'pending':
-        qs = Sale.objects.filter(status='pending').select_related('customer').prefetch_related('items__product').order_by('-created_at')
-        if start_date: qs = qs.filter(created_at__date__gte=start_date)
-        if end_date: qs = qs.filter(created_at__date__lte=end_date)
-        title = "Relatório de Vendas Pendentes / Orçamentos"
-        headers = ['ID', 'Data', 'Cliente', 'Produtos', 'Qtd. Total', 'Valor Total']
-        for s in qs:
-            products_list = [f"{item.product.name} ({item.quantity})" for item in s.items.all()]
-            products_str = "; ".join(products_list)
-            total_qty = sum(item.quantity for item in s.items.all())
-            data.append([s.id, s.created_at.strftime('%d/%m/%Y %H:%M'), s.customer.name if s.customer else 'Consumidor Final', products_str, total_qty, f"R$ {s.total:.2f}"])
-        summary['total_pendente'] = f"R$ {sum(s.total for s in qs):.2f}"
-
-    elif report_type == 'inventory':
-        qs = Product.objects.all().order_by('name')
-        
-        # --- Filtros Profissionais Adicionais ---
-        if request:
-            brand_id = request.GET.get('brand')
-            if brand_id and brand_id != 'all':
-                qs = qs.filter(brand_id=brand_id)
-
-            category_id = request.GET.get('category')
-            if category_id and category_id != 'all':
-                qs = qs.filter(category_id=category_id)
-
-            supplier_id = request.GET.get('supplier')
-            if supplier_id and supplier_id != 'all':
-                qs = qs.filter(supplier_id=supplier_id)
-                
-            stock_status = request.GET.get('stock_status')
-            if stock_status == 'in_stock':
-                qs = qs.filter(stock_quantity__gt=0)
-            elif stock_status == 'low_stock':
-                qs = qs.filter(stock_quantity__lte=F('min_stock'))
-            elif stock_status == 'out_of_stock':
-                qs = qs.filter(stock_quantity__lte=0)
-
-        title = "Relatório de Estoque e Valoração"
-        headers = ['Produto', 'Marca', 'Estoque', 'Custo Unit.', 'Venda Unit.', 'Total Custo', 'Total Venda']
-        total_cost = 0
-        total_sale = 0
-        for p in qs:
-            t_cost = p.stock_quantity * p.cost_price
-            t_sale = p.stock_quantity * p.selling_price
-            total_cost += t_cost
-            total_sale += t_sale
-            data.append([p.name, p.brand.name if p.brand else '-', p.stock_quantity, f"R$ {p.cost_price:.2f}", f"R$ {p.selling_price:.2f}", f"R$ {t_cost:.2f}", f"R$ {t_sale:.2f}"])
-        summary['custo_total'] = f"R$ {total_cost:.2f}"
-        summary['venda_total'] = f"R$ {total_sale:.2f}"
-        summary['lucro_potencial'] = f"R$ {total_sale - total_cost:.2f}"
-
-    elif report_type == 'best_sellers':
-        qs = SaleItem.objects.filter(sale__status='completed')
-        if start_date: qs = qs.filter(sale__created_at__date__gte=start_date)
-        if end_date: qs = qs.filter(sale__created_at__date__lte=end_date)
-        qs = qs.values('product__name').annotate(total_qty=Sum('quantity'), total_rev=Sum(F('quantity') * F('price'))).order_by('-total_qty')
-        title = "Produtos Mais Vendidos"
-        headers = ['Produto', 'Qtd. Vendida', 'Receita Total']
-        for item in qs:
-            data.append([item['product__name'], item['total_qty'], f"R$ {item['total_rev']:.2f}"])
-
-    elif report_type == 'sales_by_customer':
-        qs = Sale.objects.filter(status='completed')
-        if start_date: qs = qs.filter(created_at__date__gte=start_date)
-        if end_date: qs = qs.filter(created_at__date__lte=end_date)
-        qs = qs.values('customer__name').annotate(total_spent=Sum('total'), count=Count('id')).order_by('-total_spent')
-        title = "Vendas por Cliente"
-        headers = ['Cliente', 'Qtd. Compras', 'Total Gasto']
-        for item in qs:
-            name = item['customer__name'] if item['customer__name'] else 'Consumidor Final'
-            data.append([name, item['count'], f"R$ {item['total_spent']:.2f}"])
-
-    elif report_type == 'sales_by_brand':
-        qs = SaleItem.objects.filter(sale__status='completed')
-        if start_date: qs = qs.filter(sale__created_at__date__gte=start_date)
-        if end_date: qs = qs.filter(sale__created_at__date__lte=end_date)
-        qs = qs.values('product__brand__name').annotate(total_sold=Sum(F('quantity') * F('price')), qty=Sum('quantity')).order_by('-total_sold')
-        title = "Vendas por Marca"
-        headers = ['Marca', 'Qtd. Itens', 'Total Vendido']
-        for item in qs:
-            brand = item['product__brand__name'] if item['product__brand__name'] else 'Sem Marca'
-            data.append([brand, item['qty'], f"R$ {item['total_sold']:.2f}"])
-
-    elif report_type == 'sales_by_user':
-        qs = Sale.objects.filter(status='completed')
-        if start_date: qs = qs.filter(created_at__date__gte=start_date)
-        if end_date: qs = qs.filter(created_at__date__lte=end_date)
-        qs = qs.values('salesperson__username').annotate(total_sold=Sum('total'), count=Count('id')).order_by('-total_sold')
-        title = "Vendas por Vendedor"
-        headers = ['Vendedor', 'Qtd. Vendas', 'Total Vendido']
-        for item in qs:
-            user = item['salesperson__username'] if item['salesperson__username'] else 'Sistema'
-            data.append([user, item['count'], f"R$ {item['total_sold']:.2f}"])
-
-    elif report_type == 'sales_by_payment':
-        qs = Sale.objects.filter(status='completed')
-        if start_date: qs = qs.filter(created_at__date__gte=start_date)
-        if end_date: qs = qs.filter(created_at__date__lte=end_date)
-        qs = qs.values('payment_method').annotate(total=Sum('total'), count=Count('id')).order_by('-total')
-        title = "Vendas por Forma de Pagamento"
-        headers = ['Forma de Pagamento', 'Qtd. Vendas', 'Total']
-        payment_map = {'pix': 'PIX', 'credit': 'Crédito', 'debit': 'Débito', 'cash': 'Dinheiro'}
-        for item in qs:
-            method = payment_map.get(item['payment_method'], item['payment_method'])
-            data.append([method, item['count'], f"R$ {item['total']:.2f}"])
-
-    elif report_type == 'profit_by_product':
-        qs = SaleItem.objects.filter(sale__status='completed').select_related('product')
-        if start_date: qs = qs.filter(sale__created_at__date__gte=start_date)
-        if end_date: qs = qs.filter(sale__created_at__date__lte=end_date)
-        
-        # Agrupamento em Python pois o custo está no produto
-        product_stats = {}
-        for item in qs:
-            pid = item.product.id
-            if pid not in product_stats:
-                product_stats[pid] = {'name': item.product.name, 'qty': 0, 'revenue': 0, 'cost': 0}
-            
-            product_stats[pid]['qty'] += item.quantity
-            product_stats[pid]['revenue'] += item.price * item.quantity
-            # Nota: Usa o custo atual do produto
-            product_stats[pid]['cost'] += item.product.cost_price * item.quantity
-            
-        title = "Relatório de Lucro por Produto"
-        headers = ['Produto', 'Qtd Vendida', 'Receita Total', 'Custo Total', 'Lucro Bruto', 'Margem %']
-        
-        total_gross_profit = 0
-        sorted_stats = sorted(product_stats.values(), key=lambda x: x['revenue'] - x['cost'], reverse=True)
-        
-        for p in sorted_stats:
-            profit = p['revenue'] - p['cost']
-            margin = (profit / p['revenue'] * 100) if p['revenue'] > 0 else 0
-            total_gross_profit += profit
-            data.append([p['name'], p['qty'], f"R$ {p['revenue']:.2f}", f"R$ {p['cost']:.2f}", f"R$ {profit:.2f}", f"{margin:.1f}%"])
-            
-        summary['lucro_bruto_total'] = f"R$ {total_gross_profit:.2f}"
-
-    elif report_type == 'profit_by_sale':
-        qs = Sale.objects.filter(status='completed').prefetch_related('items__product').order_by('-created_at')
-        if start_date: qs = qs.filter(created_at__date__gte=start_date)
-        if end_date: qs = qs.filter(created_at__date__lte=end_date)
-        
-        title = "Relatório de Lucro por Venda"
-        headers = ['ID Venda', 'Data', 'Cliente', 'Total Venda', 'Custo Produtos', 'Lucro', 'Margem %']
-        
-        total_profit_period = 0
-        for s in qs:
-            cost = sum(item.product.cost_price * item.quantity for item in s.items.all())
-            profit = s.total - cost
-            margin = (profit / s.total * 100) if s.total > 0 else 0
-            total_profit_period += profit
-            data.append([s.id, s.created_at.strftime('%d/%m/%Y'), s.customer.name if s.customer else 'Consumidor', f"R$ {s.total:.2f}", f"R$ {cost:.2f}", f"R$ {profit:.2f}", f"{margin:.1f}%"])
-            
-        summary['lucro_liquido_periodo'] = f"R$ {total_profit_period:.2f}"
-
-    elif report_type == 'financial_expenses':
-        qs = Expense.objects.all().order_by('-date')
-        if start_date: qs = qs.filter(date__gte=start_date)
-        if end_date: qs = qs.filter(date__lte=end_date)
-        
-        title = "Relatório de Despesas Operacionais"
-        headers = ['Data', 'Descrição', 'Categoria', 'Valor']
-        
-        total_exp = 0
-        for e in qs:
-            total_exp += e.amount
-            data.append([e.date.strftime('%d/%m/%Y'), e.description, e.get_category_display(), f"R$ {e.amount:.2f}"])
-        
-        summary['total_despesas'] = f"R$ {total_exp:.2f}"
-
-    return title, headers, data, summary
-
 @admin_required
 @login_required
 def export_dashboard(request):
@@ -746,26 +680,66 @@ def export_dashboard(request):
     }
     return render(request, 'reports/export.html', context)
 
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_MODELS = ('products', 'sales', 'customers', 'financial')
+EXPORT_FORMATS = ('csv', 'ndjson', 'excel', 'pdf', 'json')
+CATALOG_ROWS_PER_TABLE = 2 # Linhas de cards por página do catálogo (paisagem)
+
+class _Echo:
+    """Pseudo-arquivo para o csv.writer: devolve a linha escrita em vez de guardá-la."""
+    def write(self, value):
+        return value
+
+def _export_text(value, decimal_sep='.'):
+    """Valor tipado da linha -> texto usado no CSV/JSON/PDF."""
+    if isinstance(value, datetime):
+        return value.strftime('%d/%m/%Y %H:%M')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, Decimal):
+        return f"{value:.2f}".replace('.', decimal_sep)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    return value
+
+def _json_array(objects):
+    yield '['
+    for index, obj in enumerate(objects):
+        yield (',' if index else '') + json.dumps(obj, cls=DjangoJSONEncoder, ensure_ascii=False)
+    yield ']'
+
 @login_required
 def export_data(request, model_name, file_format):
+    # Exportações grandes: '?background=1' gera o arquivo fora da requisição
+    if request.GET.get('background'):
+        if model_name not in EXPORT_MODELS or file_format not in EXPORT_FORMATS:
+            return JsonResponse({'status': 'error', 'message': 'Modelo ou formato inválido'})
+        return _enqueue_job(request, 'export', {
+            'model_name': model_name, 'file_format': file_format, 'query': _job_query(request)
+        })
+    return render_export(model_name, file_format, request.GET)
+
+def render_export(model_name, file_format, params):
+    """Gera o arquivo de exportação (usado pela view e pelo worker de ReportJob)."""
     # 1. Preparação dos Dados (Queryset e Headers)
+    decimal_sep = '.'
     if model_name == 'products':
         queryset = Product.objects.all().select_related('brand', 'olfactory_family', 'category', 'supplier')
         
         # --- Filtros Profissionais de Exportação ---
-        brand_id = request.GET.get('brand')
+        brand_id = params.get('brand')
         if brand_id and brand_id != 'all':
             queryset = queryset.filter(brand_id=brand_id)
 
-        category_id = request.GET.get('category')
+        category_id = params.get('category')
         if category_id and category_id != 'all':
             queryset = queryset.filter(category_id=category_id)
 
-        supplier_id = request.GET.get('supplier')
+        supplier_id = params.get('supplier')
         if supplier_id and supplier_id != 'all':
             queryset = queryset.filter(supplier_id=supplier_id)
             
-        stock_status = request.GET.get('stock_status')
+        stock_status = params.get('stock_status')
         if stock_status == 'in_stock':
             queryset = queryset.filter(stock_quantity__gt=0)
         elif stock_status == 'low_stock':
@@ -780,9 +754,10 @@ def export_data(request, model_name, file_format):
             'Volume', 'Código de Barras', 'Lote', 'Validade', 'Preço de Custo',
             'Preço de Venda', 'Qtd. em Estoque', 'Estoque Mínimo', 'URL da Imagem'
         ]
+        decimal_sep = ',' # Preços no padrão BR (a importação lê de volta)
         def get_row(obj):
             return [
-                str(obj.id),
+                obj.id,
                 obj.name,
                 obj.brand.name if obj.brand else '',
                 obj.category.name if obj.category else '',
@@ -798,11 +773,11 @@ def export_data(request, model_name, file_format):
                 obj.volume,
                 obj.barcode,
                 obj.batch_code,
-                obj.expiration_date.strftime('%Y-%m-%d') if obj.expiration_date else '',
-                f"{obj.cost_price:.2f}".replace('.', ','),
-                f"{obj.selling_price:.2f}".replace('.', ','),
-                str(obj.stock_quantity),
-                str(obj.min_stock),
+                obj.expiration_date or '',
+                obj.cost_price,
+                obj.selling_price,
+                obj.stock_quantity,
+                obj.min_stock,
                 obj.image_url if obj.image_url else ''
             ]
             
@@ -811,63 +786,71 @@ def export_data(request, model_name, file_format):
         filename = 'vendas'
         headers = ['ID', 'Data', 'Total', 'Status', 'Pagamento']
         def get_row(obj):
-            return [str(obj.id), obj.created_at.strftime('%d/%m/%Y %H:%M'), str(obj.total), obj.get_status_display(), obj.payment_method]
+            return [obj.id, obj.created_at, obj.total, obj.get_status_display(), obj.payment_method]
             
     elif model_name == 'customers':
         queryset = Customer.objects.all()
         filename = 'clientes'
         headers = ['ID', 'Nome', 'Email', 'Telefone']
         def get_row(obj):
-            return [str(obj.id), obj.name, obj.email, obj.phone]
+            return [obj.id, obj.name, obj.email, obj.phone]
             
     elif model_name == 'financial':
-        queryset = Sale.objects.filter(status='completed').prefetch_related('items__product')
+        # Custo dos itens somado no banco (uma linha por venda, sem carregar os itens)
+        queryset = Sale.objects.filter(status='completed').annotate(
+            items_cost=Coalesce(Sum(F('items__unit_cost') * F('items__quantity')),
+                                Value(0, output_field=DecimalField(max_digits=14, decimal_places=2)))
+        ).order_by('id')
         filename = 'relatorio_financeiro_lucros'
         headers = ['ID Venda', 'Data', 'Total Venda', 'Custo Produtos', 'Lucro Bruto', 'Margem %']
         def get_row(obj):
-            cost = sum(item.product.cost_price * item.quantity for item in obj.items.all())
+            cost = obj.items_cost
             revenue = obj.total
             profit = revenue - cost
-            margin = (profit / revenue * 100) if revenue > 0 else 0
-            return [str(obj.id), obj.created_at.strftime('%d/%m/%Y %H:%M'), f"{revenue:.2f}", f"{cost:.2f}", f"{profit:.2f}", f"{margin:.2f}"]
+            margin = round(profit / revenue * 100, 2) if revenue > 0 else Decimal('0')
+            return [obj.id, obj.created_at, revenue, cost, profit, margin]
     else:
         return JsonResponse({'status': 'error', 'message': 'Modelo inválido'})
 
-    # 2. Geração da Lista de Dados
-    data_rows = []
-    for obj in queryset:
-        data_rows.append(get_row(obj))
+    # 2. Linhas geradas sob demanda (lidas do banco em blocos, nunca a tabela inteira na memória).
+    # get_row() devolve os valores tipados (Excel); CSV/JSON/PDF recebem o texto formatado.
+    def data_rows():
+        for obj in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield get_row(obj)
+
+    def text_rows():
+        for row in data_rows():
+            yield [_export_text(value, decimal_sep) for value in row]
 
     # 3. Renderização por Formato
     if file_format == 'csv':
-        response = HttpResponse(content_type='text/csv')
+        # Streaming: o primeiro byte sai antes de a consulta terminar
+        writer = csv.writer(_Echo())
+        rows = itertools.chain([headers], text_rows())
+        response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type='text/csv')
         response['Content-Disposition'] = f'attachment; filename="{escape_uri_path(filename)}.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(headers)
-        writer.writerows(data_rows)
+        return response
+
+    elif file_format == 'ndjson':
+        # Um objeto JSON por linha
+        lines = (json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for row in text_rows())
+        response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="{escape_uri_path(filename)}.ndjson"'
         return response
 
     elif file_format == 'excel':
         if not openpyxl:
             return HttpResponse("Erro: Biblioteca 'openpyxl' não instalada. Instale com: pip install openpyxl", status=500)
             
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="{escape_uri_path(filename)}.xlsx"'
-        
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Dados"
-
-        # Cabeçalho Profissional no Excel
-        ws.append([f"Relatório de {model_name.title()} - Perfume ERP"])
-        ws.append([f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}"])
-        ws.append([])
-        ws.append(headers)
-        for row in data_rows:
-            ws.append(row)
-        wb.save(response)
-        return response
+        # Cabeçalho Profissional no Excel + linhas tipadas (planilha write-only em arquivo temporário)
+        rows = itertools.chain([
+            [f"Relatório de {model_name.title()} - Perfume ERP"],
+            [f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}"],
+            [],
+            headers,
+        ], data_rows())
+        output = write_workbook(rows, "Dados")
+        return FileResponse(output, as_attachment=True, filename=f"{filename}.xlsx", content_type=XLSX_CONTENT_TYPE)
 
     elif file_format == 'pdf':
         if not canvas:
@@ -910,20 +893,42 @@ def export_data(request, model_name, file_format):
             # Configuração do Grid (4 colunas para Landscape)
             cols = 4
             col_width = 65 * mm
+            grid_style = TableStyle([
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.lightgrey),
+                ('LEFTPADDING', (0, 0), (-1, -1), 5),
+                ('RIGHTPADDING', (0, 0), (-1, -1), 5),
+                ('TOPPADDING', (0, 0), (-1, -1), 10),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+            ])
+
+            # Miniaturas (geradas uma vez, em paralelo) em vez das fotos originais
+            storage = Product._meta.get_field('image').storage
+            image_paths = {}
+            for name in queryset.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True):
+                try:
+                    image_paths[name] = storage.path(name)
+                except NotImplementedError:
+                    pass # Armazenamento remoto (ex: Cloudinary): sem arquivo local
+            thumbnails = get_thumbnails(image_paths.values())
+
+            # Uma tabela pequena por página: o ReportLab não precisa calcular uma tabela gigante
             data_matrix = []
             current_row = []
+            has_products = False
 
-            for obj in queryset:
+            for obj in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                has_products = True
                 # Imagem
-                img_obj = ""
                 if obj.image:
-                    try:
-                        if os.path.exists(obj.image.path):
-                            # Imagem maior para catálogo (40x40mm)
-                            img_obj = PDFImage(obj.image.path, width=40*mm, height=40*mm)
-                        else:
-                            img_obj = Paragraph("Imagem não encontrada", style_center)
-                    except Exception:
+                    path = image_paths.get(obj.image.name)
+                    if path and thumbnails.get(path):
+                        # Imagem maior para catálogo (40x40mm)
+                        img_obj = PDFImage(thumbnails[path], width=40*mm, height=40*mm)
+                    elif path and not os.path.exists(path):
+                        img_obj = Paragraph("Imagem não encontrada", style_center)
+                    else:
                         img_obj = Paragraph("Erro", style_center)
                 else:
                     img_obj = Paragraph("Sem Foto", style_center)
@@ -943,31 +948,24 @@ def export_data(request, model_name, file_format):
                 if len(current_row) >= cols:
                     data_matrix.append(current_row)
                     current_row = []
+                if len(data_matrix) >= CATALOG_ROWS_PER_TABLE:
+                    elements.append(Table(data_matrix, colWidths=[col_width]*cols, style=grid_style))
+                    data_matrix = []
             
             # Completa a última linha
             if current_row:
                 while len(current_row) < cols:
                     current_row.append("")
                 data_matrix.append(current_row)
-
             if data_matrix:
-                t = Table(data_matrix, colWidths=[col_width]*cols)
-                t.setStyle(TableStyle([
-                    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                    ('GRID', (0, 0), (-1, -1), 0.5, colors.lightgrey),
-                    ('LEFTPADDING', (0, 0), (-1, -1), 5),
-                    ('RIGHTPADDING', (0, 0), (-1, -1), 5),
-                    ('TOPPADDING', (0, 0), (-1, -1), 10),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-                ]))
-                elements.append(t)
-            else:
+                elements.append(Table(data_matrix, colWidths=[col_width]*cols, style=grid_style))
+
+            if not has_products:
                 elements.append(Paragraph("Nenhum produto cadastrado.", styles['Normal']))
             
         else:
             # Lógica Genérica para outros modelos (Vendas, Clientes, etc)
-            table_data = [headers] + data_rows
+            table_data = [headers] + list(text_rows())
             t = Table(table_data)
             t.setStyle(TableStyle([
                 ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
@@ -977,14 +975,14 @@ def export_data(request, model_name, file_format):
                 ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
                 ('GRID', (0, 0), (-1, -1), 1, colors.black),
             ]))
+            elements.append(t)
             
-        elements.append(t)
         doc.build(elements)
         return response
         
     elif file_format == 'json':
-        json_data = [dict(zip(headers, row)) for row in data_rows]
-        return JsonResponse(json_data, safe=False, encoder=DjangoJSONEncoder)
+        # Mesmo conteúdo de antes (lista de objetos), mas o array é escrito item a item
+        return StreamingHttpResponse(_json_array(dict(zip(headers, row)) for row in text_rows()), content_type='application/json')
 
     return JsonResponse({'status': 'error', 'message': 'Formato não suportado'})
 
@@ -998,225 +996,34 @@ def import_data(request):
         model_type = request.POST.get('model') # Captura o tipo selecionado (se houver)
         
         try:
-            data_list = []
-            
-            # 1. Parse File
-            if filename.endswith('.csv'):
-                # Wrapper para ler bytes como texto (utf-8-sig lida com BOM do Excel)
-                # Tenta UTF-8 primeiro, se falhar, tenta Latin-1 (comum no Excel BR)
-                try:
-                    file_file = TextIOWrapper(uploaded_file.file, encoding='utf-8-sig')
-                    sample = file_file.read(2048)
-                    file_file.seek(0)
-                except UnicodeDecodeError:
-                    uploaded_file.file.seek(0)
-                    file_file = TextIOWrapper(uploaded_file.file, encoding='latin-1')
-                    sample = file_file.read(2048)
-                    file_file.seek(0)
-
-                # Tenta detectar se usa ponto e vírgula (comum no Excel Brasil) ou vírgula
-                delimiter = ';' if sample.count(';') > sample.count(',') else ','
-                reader = csv.DictReader(file_file, delimiter=delimiter)
-                data_list = list(reader)
-            elif filename.endswith('.json'):
-                data_list = json.load(uploaded_file)
-            elif filename.endswith('.xlsx'):
-                if not openpyxl:
-                    messages.error(request, 'Biblioteca openpyxl não instalada no servidor.')
-                    return redirect('import_data')
-                wb = openpyxl.load_workbook(uploaded_file)
-                ws = wb.active
-                rows = list(ws.iter_rows(values_only=True))
-                if rows:
-                    # 1. Busca inteligente da linha de cabeçalho (ignora linhas vazias ou títulos no topo)
-                    header_row_index = 0
-                    for i, row in enumerate(rows[:20]): # Verifica as primeiras 20 linhas
-                        row_values = [str(cell).lower().strip() for cell in row if cell is not None]
-                        # Palavras-chave para identificar se é um cabeçalho válido
-                        keywords = ['nome', 'name', 'código', 'codigo', 'barcode', 'preço', 'price', 'estoque', 'stock', 'email', 'telefone']
-                        if any(k in row_values for k in keywords):
-                            header_row_index = i
-                            break
-                    
-                    # 2. Mapeia as colunas baseadas no cabeçalho encontrado
-                    raw_headers = rows[header_row_index]
-                    header_map = {i: str(h).lower().strip() for i, h in enumerate(raw_headers) if h is not None and str(h).strip()}
-                    
-                    # 3. Processa os dados
-                    for row in rows[header_row_index + 1:]:
-                        row_dict = {}
-                        has_data = False
-                        for i, cell in enumerate(row):
-                            if i in header_map:
-                                val = str(cell) if cell is not None else ''
-                                # Remove .0 de números inteiros (comum no Excel)
-                                if val.endswith('.0'): val = val[:-2]
-                                row_dict[header_map[i]] = val.strip()
-                                if val.strip(): has_data = True
-                        if has_data:
-                            data_list.append(row_dict)
-            else:
+            # 1. Confere o arquivo (só a primeira linha é lida aqui)
+            if filename.endswith('.xlsx') and not openpyxl:
+                messages.error(request, 'Biblioteca openpyxl não instalada no servidor.')
+                return redirect('import_data')
+            try:
+                rows = read_rows(uploaded_file)
+            except UnsupportedFormat:
                 messages.error(request, 'Formato inválido. Use .csv, .json ou .xlsx')
                 return redirect('import_data')
-            
-            if not data_list:
+            first = next(rows, None)
+            rows.close()
+            if first is None:
                 messages.warning(request, 'O arquivo está vazio.')
                 return redirect('import_data')
 
             # 2. Identify Model based on headers (heuristic)
-            first_row = {k.lower().strip(): v for k, v in data_list[0].items()}
-            keys = first_row.keys()
-            
-            success_count = 0
-            errors = []
-            model_name = ""
-
-            # Helper para limpar valores monetários (Ex: "R$ 1.200,50" -> 1200.50)
-            def clean_decimal(val):
-                if not val: return None
-                s = str(val).replace('R$', '').replace(' ', '').strip()
-                # Se tiver ponto e vírgula, assume formato BR (milhar.centena,decimal)
-                if ',' in s and '.' in s: s = s.replace('.', '').replace(',', '.')
-                elif ',' in s: s = s.replace(',', '.')
-                try: return Decimal(s)
-                except: return Decimal('0')
-
-            # Lógica para Produtos (busca por colunas típicas)
-            # Verifica se foi selecionado 'products' OU se os cabeçalhos indicam produtos
-            if model_type == 'products' or (not model_type and any(k in keys for k in ['estoque', 'stock', 'stock_quantity', 'preço', 'price', 'selling_price'])):
-                model_name = "Produtos"
-                for row in data_list:
-                    try:
-                        row_lower = {k.lower().strip(): v for k, v in row.items()}
-                        
-                        pk = row_lower.get('id')
-                        barcode = row_lower.get('código de barras') or row_lower.get('codigo de barras') or row_lower.get('barcode')
-                        
-                        if barcode:
-                            barcode = str(barcode).strip()
-                            if not barcode: barcode = None
-                        else:
-                            barcode = None
-
-                        name = row_lower.get('nome') or row_lower.get('name')
-                        
-                        if not name:
-                            errors.append(f"Linha ignorada por não conter 'Nome': {row}")
-                            continue
-
-                        # --- Lógica de Relacionamentos (Foreign Keys) ---
-                        brand_obj = None
-                        brand_name = row_lower.get('marca') or row_lower.get('brand')
-                        if brand_name:
-                            brand_obj, _ = Brand.objects.get_or_create(name__iexact=brand_name.strip(), defaults={'name': brand_name.strip()})
-
-                        olfactory_family_obj = None
-                        olfactory_family_name = row_lower.get('família olfativa') or row_lower.get('familia olfativa')
-                        if olfactory_family_name:
-                            olfactory_family_obj, _ = OlfactoryFamily.objects.get_or_create(name__iexact=olfactory_family_name.strip(), defaults={'name': olfactory_family_name.strip()})
-                        
-                        # --- Busca o produto existente ---
-                        product = None
-                        if pk and Product.objects.filter(pk=pk).exists():
-                            product = Product.objects.get(pk=pk)
-                        elif barcode and Product.objects.filter(barcode=barcode).exists():
-                            product = Product.objects.get(barcode=barcode)
-                        elif name:
-                            # Busca por nome e marca para ser mais preciso
-                            search_filter = {'name__iexact': name}
-                            if brand_obj:
-                                search_filter['brand'] = brand_obj
-                            product = Product.objects.filter(**search_filter).first()
-                        
-                        # --- Prepara os dados ---
-                        product_data = {
-                            'name': name,
-                            'line': row_lower.get('linha'),
-                            'product_type': row_lower.get('tipo'),
-                            'gender': (row_lower.get('gênero') or row_lower.get('genero') or '').upper(),
-                            'olfactory_family': olfactory_family_obj,
-                            'top_notes': row_lower.get('notas de saída'),
-                            'heart_notes': row_lower.get('notas de corpo'),
-                            'base_notes': row_lower.get('notas de fundo'),
-                            'description': row_lower.get('descrição') or row_lower.get('descricao'),
-                            'volume': row_lower.get('volume'),
-                            'barcode': barcode,
-                            'batch_code': row_lower.get('lote'),
-                            'expiration_date': row_lower.get('validade') or None,
-                            'cost_price': clean_decimal(row_lower.get('preço de custo') or row_lower.get('preco de custo') or row_lower.get('custo')),
-                            'selling_price': clean_decimal(row_lower.get('preço de venda') or row_lower.get('preco de venda') or row_lower.get('preço') or row_lower.get('price')),
-                            'stock_quantity': row_lower.get('qtd. em estoque') or row_lower.get('qtd em estoque') or row_lower.get('estoque'),
-                            'min_stock': row_lower.get('estoque mínimo') or row_lower.get('estoque minimo'),
-                            'image_url': row_lower.get('url da imagem') or row_lower.get('imagem')
-                        }
-                        if brand_obj:
-                            product_data['brand'] = brand_obj
-
-                        # --- Limpa e Converte os Tipos ---
-                        # Já convertido pelo clean_decimal acima
-                        if product_data['stock_quantity']: product_data['stock_quantity'] = int(float(str(product_data['stock_quantity']).replace(',', '.')))
-                        if product_data['min_stock']: product_data['min_stock'] = int(float(str(product_data['min_stock']).replace(',', '.')))
-                        if not product_data['expiration_date']: del product_data['expiration_date']
-
-                        # Filtra valores nulos/vazios para não sobrescrever dados existentes com nada
-                        update_data = {k: v for k, v in product_data.items() if v is not None and v != ''}
-                        
-                        if product: # Atualiza
-                            for key, value in update_data.items():
-                                setattr(product, key, value)
-                            product.save()
-                            success_count += 1
-                        elif name and update_data.get('selling_price'): # Cria
-                            # Garante campos obrigatórios para criação
-                            if 'brand' not in update_data:
-                                default_brand, _ = Brand.objects.get_or_create(name="Geral")
-                                update_data['brand'] = default_brand
-                            if 'cost_price' not in update_data:
-                                update_data['cost_price'] = 0
-                            if 'volume' not in update_data:
-                                update_data['volume'] = 'N/A'
-                            
-                            Product.objects.create(**update_data)
-                            success_count += 1
-                    except Exception as e:
-                        errors.append(f"Erro na linha {row}: {str(e)}")
-
-            # Lógica para Clientes
-            # Verifica se foi selecionado 'customers' OU se os cabeçalhos indicam clientes
-            elif model_type == 'customers' or (not model_type and any(k in keys for k in ['email', 'telefone', 'phone'])):
-                model_name = "Clientes"
-                for row in data_list:
-                    try:
-                        row_lower = {k.lower().strip(): v for k, v in row.items()}
-                        pk = row_lower.get('id')
-                        defaults = {
-                            'name': row_lower.get('nome') or row_lower.get('name'),
-                            'email': row_lower.get('email'),
-                            'phone': row_lower.get('telefone') or row_lower.get('phone')
-                        }
-                        # Remove chaves vazias
-                        defaults = {k: v for k, v in defaults.items() if v}
-                        
-                        if pk:
-                            Customer.objects.update_or_create(pk=pk, defaults=defaults)
-                        elif defaults.get('email'):
-                            Customer.objects.update_or_create(email=defaults['email'], defaults=defaults)
-                        elif defaults.get('name'):
-                            Customer.objects.update_or_create(name=defaults['name'], defaults=defaults)
-                        success_count += 1
-                    except Exception as e:
-                        errors.append(f"Erro na linha {row}: {str(e)}")
-            
-            else:
+            model = imports.detect_model(model_type, first)
+            if model is None:
                 messages.error(request, 'Não foi possível identificar o tipo de dados (Produtos ou Clientes). Verifique os cabeçalhos.')
                 return redirect('import_data')
 
-            if success_count > 0:
-                messages.success(request, f'{success_count} registros de {model_name} processados com sucesso!')
-            
-            if errors:
-                for err in errors[:3]: messages.warning(request, err)
-                if len(errors) > 3: messages.warning(request, f'E mais {len(errors)-3} erros.')
+            # 3. As linhas são gravadas em lotes pelo worker (manage.py run_report_worker)
+            run, resumed = imports.start_import(uploaded_file, model, request.user)
+            if resumed:
+                messages.info(request, f'Este arquivo já estava sendo importado: continuando da linha {run.rows_processed + 1}.')
+            else:
+                messages.success(request, 'Arquivo recebido. A importação é feita em segundo plano; acompanhe o progresso abaixo.')
+            return redirect('import_run_detail', run_id=run.id)
 
         except Exception as e:
             messages.error(request, f'Erro ao processar arquivo: {str(e)}')
@@ -1231,253 +1038,56 @@ def import_data(request):
 @admin_required
 @login_required
 def download_fiscal(request, sale_id, doc_type):
-    sale = get_object_or_404(Sale, pk=sale_id)
-    
-    # Busca dados da empresa
+    sale = get_object_or_404(Sale.objects.select_related('customer'), pk=sale_id)
+    if doc_type not in fiscal.DOC_TYPES:
+        return redirect('import_data')
+    if not fiscal.is_available(doc_type):
+        messages.error(request, 'PDFs indisponíveis (ReportLab ausente).')
+        return redirect('import_data')
+
+    # Gerado uma vez por versão dos dados; os próximos downloads usam o arquivo gravado
+    doc = fiscal.get_document(sale, doc_type)
+    etag = f'"{doc.content_hash}"'
+    not_modified = get_conditional_response(request, etag=etag, last_modified=doc.created_at.timestamp())
+    if not_modified is not None:
+        return not_modified
+
+    response = FileResponse(
+        doc.file.open('rb'),
+        as_attachment=True,
+        filename=fiscal.filename(doc_type, sale.id),
+        content_type=fiscal.DOC_TYPES[doc_type][0],
+    )
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(doc.created_at.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@admin_required
+@login_required
+def export_fiscal(request):
+    """Exportação do período para a contabilidade: ZIP com XML da NF-e e DANFE das vendas concluídas."""
     try:
-        company = CompanySettings.objects.first()
-    except (OperationalError, ProgrammingError):
-        company = None
-    company_name = company.name if company else "Perfume ERP Ltda"
-    company_cnpj = company.cnpj if company else "00.000.000/0001-91"
-    
-    if doc_type == 'cupom':
-        if not canvas:
-            messages.error(request, 'PDFs indisponíveis (ReportLab ausente).')
-            return redirect('import_data')
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="cupom_{sale.id}.pdf"'
-        
-        # Gera PDF estilo Cupom Térmico (80mm largura) - Layout Moderno
-        width = 80*mm
-        height = 250*mm # Altura maior para garantir que caibam os itens
-        p = canvas.Canvas(response, pagesize=(width, height))
-        
-        # Coordenadas e Configurações
-        y = 240*mm 
-        left_x = 5*mm
-        center_x = 40*mm
-        right_x = 75*mm
-        line_height = 4*mm
-        
-        # --- Cabeçalho da Empresa ---
-        p.setFont("Helvetica-Bold", 10)
-        p.drawCentredString(center_x, y, company_name.upper())
-        y -= line_height + 1*mm
-        
-        p.setFont("Helvetica", 8)
-        p.drawCentredString(center_x, y, f"CNPJ: {company_cnpj}")
-        y -= line_height
-        
-        if company:
-            if company.address:
-                p.drawCentredString(center_x, y, company.address[:45]) # Trunca para caber
-                y -= line_height
-            if company.phone:
-                p.drawCentredString(center_x, y, f"Tel: {company.phone}")
-                y -= line_height
-        
-        y -= 2*mm
-        p.setLineWidth(0.5)
-        p.line(left_x, y, right_x, y)
-        y -= line_height + 2*mm
-        
-        # --- Dados da Venda ---
-        p.setFont("Helvetica-Bold", 9)
-        p.drawCentredString(center_x, y, "CUPOM NÃO FISCAL")
-        y -= line_height
-        
-        p.setFont("Helvetica", 8)
-        p.drawCentredString(center_x, y, f"Venda Nº {sale.id:06d}")
-        y -= line_height
-        p.drawCentredString(center_x, y, sale.created_at.strftime('%d/%m/%Y %H:%M:%S'))
-        y -= line_height + 2*mm
-        
-        p.line(left_x, y, right_x, y)
-        y -= line_height + 2*mm
-        
-        # --- Itens ---
-        p.setFont("Helvetica-Bold", 8)
-        p.drawString(left_x, y, "ITEM")
-        p.drawRightString(right_x, y, "TOTAL")
-        y -= line_height
-        
-        p.setFont("Helvetica", 8)
-        for item in sale.items.all():
-            # Nome do Produto
-            name = item.product.name
-            if len(name) > 30: name = name[:30] + "..."
-            p.drawString(left_x, y, name)
-            y -= line_height
-            
-            # Detalhes
-            details = f"{item.quantity} x R$ {item.price:.2f}"
-            total_item = item.quantity * item.price
-            
-            p.setFont("Helvetica", 7)
-            p.drawString(left_x + 2*mm, y, details)
-            p.drawRightString(right_x, y, f"R$ {total_item:.2f}")
-            p.setFont("Helvetica", 8)
-            y -= line_height + 1*mm
-            
-        y -= 2*mm
-        p.line(left_x, y, right_x, y)
-        y -= line_height + 2*mm
-        
-        # --- Totais ---
-        p.setFont("Helvetica-Bold", 12)
-        p.drawString(left_x, y, "TOTAL A PAGAR")
-        p.drawRightString(right_x, y, f"R$ {sale.total:.2f}")
-        y -= line_height + 4*mm
-        
-        p.setFont("Helvetica", 8)
-        p.drawString(left_x, y, "Forma de Pagamento:")
-        p.drawRightString(right_x, y, sale.get_payment_method_display())
-        y -= line_height + 2*mm
-        
-        # --- Cliente ---
-        if sale.customer:
-            p.line(left_x, y, right_x, y)
-            y -= line_height + 2*mm
-            p.setFont("Helvetica-Bold", 8)
-            p.drawString(left_x, y, "CLIENTE")
-            y -= line_height
-            p.setFont("Helvetica", 8)
-            p.drawString(left_x, y, sale.customer.name[:35])
-            y -= line_height
-            if sale.customer.cpf_cnpj:
-                p.drawString(left_x, y, f"CPF/CNPJ: {sale.customer.cpf_cnpj}")
-                y -= line_height
-        
-        # --- Rodapé ---
-        y -= 10*mm
-        p.setFont("Helvetica-Oblique", 8)
-        p.drawCentredString(center_x, y, "Obrigado pela preferência!")
-        y -= line_height
-        p.setFont("Helvetica", 6)
-        p.drawCentredString(center_x, y, "Gerado por Perfume ERP")
-
-        # --- QR Code ---
-        y -= 5*mm
-        qr_data = "https://www.seusite.com.br" # Substitua pelo seu site
-        qr_code = qr.QrCodeWidget(qr_data)
-        bounds = qr_code.getBounds()
-        width = bounds[2] - bounds[0]
-        height = bounds[3] - bounds[1]
-        d = Drawing(45, 45, transform=[45/width,0,0,45/height,0,0])
-        d.add(qr_code)
-        renderPDF.draw(d, p, center_x - 8*mm, y - 18*mm)
-
-        p.showPage()
-        p.save()
-        return response
+        start = datetime.strptime(request.GET.get('start_date', ''), '%Y-%m-%d').date()
+        end = datetime.strptime(request.GET.get('end_date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        messages.error(request, 'Informe a data inicial e a data final da exportação.')
+        return redirect('import_data')
+    doc_types = [t for t in fiscal.EXPORT_DOC_TYPES if t in request.GET.getlist('doc_type')] or list(fiscal.EXPORT_DOC_TYPES)
+    if not all(fiscal.is_available(t) for t in doc_types):
+        messages.error(request, 'PDFs indisponíveis (ReportLab ausente).')
+        return redirect('import_data')
 
-    elif doc_type == 'nfe':
-        # Gera XML Simulado de NF-e
-        response = HttpResponse(content_type='application/xml')
-        response['Content-Disposition'] = f'attachment; filename="nfe_{sale.id}.xml"'
-        
-        xml_content = f"""<?xml version="1.0" encoding="UTF-8"?>
-<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">
-    <NFe>
-        <infNFe Id="NFe{sale.id}">
-            <ide>
-                <nNF>{sale.id}</nNF>
-                <dhEmi>{sale.created_at.isoformat()}</dhEmi>
-                <tpNF>1</tpNF>
-                <natOp>Venda de Mercadoria</natOp>
-            </ide>
-            <emit>
-                <xNome>{company_name}</xNome>
-                <CNPJ>{company_cnpj}</CNPJ>
-            </emit>
-            <dest>
-                <xNome>{sale.customer.name if sale.customer else 'Consumidor Final'}</xNome>
-                <CPF>{sale.customer.cpf_cnpj if sale.customer and sale.customer.cpf_cnpj else ''}</CPF>
-            </dest>
-            <det nItem="1">
-                <prod>
-                    <xProd>Venda de Perfumes e Cosmeticos</xProd>
-                    <vProd>{sale.total}</vProd>
-                </prod>
-            </det>
-            <total>
-                <ICMSTot>
-                    <vNF>{sale.total}</vNF>
-                </ICMSTot>
-            </total>
-        </infNFe>
-    </NFe>
-</nfeProc>"""
-        response.write(xml_content)
-        return response
-        
-    elif doc_type == 'danfe':
-        if not canvas:
-            messages.error(request, 'PDFs indisponíveis (ReportLab ausente).')
-            return redirect('import_data')
-        # Gera PDF estilo DANFE (Simplificado A4)
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="danfe_{sale.id}.pdf"'
-        
-        # Configuração A4 (210mm x 297mm)
-        width, height = 210*mm, 297*mm
-        p = canvas.Canvas(response, pagesize=(width, height))
-        
-        # --- Cabeçalho ---
-        p.setLineWidth(1)
-        p.rect(10*mm, height - 40*mm, 190*mm, 30*mm)
-        
-        p.setFont("Helvetica-Bold", 12)
-        p.drawString(15*mm, height - 20*mm, "DANFE - Documento Auxiliar da Nota Fiscal Eletrônica")
-        
-        p.setFont("Helvetica", 10)
-        p.drawString(15*mm, height - 25*mm, company_name)
-        p.drawString(15*mm, height - 30*mm, f"CNPJ: {company_cnpj}")
-        
-        p.drawString(120*mm, height - 20*mm, f"Nº: {sale.id}")
-        p.drawString(120*mm, height - 25*mm, "Série: 1")
-        p.drawString(120*mm, height - 30*mm, f"Emissão: {sale.created_at.strftime('%d/%m/%Y')}")
-        
-        # --- Destinatário ---
-        y = height - 50*mm
-        p.rect(10*mm, y - 25*mm, 190*mm, 25*mm)
-        p.setFont("Helvetica-Bold", 10)
-        p.drawString(12*mm, y - 5*mm, "DESTINATÁRIO / REMETENTE")
-        
-        p.setFont("Helvetica", 9)
-        customer_name = sale.customer.name if sale.customer else 'Consumidor Final'
-        customer_doc = sale.customer.cpf_cnpj if sale.customer and sale.customer.cpf_cnpj else ''
-        
-        p.drawString(15*mm, y - 12*mm, f"Nome/Razão Social: {customer_name}")
-        p.drawString(130*mm, y - 12*mm, f"CNPJ/CPF: {customer_doc}")
-        
-        # --- Itens ---
-        y = height - 85*mm
-        p.setFont("Helvetica-Bold", 9)
-        p.drawString(10*mm, y, "DADOS DOS PRODUTOS / SERVIÇOS")
-        y -= 5*mm
-        p.line(10*mm, y, 200*mm, y)
-        y -= 5*mm
-        
-        p.setFont("Helvetica", 9)
-        for item in sale.items.all():
-            line_text = f"{item.product.name[:50]} | Qtd: {item.quantity} | Unit: R$ {item.price:.2f} | Total: R$ {item.quantity * item.price:.2f}"
-            p.drawString(12*mm, y, line_text)
-            y -= 5*mm
-            
-        # --- Totais ---
-        y -= 5*mm
-        p.line(10*mm, y, 200*mm, y)
-        y -= 8*mm
-        p.setFont("Helvetica-Bold", 11)
-        p.drawString(140*mm, y, f"VALOR TOTAL: R$ {sale.total:.2f}")
-        
-        p.showPage()
-        p.save()
-        return response
+    sales = fiscal.export_sales(start, end)
+    if not sales.exists():
+        messages.warning(request, 'Nenhuma venda concluída no período.')
+        return redirect('import_data')
 
-    return redirect('import_data')
+    # Streaming: cada documento entra no ZIP assim que fica pronto
+    chunks = fiscal.export_zip(sales.iterator(chunk_size=fiscal.EXPORT_CHUNK_SIZE), doc_types)
+    response = StreamingHttpResponse(chunks, content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="fiscal_{start:%Y%m%d}_{end:%Y%m%d}.zip"'
+    return response
 
 @admin_required
 @login_required
@@ -1515,16 +1125,24 @@ def delete_sale(request, sale_id):
     sale = get_object_or_404(Sale, pk=sale_id)
     
     # Estorno de Estoque (Seja pendente ou finalizada)
-    # Devolve os itens ao estoque antes de excluir
-    for item in sale.items.all():
-        StockMovement.objects.create(
-            product=item.product,
-            quantity=item.quantity,
-            movement_type='E',
-            reason=f'Estorno/Exclusão Venda #{sale.id}'
-        )
-        
-    sale.delete()
+    # Devolve ao estoque exatamente o que foi baixado (movimentações vinculadas à venda)
+    with transaction.atomic():
+        reason = f'Estorno/Exclusão Venda #{sale.id}'
+        if not sale.post_stock_reversal(reason):
+            # Vendas antigas, sem movimentações vinculadas: devolve os itens da venda (lançamento único)
+            post_movements([
+                StockMovement(
+                    product_id=item.product_id,
+                    quantity=item.quantity,
+                    movement_type='E',
+                    reason=reason,
+                    source='sale_reversal',
+                    sale=sale
+                )
+                for item in sale.items.all()
+            ])
+            
+        sale.delete()
     messages.success(request, f'Venda #{sale_id} excluída e estoque estornado.')
     
     # Redireciona para a página anterior (Dashboard ou Pendentes)
@@ -1541,13 +1159,21 @@ def delete_sale_item(request, item_id):
     
     try:
         with transaction.atomic():
-            # 1. Devolve o item ao estoque
-            StockMovement.objects.create(
-                product=item.product,
-                quantity=item.quantity,
-                movement_type='E', # Entrada (estorno)
-                reason=f'Remoção de item da Venda #{sale.id}'
-            )
+            # 1. Devolve o item ao estoque (o que foi baixado para ele, inclusive componentes de Kit)
+            reason = f'Remoção de item da Venda #{sale.id}'
+            if not sale.post_stock_reversal(reason, source='item_removal', sale_item=item):
+                # Vendas antigas, sem movimentações vinculadas: devolve o item (mesmo Livro de Estoque)
+                post_movements([
+                    StockMovement(
+                        product_id=item.product_id,
+                        quantity=item.quantity,
+                        movement_type='E', # Entrada (estorno)
+                        reason=reason,
+                        source='item_removal',
+                        sale=sale,
+                        sale_item=item
+                    )
+                ])
             
             # 2. Deleta o item
             item.delete()
@@ -1560,6 +1186,7 @@ def delete_sale_item(request, item_id):
             else:
                 # Apenas recalcula o total se ainda houver itens
                 sale.save()
+                fiscal.invalidate(sale.id)
                 messages.success(request, 'Item removido da venda e estoque estornado.')
 
     except Exception as e:
@@ -1583,7 +1210,10 @@ def sale_detail(request, sale_id):
                 sale.customer_id = customer_id if customer_id else None
                 
                 sale.payment_method = request.POST.get('payment_method')
-                sale.created_at = request.POST.get('created_at')
+                # Converte o valor do campo datetime-local (o __str__ da venda, usado na auditoria, precisa de um datetime)
+                created_at = parse_datetime(request.POST.get('created_at') or '')
+                if created_at:
+                    sale.created_at = created_at if timezone.is_aware(created_at) else timezone.make_aware(created_at)
                 
 
                 sale.discount_value = clean_br_decimal(request.POST.get('discount_value', '0'))
@@ -1593,6 +1223,7 @@ def sale_detail(request, sale_id):
                 sale.tax_type = request.POST.get('tax_type', 'fixed')
 
                 # 2. Atualizar Itens (Quantidade e Preço)
+                stock_adjustments = []
                 for item in sale.items.all():
                     qty_key = f'quantity_{item.id}'
                     price_key = f'price_{item.id}'
@@ -1609,20 +1240,27 @@ def sale_detail(request, sale_id):
                         # Ajuste de Estoque pela diferença
                         diff = new_qty - item.quantity
                         if diff != 0:
-                            prod = Product.objects.select_for_update().get(pk=item.product.id)
-                            StockMovement.objects.create(
-                                product=prod,
+                            stock_adjustments.append(StockMovement(
+                                product_id=item.product_id,
                                 quantity=abs(diff),
                                 movement_type='S' if diff > 0 else 'E', # S=Saída (aumentou venda), E=Entrada (diminuiu)
-                                reason=f'Edição Venda #{sale.id}'
-                            )
+                                reason=f'Edição Venda #{sale.id}',
+                                source='sale_edit',
+                                sale=sale,
+                                sale_item=item
+                            ))
                         
                         item.quantity = new_qty
                         item.price = new_price
                         item.save(update_sale_total=False) # Atualiza subtotal do item, mas não salva a venda ainda
 
+                # Ajustes de estoque de todos os itens em um único lançamento (UPDATE com F(), sem ler o produto)
+                post_movements(stock_adjustments)
+
                 # 3. Salvar Venda (Recalcula o TOTAL GERAL baseado nos itens e descontos novos)
                 sale.save()
+                # Documentos fiscais gravados ficam desatualizados: gera de novo no próximo download
+                fiscal.invalidate(sale.id)
                 messages.success(request, 'Venda atualizada com sucesso!')
                 return redirect('sale_detail', sale_id=sale.id)
                 
@@ -1804,4 +1442,65 @@ def register_payment(request, sale_id):
 def audit_logs(request):
     """Exibe o histórico de logs do sistema"""
     logs = AuditLog.objects.select_related('user').all()[:500] # Limite de 500 para performance
-    return render(request, 'reports/audit_logs.html', {'logs': logs})
\ No newline at end of file
+    return render(request, 'reports/audit_logs.html', {'logs': logs})
+
+# --- Arquivos gerados em segundo plano (ReportJob) ---
+
+def _get_user_job(request, job_id):
+    job = get_object_or_404(ReportJob, pk=job_id)
+    if job.user_id != request.user.id and not request.user.is_superuser:
+        raise Http404
+    return job
+
+def _job_status(job):
+    data = {'status': job.status, 'status_display': job.get_status_display(), 'download_url': None, 'error': job.error}
+    if job.status == 'done' and job.result:
+        data['download_url'] = reverse('report_job_download', args=[job.id])
+    return data
+
+@login_required
+def report_job_detail(request, job_id):
+    """Página de acompanhamento: consulta o status até o arquivo ficar pronto."""
+    job = _get_user_job(request, job_id)
+    return render(request, 'reports/report_job.html', {'job': job, 'job_status': _job_status(job)})
+
+@login_required
+def report_job_status(request, job_id):
+    return JsonResponse(_job_status(_get_user_job(request, job_id)))
+
+@login_required
+def report_job_download(request, job_id):
+    job = _get_user_job(request, job_id)
+    if job.status != 'done' or not job.result or (job.expires_at and job.expires_at <= timezone.now()):
+        raise Http404("Arquivo não disponível (ainda em processamento ou expirado).")
+    return FileResponse(job.result.open('rb'), as_attachment=True, filename=job.filename)
+
+def _get_user_import(request, run_id):
+    run = get_object_or_404(ImportRun, pk=run_id)
+    if run.user_id != request.user.id and not request.user.is_superuser:
+        raise Http404
+    return run
+
+def _import_status(run):
+    return {
+        'status': run.status,
+        'status_display': run.get_status_display(),
+        'model_name': run.model_name,
+        'rows_processed': run.rows_processed,
+        'success_count': run.success_count,
+        'error_count': run.error_count,
+        'errors': run.errors[:20],
+        'error': run.error,
+    }
+
+@admin_required
+@login_required
+def import_run_detail(request, run_id):
+    """Página de acompanhamento da importação: consulta o progresso até terminar."""
+    run = _get_user_import(request, run_id)
+    return render(request, 'reports/import_run.html', {'run': run, 'run_status': _import_status(run)})
+
+@admin_required
+@login_required
+def import_run_status(request, run_id):
+    return JsonResponse(_import_status(_get_user_import(request, run_id)))
@@ -0,0 +1,39 @@
+"""
+Geração de planilhas Excel (.xlsx) em modo "write-only".
+
+O openpyxl normal monta a planilha inteira em memória (um objeto Cell por
+célula). No modo write-only cada linha é gravada direto no XML assim que é
+recebida, então exportar 100 mil linhas usa memória constante. O arquivo vai
+para um temporário em disco e é devolvido com FileResponse.
+
+Os valores mantêm o tipo (número, data), para o Excel poder somar/filtrar.
+"""
+import tempfile
+from datetime import datetime
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def excel_value(value):
+    # O Excel não aceita fuso horário nas datas: grava o mesmo horário exibido nos relatórios
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.replace(tzinfo=None)
+    return value
+
+def write_workbook(rows, sheet_title="Dados"):
+    """
+    Grava as linhas (iterável de listas) numa planilha write-only e retorna o
+    arquivo temporário já posicionado no início (apagado ao ser fechado).
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+    for row in rows:
+        ws.append([excel_value(v) for v in row])
+    output = tempfile.TemporaryFile()
+    wb.save(output)
+    output.seek(0)
+    return output
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.3 on 2026-10-17 14:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_unit_cost(apps, schema_editor):
+    # Itens já existentes: o custo da época não foi guardado, usa o custo atual do produto
+    # (o mesmo valor que os relatórios usavam até aqui).
+    SaleItem = apps.get_model('sales', 'SaleItem')
+    Product = apps.get_model('products', 'Product')
+    SaleItem.objects.filter(unit_cost__isnull=True).update(
+        unit_cost=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('cost_price')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_backfill_stockmovement_references'),
+        ('sales', '0005_auditlog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='saleitem',
+            name='unit_cost',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True, verbose_name='Custo Unit.'),
+        ),
+        migrations.RunPython(fill_unit_cost, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,14 @@
 from django.db import models
-from django.db.models import Q
-from django.db.models.signals import post_save, post_delete, pre_save
+from django.db.models import Q, F, Case, When, Sum
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from customers.models import Customer
 from products.models import Product, StockMovement
+from products.ledger import post_movements
 from decimal import Decimal
 import json
-from django.forms.models import model_to_dict
+from core import audit
 from datetime import datetime, date
 
 # Helper para serializar datas e decimais para JSON
@@ -42,7 +43,7 @@ class AuditLog(models.Model):
     def __str__(self):
         return f"{self.user} - {self.action} - {self.model_name}"
 
-class Sale(models.Model):
+class Sale(audit.AuditedModel, models.Model):
     PAYMENT_CHOICES = [
         ('pix', 'PIX'),
         ('credit', 'Cartão de Crédito'),
@@ -80,59 +81,111 @@ class Sale(models.Model):
     def __str__(self):
         return f"Venda #{self.pk} - {self.created_at.strftime('%d/%m/%Y')}"
 
+    def calculate_totals(self, subtotal_items):
+        """Aplica desconto, acréscimo e comissão sobre a soma dos itens."""
+        # Cálculo do Desconto
+        discount_amount = self.discount_value
+        if self.discount_type == 'percent':
+            discount_amount = subtotal_items * (self.discount_value / 100)
+        
+        # Cálculo do Acréscimo (Taxa)
+        tax_amount = self.tax_value
+        if self.tax_type == 'percent':
+            tax_amount = subtotal_items * (self.tax_value / 100)
+
+        self.total = subtotal_items - discount_amount + tax_amount
+        if self.total < Decimal('0'): self.total = Decimal('0')
+        
+        # Cálculo de comissão (Ex: 5% sobre o total)
+        self.commission = self.total * Decimal('0.05')
+
     def save(self, *args, **kwargs):
         # Recalcula o total se a venda já existir
         if self.pk:
-            subtotal_items = sum(item.subtotal for item in self.items.all())
-            
-            # Cálculo do Desconto
-            discount_amount = self.discount_value
-            if self.discount_type == 'percent':
-                discount_amount = subtotal_items * (self.discount_value / 100)
-            
-            # Cálculo do Acréscimo (Taxa)
-            tax_amount = self.tax_value
-            if self.tax_type == 'percent':
-                tax_amount = subtotal_items * (self.tax_value / 100)
-
-            self.total = subtotal_items - discount_amount + tax_amount
-            if self.total < Decimal('0'): self.total = Decimal('0')
-            
-            # Cálculo de comissão (Ex: 5% sobre o total)
-            self.commission = self.total * Decimal('0.05')
+            self.calculate_totals(sum(item.subtotal for item in self.items.all()))
             
         super().save(*args, **kwargs)
 
+    def stock_exits(self, items):
+        """
+        Expande os itens da venda em saídas de estoque: (produto, quantidade, motivo, item).
+        Kits/Combos não têm estoque próprio, então a baixa é feita nos componentes.
+        Espera os itens com 'product__components__component' já carregados.
+        """
+        pending = self.status == 'pending'
+        lines = []
+        for item in items:
+            product = item.product
+            if product.product_type in ['kit', 'combo']:
+                for comp in product.components.all():
+                    reason = f"Venda Kit Pendente #{self.pk} ({product.name})" if pending else f"Venda Kit #{self.pk} ({product.name})"
+                    lines.append((comp.component, int(comp.quantity * item.quantity), reason, item))
+            else:
+                reason = f"Venda Pendente #{self.pk}" if pending else f"Venda #{self.pk}"
+                lines.append((product, item.quantity, reason, item))
+        return lines
+
+    def post_stock_exits(self, items, guarded=False):
+        """
+        Lança as saídas de estoque da venda em lote pelo Livro de Estoque:
+        um único UPDATE para todos os produtos e um único INSERT das movimentações.
+        guarded=True: baixa condicional por produto (levanta OutOfStock se faltar saldo).
+        """
+        source = 'sale_pending' if self.status == 'pending' else 'sale'
+        post_movements([
+            StockMovement(
+                product=product, quantity=quantity, movement_type='S', reason=reason,
+                source=source, sale=self, sale_item=item if item.pk else None
+            )
+            for product, quantity, reason, item in self.stock_exits(items)
+        ], guarded=guarded)
+
+    def post_stock_reversal(self, reason, source='sale_reversal', sale_item=None):
+        """
+        Devolve ao estoque o saldo líquido que a venda (ou um item dela) baixou,
+        com base nas movimentações vinculadas (consulta pelo índice de 'sale').
+        Retorna False se não houver nenhuma movimentação vinculada (vendas antigas).
+        """
+        movements = StockMovement.objects.filter(sale=self)
+        if sale_item is not None:
+            movements = movements.filter(sale_item=sale_item)
+        if not movements.exists():
+            return False
+
+        net_out = movements.values('product_id').annotate(
+            quantity=Sum(Case(
+                When(movement_type='S', then=F('quantity')),
+                default=-F('quantity'),
+                output_field=models.IntegerField(),
+            ))
+        )
+        post_movements([
+            StockMovement(
+                product_id=row['product_id'],
+                quantity=row['quantity'],
+                movement_type='E',
+                reason=reason,
+                source=source,
+                sale=self,
+                sale_item=sale_item
+            )
+            for row in net_out if row['quantity'] > 0
+        ])
+        return True
+
     def finalize(self):
         """Finaliza a venda e gera a saída no estoque automaticamente"""
         if self.status == 'completed':
-            # Verifica se já existem movimentações (seja Finalizada ou Pendente) para evitar duplicidade
-            # Isso evita que o estoque seja baixado duas vezes se a venda veio de "Pendente"
-            # Alterado para contains para pegar também 'Venda Kit Pendente...' e variações
+            # Verifica se já existe a baixa desta venda (seja Finalizada ou Pendente) para evitar duplicidade.
+            # Isso evita que o estoque seja baixado duas vezes se a venda veio de "Pendente".
+            # A consulta usa a FK estruturada (índice sale + source), não o texto do motivo.
             already_deducted = StockMovement.objects.filter(
-                reason__contains=f"#{self.pk}"
+                sale=self, source__in=StockMovement.SALE_DEDUCTION_SOURCES
             ).exists()
             
             if not already_deducted:
-                for item in self.items.all():
-                    # Verifica se é Kit/Combo para baixar os componentes
-                    if item.product.product_type in ['kit', 'combo']:
-                        components = item.product.components.all()
-                        if components.exists():
-                            for comp in components:
-                                StockMovement.objects.create(
-                                    product=comp.component,
-                                    quantity=comp.quantity * item.quantity,
-                                    movement_type='S',
-                                    reason=f"Venda Kit #{self.pk} ({item.product.name})"
-                                )
-                    else:
-                        StockMovement.objects.create(
-                            product=item.product,
-                            quantity=item.quantity,
-                            movement_type='S',
-                            reason=f"Venda #{self.pk}"
-                        )
+                items = self.items.select_related('product').prefetch_related('product__components__component')
+                self.post_stock_exits(items)
 
     class Meta:
         verbose_name = "Venda"
@@ -144,12 +197,16 @@ class SaleItem(models.Model):
     quantity = models.PositiveIntegerField("Qtd", default=1)
     price = models.DecimalField("Preço Unit.", max_digits=10, decimal_places=2)
     subtotal = models.DecimalField("Subtotal", max_digits=10, decimal_places=2, editable=False)
+    # Custo do produto no momento da venda: o CMV da venda não muda com entradas/edições de custo posteriores
+    unit_cost = models.DecimalField("Custo Unit.", max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
 
     def save(self, *args, update_sale_total=True, **kwargs):
         # Pega o preço de venda do produto apenas na criação do item,
         # se nenhum preço for fornecido explicitamente.
         if not self.pk and self.price is None:
             self.price = self.product.selling_price
+        if self.unit_cost is None:
+            self.unit_cost = self.product.cost_price
         
         self.subtotal = self.price * self.quantity
         super().save(*args, **kwargs)
@@ -166,45 +223,26 @@ class SaleItem(models.Model):
         sale.save()
 
 # --- SINAIS PARA LOG AUTOMÁTICO ---
+# O estado anterior vem do snapshot de AuditedModel.from_db (sem buscar o objeto de novo)
+# e os registros são gravados em lote (ver core/audit.py).
 from config.middleware import get_current_user
 
-@receiver(pre_save, sender=Sale)
-@receiver(pre_save, sender=Product)
-@receiver(pre_save, sender=Customer)
-def audit_log_pre_save(sender, instance, **kwargs):
-    """Captura o estado original do objeto antes de salvar para comparação"""
-    if instance.pk:
-        try:
-            old_obj = sender.objects.get(pk=instance.pk)
-            instance._old_state = model_to_dict(old_obj)
-        except sender.DoesNotExist:
-            instance._old_state = {}
-
 @receiver(post_save, sender=Sale)
 @receiver(post_save, sender=Product)
 @receiver(post_save, sender=Customer)
 def audit_log_save(sender, instance, created, **kwargs):
     user = get_current_user()
-    if not user or not user.is_authenticated:
+    if not user or not user.is_authenticated or not audit.is_enabled():
+        audit.take_snapshot(instance)
         return # Ignora ações do sistema sem usuário logado
 
     action = 'CREATE' if created else 'UPDATE'
-    model_name = sender._meta.verbose_name.title()
-    
-    changes_desc = ""
-    if action == 'UPDATE' and hasattr(instance, '_old_state'):
-        new_state = model_to_dict(instance)
-        diffs = []
-        for field, new_val in new_state.items():
-            old_val = instance._old_state.get(field)
-            # Compara convertendo para string para evitar erros entre tipos (ex: Decimal vs Float)
-            if str(old_val) != str(new_val):
-                diffs.append(f"{field}: {old_val} ➔ {new_val}")
-        changes_desc = ", ".join(diffs) if diffs else "Atualização sem alterações visíveis"
-    
-    AuditLog.objects.create(
+    changes_desc = audit.describe_changes(instance) if action == 'UPDATE' else ""
+    audit.take_snapshot(instance)
+
+    audit.record(
         user=user,
-        model_name=model_name,
+        model_name=sender._meta.verbose_name.title(),
         object_id=str(instance.pk),
         object_repr=str(instance),
         action=action,
@@ -219,11 +257,11 @@ def audit_log_delete(sender, instance, **kwargs):
     if not user or not user.is_authenticated:
         return
 
-    AuditLog.objects.create(
+    audit.record(
         user=user,
         model_name=sender._meta.verbose_name.title(),
         object_id=str(instance.pk),
         object_repr=str(instance),
         action='DELETE',
         changes=''
-    )
\ No newline at end of file
+    )
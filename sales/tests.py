@@ -0,0 +1,294 @@
+import json
+import threading
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction, OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from config.middleware import _thread_locals
+from core import audit
+from core.testing import local_cache
+from products.cache import barcode_cache, get_catalog_version
+from products.ledger import post_movements, OutOfStock
+from products.models import Product, ProductComponent, StockMovement
+from products.search import search_products
+from .models import Sale, AuditLog
+
+
+class SaveSaleBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('caixa', password='123')
+        self.client.force_login(self.user)
+        self.products = [
+            Product.objects.create(name=f'Perfume {i}', selling_price=100, cost_price=40, stock_quantity=50)
+            for i in range(12)
+        ]
+
+    def post_sale(self, products, status='completed'):
+        payload = {
+            'payment_method': 'credit',
+            'installments': 1,
+            'status': status,
+            'items': [{'id': p.pk, 'quantity': 2, 'price': '100,00'} for p in products],
+        }
+        return self.client.post(reverse('save_sale'), data=json.dumps(payload), content_type='application/json')
+
+    def count_queries(self, products, status='completed'):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post_sale(products, status)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_constant_in_cart_size(self):
+        for status in ['completed', 'pending']:
+            small = self.count_queries(self.products[:1], status)
+            large = self.count_queries(self.products[1:11], status)
+            self.assertEqual(small, large, f'save_sale ({status}) não deve crescer com o carrinho')
+
+    def test_totals_and_stock_are_posted(self):
+        response = self.post_sale(self.products[:3])
+        sale = Sale.objects.get(pk=response.json()['sale_id'])
+        self.assertEqual(sale.total, 600)
+        self.assertEqual(sale.items.count(), 3)
+        for product in self.products[:3]:
+            product.refresh_from_db()
+            self.assertEqual(product.stock_quantity, 48)
+        self.assertEqual(StockMovement.objects.filter(movement_type='S').count(), 3)
+
+    def test_kit_deducts_components(self):
+        kit = Product.objects.create(name='Kit Presente', product_type='kit', selling_price=150)
+        ProductComponent.objects.create(kit=kit, component=self.products[0], quantity=1)
+        ProductComponent.objects.create(kit=kit, component=self.products[1], quantity=2)
+        self.post_sale([kit], status='pending')
+        self.products[0].refresh_from_db()
+        self.products[1].refresh_from_db()
+        self.assertEqual(self.products[0].stock_quantity, 48)
+        self.assertEqual(self.products[1].stock_quantity, 46)
+
+    def test_insufficient_stock_rolls_back(self):
+        Product.objects.filter(pk=self.products[0].pk).update(stock_quantity=1)
+        response = self.post_sale(self.products[:2])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Sale.objects.exists())
+        self.products[1].refresh_from_db()
+        self.assertEqual(self.products[1].stock_quantity, 50)
+
+
+class StockLedgerReferenceTests(TestCase):
+    def setUp(self):
+        _thread_locals.user = None # Sem usuário logado (evita herdar o usuário de outro teste)
+        self.product = Product.objects.create(name='Perfume', selling_price=100, stock_quantity=20)
+
+    def make_sale(self, status):
+        sale = Sale.objects.create(status=status, payment_method='credit')
+        sale.items.create(product=self.product, quantity=1, price=100)
+        return sale
+
+    def test_finalize_ignores_movements_of_other_sales(self):
+        # Antes, 'reason LIKE %#1%' também encontrava as baixas da venda #10, #11...
+        sales = [self.make_sale('pending') for _ in range(11)]
+        sales[-1].post_stock_exits(sales[-1].items.all())
+        sale = sales[0]
+        sale.status = 'completed'
+        sale.save()
+        sale.finalize()
+        self.assertTrue(StockMovement.objects.filter(sale=sale, source='sale').exists())
+
+    def test_delete_reverses_linked_movements(self):
+        sale = self.make_sale('completed')
+        sale.finalize()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 19)
+        self.assertTrue(sale.post_stock_reversal(f'Estorno/Exclusão Venda #{sale.pk}'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 20)
+
+    def test_item_removal_of_legacy_sale_is_structured(self):
+        # Venda antiga: sem movimentações vinculadas, o estorno vem dos próprios itens
+        sale = self.make_sale('completed')
+        sale.items.create(product=self.product, quantity=2, price=100)
+        item = sale.items.first()
+        self.client.force_login(User.objects.create_superuser('admin', password='123'))
+        self.client.get(reverse('delete_sale_item', args=[item.pk]))
+        movement = StockMovement.objects.get()
+        self.assertEqual(
+            (movement.movement_type, movement.quantity, movement.source, movement.sale_id),
+            ('E', 1, 'item_removal', sale.pk),
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 21)
+
+
+@local_cache
+class BarcodeCacheTests(TestCase):
+    def setUp(self):
+        _thread_locals.user = None
+        barcode_cache.clear()
+        self.addCleanup(barcode_cache.clear)
+        self.client.force_login(User.objects.create_user('caixa', password='123'))
+        self.product = Product.objects.create(name='Perfume', barcode='7891234567890', selling_price=100, cost_price=40, stock_quantity=2)
+
+    def scan(self, barcode='7891234567890'):
+        with mock.patch('sales.views.search_products', wraps=search_products) as search:
+            results = self.client.get(reverse('product_search_api'), {'q': barcode}).json()
+        return results, search.called
+
+    def sell(self, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            post_movements([StockMovement(product=self.product, quantity=quantity, movement_type='S')])
+
+    def test_hit_reads_stock_live(self):
+        results, searched = self.scan()
+        self.assertTrue(searched)
+        self.assertEqual((results[0]['name'], results[0]['stock']), ('Perfume', 2))
+
+        # Vendas não invalidam o cache: o estoque é lido na hora
+        version = get_catalog_version()
+        self.sell(2)
+        self.assertEqual(get_catalog_version(), version)
+        results, searched = self.scan()
+        self.assertFalse(searched)
+        self.assertEqual((results[0]['name'], results[0]['stock']), ('Perfume (ESGOTADO ⚠️)', 0))
+
+    def test_negative_entry_expires(self):
+        self.assertEqual(self.scan('7890000000000'), ([], True))
+        self.assertEqual(self.scan('7890000000000'), ([], False))
+        with mock.patch.object(barcode_cache, 'negative_ttl', -1):
+            barcode_cache.clear()
+            self.scan('7890000000000')
+            self.assertEqual(self.scan('7890000000000'), ([], True)) # Expirado: busca de novo
+
+    def test_edit_invalidates_after_commit(self):
+        self.scan()
+        version = get_catalog_version()
+        with self.assertRaises(RuntimeError), self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Product.objects.filter(pk=self.product.pk).get().save()
+                raise RuntimeError('edição desfeita')
+        self.assertEqual(get_catalog_version(), version)
+
+        self.product.selling_price = 120
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        results, searched = self.scan()
+        self.assertTrue(searched)
+        self.assertEqual(results[0]['price'], 120.0)
+
+
+@override_settings(POS_CHECKOUT_MODE='guarded')
+class GuardedCheckoutTests(SaveSaleBatchTests):
+    """Mesmos cenários do modo com trava, agora com a baixa condicional (sem SELECT FOR UPDATE)."""
+
+    def test_query_count_is_constant_in_cart_size(self):
+        # Aqui a baixa é um UPDATE condicional por produto: cresce exatamente 1 query por produto
+        for status in ['completed', 'pending']:
+            small = self.count_queries(self.products[:1], status)
+            large = self.count_queries(self.products[1:11], status)
+            self.assertEqual(large - small, 9, f'save_sale ({status}): uma baixa por produto')
+
+    def test_kit_without_component_stock_is_rejected(self):
+        Product.objects.filter(pk=self.products[1].pk).update(stock_quantity=1)
+        kit = Product.objects.create(name='Kit Presente', product_type='kit', selling_price=150)
+        ProductComponent.objects.create(kit=kit, component=self.products[0], quantity=1)
+        ProductComponent.objects.create(kit=kit, component=self.products[1], quantity=2)
+        response = self.post_sale([kit])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Produto 'Perfume 1' insuficiente! Estoque atual: 1", response.json()['message'])
+        self.assertFalse(Sale.objects.exists())
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock_quantity, 50)
+
+
+class GuardedStockConcurrencyTests(TransactionTestCase):
+    """Vários 'caixas' (threads) vendendo o mesmo produto ao mesmo tempo."""
+    STOCK = 20
+    TERMINALS = 8
+    SALES_PER_TERMINAL = 5
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite em memória não aceita escrita concorrente entre threads')
+
+    def test_concurrent_sales_never_oversell(self):
+        _thread_locals.user = None
+        product = Product.objects.create(name='Mais Vendido', selling_price=100, stock_quantity=self.STOCK)
+        barrier = threading.Barrier(self.TERMINALS)
+        results = {'sold': 0, 'out_of_stock': 0, 'errors': []}
+        lock = threading.Lock()
+
+        def terminal():
+            barrier.wait()
+            try:
+                for _ in range(self.SALES_PER_TERMINAL):
+                    try:
+                        post_movements([
+                            StockMovement(product_id=product.pk, quantity=1, movement_type='S', source='sale')
+                        ], guarded=True)
+                        outcome = 'sold'
+                    except OutOfStock:
+                        outcome = 'out_of_stock'
+                    with lock:
+                        results[outcome] += 1
+            except OperationalError as e:
+                with lock:
+                    results['errors'].append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=terminal) for _ in range(self.TERMINALS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results['errors'], [])
+        self.assertEqual(results['sold'], self.STOCK)
+        self.assertEqual(results['out_of_stock'], self.TERMINALS * self.SALES_PER_TERMINAL - self.STOCK)
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 0)
+        self.assertEqual(StockMovement.objects.filter(product=product).count(), self.STOCK)
+
+
+class AuditLogBufferTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('gerente', password='123')
+        _thread_locals.user = self.user
+        self.addCleanup(setattr, _thread_locals, 'user', None)
+        Product.objects.create(name='Perfume', selling_price=100, stock_quantity=5)
+
+    def test_diff_uses_loaded_state_and_single_insert(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with audit.audit_buffer():
+                product = Product.objects.get(name='Perfume')
+                product.selling_price = Decimal('120.00')
+                with CaptureQueriesContext(connection) as ctx:
+                    product.save()
+                    product.stock_quantity = 4
+                    product.save()
+                self.assertFalse(AuditLog.objects.exists()) # Ainda no buffer
+        # Nenhum SELECT extra para descobrir o estado anterior
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT')])
+        logs = list(AuditLog.objects.order_by('pk'))
+        self.assertEqual(len(logs), 2)
+        self.assertIn('selling_price: 100.00 ➔ 120.00', logs[0].changes)
+        self.assertEqual(logs[1].changes, 'stock_quantity: 5 ➔ 4')
+
+    def test_rolled_back_changes_are_not_logged(self):
+        with audit.audit_buffer():
+            try:
+                with transaction.atomic():
+                    Product.objects.create(name='Outro', selling_price=10)
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertFalse(AuditLog.objects.exists())
+
+    def test_opt_out(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with audit.audit_disabled():
+                Product.objects.create(name='Importado', selling_price=10)
+        self.assertFalse(AuditLog.objects.exists())
@@ -1,15 +1,20 @@
 # Importações de bibliotecas padrão e do Django
 import json
 import unicodedata
+from django.conf import settings
 from django.shortcuts import render
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import prefetch_related_objects
 from decimal import Decimal
 from .models import Sale, SaleItem
-from products.models import Product, StockMovement
+from products.models import Product
 from customers.models import Customer
+from core.search import search_by_key
+from products.ledger import OutOfStock
+from products.search import search_products, serialize_catalog, with_stock, RANK_EXACT_BARCODE
+from products.cache import barcode_cache, get_catalog_version, MISSING
 
 def normalize_str(s):
     """
@@ -32,67 +37,53 @@ def pos_view(request):
 def product_search_api(request):
     """
     API de Busca de Produtos: Otimizada para o PDV.
-    Utiliza normalização para permitir que 'Perfume' e 'perfume' ou 'Joao' e 'João' coincidam.
+    Utiliza o índice normalizado para permitir que 'Perfume' e 'perfume' ou 'Joao' e 'João' coincidam.
     Usada pelo Javascript do PDV para preencher a lista de pesquisa.
     """
     query = request.GET.get('q', '').strip()
     if not query:
         return JsonResponse([], safe=False)
 
-    # Se a busca for numérica (EAN-13), tentamos primeiro a busca EXATA (muito mais rápido para o leitor)
-    if query.isdigit() and len(query) >= 8:
-        products = Product.objects.select_related('brand').prefetch_related('components__component').filter(
-            barcode=query
-        )
-        # Se não achou exato, tenta parcial
-        if not products.exists():
-            products = Product.objects.select_related('brand').prefetch_related('components__component').filter(
-                barcode__icontains=query
-            )[:5]
-    else:
-        # Busca textual padrão por nome ou marca
-        products = Product.objects.select_related('brand').prefetch_related('components__component').filter(
-            Q(name__icontains=query) | 
-            Q(barcode__icontains=query) |
-            Q(brand__name__icontains=query)
-        )[:20]
+    # Se a busca for numérica (EAN-13), usamos o cache de código de barras (leitor a laser).
+    # O cache guarda só os dados do catálogo; o estoque é sempre lido na hora (pela chave primária).
+    is_barcode = query.isdigit() and len(query) >= 8
+    if is_barcode:
+        cached = barcode_cache.get(query)
+        if cached is None:
+            return JsonResponse([], safe=False)
+        if cached is not MISSING:
+            stock = Product.objects.filter(pk=cached['id']).values_list('stock_quantity', flat=True).first()
+            if stock is not None:
+                return JsonResponse([with_stock(cached, stock)], safe=False)
+        version = get_catalog_version()
+
+    # Busca ranqueada: código exato > prefixo > palavras (ver products/search.py)
+    products = list(
+        search_products(query).select_related('brand').prefetch_related('components__component')[:20]
+    )
+    # Leitor de código de barras: se achou o código EXATO, devolve só ele
+    if products and products[0].search_rank == RANK_EXACT_BARCODE:
+        products = products[:1]
     
-    results = []
-    for p in products:
-        components_list = []
-        # Lógica especial para Kits: Monta a lista de itens que compõem o kit
-        if p.product_type in ['kit', 'combo']:
-            for comp in p.components.all():
-                # Formata quantidade (tira .0 se for inteiro)
-                qty = int(comp.quantity) if comp.quantity % 1 == 0 else float(comp.quantity)
-                components_list.append(f"{qty}x {comp.component.name}")
-
-        # Monta o dicionário de dados para enviar ao Frontend
-        results.append({
-            'id': p.id,
-            # Adiciona alerta visual se estiver sem estoque (exceto Kits que são virtuais)
-            'name': p.name + (" (ESGOTADO ⚠️)" if p.stock_quantity <= 0 and p.product_type not in ['kit', 'combo'] else ""),
-            'price': float(p.selling_price),
-            'cost_price': float(p.cost_price),
-            'image': p.image.url if p.image else (p.image_url if p.image_url else ''),
-            'stock': p.stock_quantity,
-            'volume': p.volume,
-            'components': components_list
-        })
+    catalog = [serialize_catalog(p) for p in products]
+    results = [with_stock(data, p.stock_quantity) for data, p in zip(catalog, products)]
+
+    if is_barcode:
+        if len(products) == 1 and products[0].search_rank == RANK_EXACT_BARCODE:
+            barcode_cache.set(query, catalog[0], version)
+        elif not products:
+            barcode_cache.set(query, None, version) # Cache negativo (EAN desconhecido)
     return JsonResponse(results, safe=False)
 
 @login_required
 def customer_search_api(request):
-    """API para buscar clientes pelo nome ou CPF"""
+    """
+    API para buscar clientes pelo nome ou CPF.
+    A busca é feita na chave normalizada (search_key) direto no banco, com LIMIT,
+    então 'joao' encontra 'João' sem precisar carregar todos os clientes.
+    """
     query = request.GET.get('q', '')
-    query_norm = normalize_str(query)
-    
-    all_customers = Customer.objects.all()
-    customers = []
-    for c in all_customers:
-        if query_norm in normalize_str(c.name) or (c.cpf_cnpj and query_norm in normalize_str(c.cpf_cnpj)):
-            customers.append(c)
-            if len(customers) >= 10: break
+    customers = search_by_key(Customer.objects.only('id', 'name', 'cpf_cnpj'), query, limit=10)
     
     results = []
     for c in customers:
@@ -140,14 +131,36 @@ def save_sale(request):
                     )
 
                 # Validação de Estoque (Impede a venda se não houver saldo)
-                items_check = data.get('items', [])
-                for item in items_check:
-                    # TRAVA DE BANCO (Lock): select_for_update bloqueia esse registro
+                items = data.get('items', [])
+
+                # Soma as quantidades por produto (o mesmo item pode vir em mais de uma linha)
+                requested = {}
+                for item in items:
+                    requested[int(item['id'])] = requested.get(int(item['id']), 0) + int(item['quantity'])
+
+                # Modo de baixa de estoque (settings.POS_CHECKOUT_MODE):
+                #   'lock'    -> trava as linhas dos produtos (select_for_update) e valida o saldo antes.
+                #   'guarded' -> sem trava: a própria baixa só acontece se houver saldo
+                #                (UPDATE ... WHERE estoque >= qtd), inclusive nos componentes dos Kits.
+                guarded = getattr(settings, 'POS_CHECKOUT_MODE', 'lock') == 'guarded'
+
+                products = Product.objects.filter(id__in=requested.keys()).order_by('id')
+                if not guarded:
+                    # TRAVA DE BANCO (Lock): uma única query com select_for_update bloqueia todos os
+                    # produtos do carrinho (sempre na mesma ordem, por id, para evitar deadlock entre caixas)
                     # enquanto esta venda está sendo processada, evitando venda duplicada do mesmo item.
-                    prod_check = Product.objects.select_for_update().get(pk=item['id'])
-                    
+                    products = products.select_for_update()
+                locked_products = {p.pk: p for p in products}
+                # Componentes dos Kits (consulta separada, sem trava, só para leitura)
+                prefetch_related_objects(list(locked_products.values()), 'components__component')
+
+                for product_id, quantity in requested.items():
+                    prod_check = locked_products.get(product_id)
+                    if prod_check is None:
+                        raise Exception(f"Produto #{product_id} não encontrado.")
                     # Se não for kit e estoque for menor que o pedido, lança erro
-                    if prod_check.product_type not in ['kit', 'combo'] and prod_check.stock_quantity < item['quantity']:
+                    # (no modo 'guarded' quem decide é a baixa condicional, com o saldo real do banco)
+                    if not guarded and prod_check.product_type not in ['kit', 'combo'] and prod_check.stock_quantity < quantity:
                         raise Exception(f"Produto '{prod_check.name}' insuficiente! Estoque atual: {prod_check.stock_quantity}")
 
                 # --- Validação de Regras de Pagamento ---
@@ -165,8 +178,22 @@ def save_sale(request):
                 if status == 'pending' and payment_method not in ['credit', 'debit']:
                     raise Exception("Vendas com status 'Pendente' exigem a seleção de Cartão como forma de pagamento.")
 
-                # Cria o objeto Venda (Cabeçalho)
-                sale = Sale.objects.create(
+                # Monta os Itens da Venda em memória (preço informado pelo PDV)
+                sale_items = []
+                for item in items:
+                    price = to_decimal(item['price'])
+                    quantity = int(item['quantity'])
+                    product = locked_products[int(item['id'])]
+                    sale_items.append(SaleItem(
+                        product=product,
+                        quantity=quantity,
+                        price=price,
+                        subtotal=price * quantity,
+                        unit_cost=product.cost_price
+                    ))
+
+                # Cria o objeto Venda (Cabeçalho) já com o total calculado uma única vez
+                sale = Sale(
                     salesperson=request.user,
                     customer=customer_obj,
                     payment_method=data.get('payment_method'),
@@ -177,51 +204,26 @@ def save_sale(request):
                     tax_type=data.get('tax_type', 'fixed'),
                     status=data.get('status', 'pending')
                 )
+                sale.calculate_totals(sum(si.subtotal for si in sale_items))
+                sale.save()
+
+                # Grava todos os itens com um único INSERT
+                for si in sale_items:
+                    si.sale = sale
+                SaleItem.objects.bulk_create(sale_items)
                 
-                # Cria os Itens da Venda
-                items = data.get('items', [])
-                for item in items:
-                    SaleItem.objects.create(
-                        sale=sale,
-                        product_id=item['id'],
-                        quantity=item['quantity'],
-                        price=to_decimal(item['price'])
-                    )
-                    
-                sale.save() # Chama o método .save() do modelo para recalcular totais
-                
-                if sale.status == 'completed':
-                    # Se a venda foi finalizada, chama a função que dá baixa no estoque
-                    if hasattr(sale, 'finalize'):
-                        sale.finalize()
-                elif sale.status == 'pending':
-                    # Lógica para Venda Pendente (Reserva de Estoque)
-                    for item in items:
-                        product = Product.objects.get(pk=item['id'])
-                        
-                        # Se for Kit, precisa baixar os componentes internos
-                        if product.product_type == 'kit' or product.product_type == 'combo':
-                            components = product.components.all()
-                            if components.exists():
-                                for comp in components:
-                                    StockMovement.objects.create(
-                                        product=comp.component,
-                                        quantity=comp.quantity * item['quantity'],
-                                        movement_type='S',
-                                        reason=f'Venda Kit Pendente #{sale.id} ({product.name})'
-                                    )
-                                continue # Pula, pois o produto 'Kit' não tem estoque físico próprio
-                        
-                        # Baixa normal de produto simples
-                        StockMovement.objects.create(
-                            product=product,
-                            quantity=item['quantity'],
-                            movement_type='S',
-                            reason=f'Venda Pendente #{sale.id}'
-                        )
+                # Baixa de estoque em lote: Finalizada (saída) ou Pendente (reserva).
+                # A venda acabou de ser criada, então não há baixa anterior para conferir.
+                if sale.status in ['completed', 'pending']:
+                    sale.post_stock_exits(sale_items, guarded=guarded)
                 
                 # Retorna sucesso para o Javascript
                 return JsonResponse({'status': 'success', 'sale_id': sale.id})
+        except OutOfStock as e:
+            # Fora da transação (já desfeita): nome e saldo atual para a mensagem do caixa
+            product = Product.objects.filter(pk=e.product_id).values('name', 'stock_quantity').first()
+            message = str(e) if product is None else f"Produto '{product['name']}' insuficiente! Estoque atual: {product['stock_quantity']}"
+            return JsonResponse({'status': 'error', 'message': message}, status=400)
         except Exception as e:
             # Em caso de erro, retorna mensagem e status 400 (Bad Request)
             return JsonResponse({'status': 'error', 'message': str(e)}, status=400)